@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memória do catálogo: dicionários por livro x BookRecord
+
+Gera um catálogo sintético e mede, com tracemalloc, a memória ocupada por
+um livro no formato antigo (um dicionário com strings ISO e ID hexadecimal)
+e no formato atual (BookRecord com __slots__ e strings internadas).
+
+Uso:
+    python benchmarks/catalog_memory.py [-books 100000]
+"""
+
+import argparse
+import gc
+import hashlib
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from opds_catalog import MIME_TYPES, BookRecord
+
+
+def synthetic_files(count, seed=42):
+    """
+    Gera descrições de arquivos com a distribuição de uma biblioteca real.
+
+    Poucas categorias, alguns milhares de autores e títulos únicos; cada
+    chamada cria strings novas, como faria a leitura do disco.
+    """
+    rng = random.Random(seed)
+    categories = [f'Categoria {i}' for i in range(40)]
+    authors = [f'Autor {i}' for i in range(max(1, count // 20))]
+    extensions = ['.epub', '.pdf', '.cbz', '.mobi', '.fb2']
+    base = 1_700_000_000_000_000_000
+    for i in range(count):
+        # ''.join força uma string nova, como os nomes lidos com os.scandir
+        category = ''.join(rng.choice(categories))
+        author = ''.join(rng.choice(authors))
+        extension = ''.join(rng.choice(extensions))
+        title = f'Livro número {i} de {author}'
+        path = os.path.join(category, author, title + extension)
+        yield title, author, category, path, rng.randint(10_000, 50_000_000), base + i * 1_000_003, extension
+
+
+def as_dict(title, author, category, path, size, mtime_ns, extension):
+    """Registro no formato antigo (um dicionário por livro)."""
+    return {
+        'title': title,
+        'author': author,
+        'authors': [author],
+        'series': None,
+        'series_index': None,
+        'language': None,
+        'description': None,
+        'category': category,
+        'file_path': path,
+        'file_size': size,
+        'modified': datetime.fromtimestamp(mtime_ns / 1e9).isoformat() + 'Z',
+        'extension': extension,
+        'mime_type': MIME_TYPES.get(extension, 'application/octet-stream'),
+        'id': hashlib.md5(path.encode()).hexdigest(),
+    }
+
+
+def as_record(title, author, category, path, size, mtime_ns, extension):
+    """Registro no formato atual (BookRecord)."""
+    return BookRecord(
+        digest=hashlib.md5(path.encode()).digest(),
+        title=title,
+        authors=[author],
+        category=category,
+        file_path=path,
+        file_size=size,
+        mtime_ns=mtime_ns,
+        extension=extension,
+    )
+
+
+def measure(factory, count):
+    """
+    Mede a memória e o tempo para montar um catálogo com ``factory``.
+
+    Returns:
+        Tupla (bytes alocados e mantidos, segundos)
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    books = [factory(*item) for item in synthetic_files(count)]
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del books
+    return current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara a memória do catálogo em dicionários e BookRecord')
+    parser.add_argument('-books', '--books', type=int, default=100_000, help='Quantidade de livros (padrão: 100000)')
+    args = parser.parse_args()
+
+    print(f"Catálogo sintético com {args.books} livros")
+    results = {}
+    for name, factory in (('dict', as_dict), ('BookRecord', as_record)):
+        memory, elapsed = measure(factory, args.books)
+        results[name] = memory
+        print(
+            f"  {name:<11} {memory / 1024 / 1024:8.1f} MB  "
+            f"{memory / args.books:6.0f} bytes/livro  {elapsed:6.2f}s"
+        )
+
+    print(f"  Redução: {100 * (1 - results['BookRecord'] / results['dict']):.0f}%")
+
+
+if __name__ == '__main__':
+    main()
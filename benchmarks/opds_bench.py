@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Suíte de benchmarks reproduzível com gerador de bibliotecas sintéticas
+
+Gera uma biblioteca sintética (arquivos esparsos, então milhares de livros
+de vários MB ocupam quase nada em disco), mede o escaneamento, a geração do
+XML e a latência e vazão do servidor HTTP sob carga concorrente, e grava
+os resultados em JSON para comparar versões.
+
+Uso:
+    python benchmarks/opds_bench.py [-books 10000] [-depth 3] [-clients 8]
+                                    [-output resultados.json]
+
+A mesma semente (``-seed``) sempre gera a mesma biblioteca e a mesma
+sequência de requisições.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from opds_generator import OPDSGenerator
+from opds_logging import setup_logging
+from opds_server import OPDSServer, ThreadPoolHTTPServer
+
+
+# Partes de nomes usadas na biblioteca sintética (com e sem acentos e
+# caracteres fora do latim, para exercitar a codificação das URLs)
+ASCII_WORDS = ['Livro', 'Historia', 'Guia', 'Manual', 'Cronicas', 'Contos', 'Volume', 'Tratado']
+UNICODE_WORDS = ['Ação', 'Coração', 'Müller', 'Ñandú', 'Ελληνικά', 'Русский', '日本語', '한국어', 'Café & Chá', '«Citação»']
+EXTENSIONS = ['.epub', '.pdf', '.cbz', '.mobi', '.fb2', '.txt']
+
+
+def make_library(root, books, depth=2, categories=20, authors=50, unicode_ratio=0.3,
+                 min_size=100 * 1024, max_size=5 * 1024 * 1024, seed=42):
+    """
+    Cria uma biblioteca sintética com arquivos esparsos.
+
+    Args:
+        root: Diretório onde a biblioteca é criada
+        books: Quantidade de livros
+        depth: Níveis de diretórios abaixo da raiz (1 = só categorias;
+               2 = categoria/autor; mais níveis viram subpastas de série)
+        categories: Quantidade de categorias (diretórios do primeiro nível)
+        authors: Autores por categoria
+        unicode_ratio: Fração dos nomes com caracteres não ASCII
+        min_size: Tamanho mínimo dos arquivos em bytes
+        max_size: Tamanho máximo dos arquivos em bytes
+        seed: Semente do gerador de números aleatórios
+
+    Returns:
+        Lista de caminhos relativos dos livros criados
+    """
+    rng = random.Random(seed)
+
+    def name(prefix, number):
+        words = UNICODE_WORDS if rng.random() < unicode_ratio else ASCII_WORDS
+        return f'{prefix} {rng.choice(words)} {number}'
+
+    category_names = [name('Categoria', i) for i in range(categories)]
+    author_names = [[name('Autor', j) for j in range(authors)] for _ in range(categories)]
+
+    paths = []
+    created = set()
+    for i in range(books):
+        c = rng.randrange(categories)
+        parts = [category_names[c]]
+        if depth >= 2:
+            parts.append(author_names[c][rng.randrange(authors)])
+        for level in range(2, depth):
+            parts.append(f'Série {level - 1}.{rng.randrange(5)}')
+        directory = os.path.join(root, *parts)
+        if directory not in created:
+            os.makedirs(directory, exist_ok=True)
+            created.add(directory)
+
+        relative = os.path.join(*parts, name('Título', i) + rng.choice(EXTENSIONS))
+        with open(os.path.join(root, relative), 'wb') as f:
+            # Arquivo esparso: o tamanho aparece no stat, mas não ocupa disco
+            f.truncate(rng.randint(min_size, max_size))
+        paths.append(relative)
+    return paths
+
+
+def timed(function, *args, repeat=1, **kwargs):
+    """
+    Executa uma função ``repeat`` vezes.
+
+    Returns:
+        Tupla (resultado da última execução, lista de durações em segundos)
+    """
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+    return result, durations
+
+
+def summarize(durations):
+    """Resume uma lista de durações (em milissegundos)."""
+    ordered = sorted(durations)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'min_ms': ordered[0] * 1000,
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def bench_catalog(library, cache_dir, page_size):
+    """
+    Mede o escaneamento e a geração do XML.
+
+    Returns:
+        Tupla (gerador com o catálogo carregado, dicionário de resultados)
+    """
+    generator = OPDSGenerator(library, '127.0.0.1', 0, page_size=page_size,
+                              cache_dir=cache_dir, extract_metadata=False, covers=False)
+
+    books, cold = timed(generator.scan_books)
+    generator.update_catalog(books, generator.last_delta)
+    # Sem mudanças no disco: apenas os mtimes dos diretórios são conferidos
+    _, warm = timed(generator.scan_books, repeat=3)
+
+    xml, durations = timed(generator.generate_opds_xml, books, 'http://127.0.0.1:8080', repeat=3)
+
+    results = {
+        'books': len(books),
+        'scan_cold_s': cold[0],
+        'scan_warm_s': min(warm),
+        'generate_opds_xml_s': min(durations),
+        'generate_opds_xml_bytes': len(xml.encode('utf-8')),
+    }
+    return generator, results
+
+
+def load_worker(port, paths, requests, seed, latencies, sizes, errors):
+    """
+    Cliente de carga: faz requisições em uma conexão keep-alive.
+
+    Args:
+        port: Porta do servidor
+        paths: Caminhos possíveis das requisições
+        requests: Quantidade de requisições a fazer
+        seed: Semente da escolha dos caminhos
+        latencies: Lista onde as durações são acumuladas
+        sizes: Lista onde os tamanhos dos corpos são acumulados
+        errors: Lista onde os erros são acumulados
+    """
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    for _ in range(requests):
+        path = rng.choice(paths)
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                errors.append(f'{response.status} {path}')
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(f'{type(e).__name__} {path}')
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(body))
+    connection.close()
+
+
+def bench_http(generator, library, paths, clients, requests, workers, seed):
+    """
+    Mede latência e vazão do servidor sob carga concorrente.
+
+    Args:
+        generator: OPDSGenerator com o catálogo carregado
+        library: Diretório da biblioteca
+        paths: Dicionário nome do cenário -> lista de caminhos requisitados
+        clients: Quantidade de clientes simultâneos
+        requests: Requisições por cliente em cada cenário
+        workers: Workers do servidor
+        seed: Semente da escolha dos caminhos
+
+    Returns:
+        Dicionário de resultados por cenário
+    """
+    opds_server = OPDSServer(library, generator, '127.0.0.1', 0, workers=workers)
+    httpd = ThreadPoolHTTPServer(('127.0.0.1', 0), opds_server.handler, workers=workers,
+                                 queue_size=max(32, clients * 2))
+    port = httpd.server_address[1]
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    server_thread.start()
+
+    results = {}
+    try:
+        for scenario, scenario_paths in paths.items():
+            latencies, sizes, errors = [], [], []
+            threads = [
+                threading.Thread(
+                    target=load_worker,
+                    args=(port, scenario_paths, requests, seed + i, latencies, sizes, errors)
+                )
+                for i in range(clients)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            result = summarize(latencies) if latencies else {'count': 0}
+            result.update({
+                'errors': len(errors),
+                'requests_per_s': len(latencies) / elapsed,
+                'megabytes_per_s': sum(sizes) / elapsed / 1024 / 1024,
+            })
+            results[scenario] = result
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    return results
+
+
+def git_revision():
+    """Revisão atual do repositório (ou None fora de um clone git)."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks do opds-gen com uma biblioteca sintética')
+    parser.add_argument('-books', '--books', type=int, default=10_000, help='Quantidade de livros (padrão: 10000)')
+    parser.add_argument('-depth', '--depth', type=int, default=2,
+                        help='Níveis de diretórios: 1 = categorias, 2 = categoria/autor, 3+ = séries (padrão: 2)')
+    parser.add_argument('-categories', '--categories', type=int, default=20, help='Categorias (padrão: 20)')
+    parser.add_argument('-authors', '--authors', type=int, default=50, help='Autores por categoria (padrão: 50)')
+    parser.add_argument('-unicode', '--unicode', type=float, default=0.3,
+                        help='Fração dos nomes com caracteres não ASCII (padrão: 0.3)')
+    parser.add_argument('-min-size', '--min-size', type=int, default=100, help='Tamanho mínimo dos livros em KB (padrão: 100)')
+    parser.add_argument('-max-size', '--max-size', type=int, default=5120, help='Tamanho máximo dos livros em KB (padrão: 5120)')
+    parser.add_argument('-clients', '--clients', type=int, default=8, help='Clientes HTTP simultâneos (padrão: 8)')
+    parser.add_argument('-requests', '--requests', type=int, default=200,
+                        help='Requisições por cliente em cada cenário (padrão: 200)')
+    parser.add_argument('-workers', '--workers', type=int, default=8, help='Workers do servidor (padrão: 8)')
+    parser.add_argument('-page-size', '--page-size', type=int, default=50, help='Livros por página dos feeds (padrão: 50)')
+    parser.add_argument('-seed', '--seed', type=int, default=42, help='Semente da biblioteca e das requisições (padrão: 42)')
+    parser.add_argument('-library', '--library', default=None,
+                        help='Diretório da biblioteca sintética (padrão: temporário, removido ao final)')
+    parser.add_argument('-output', '--output', default=None, help='Arquivo JSON de resultados (padrão: saída padrão)')
+    args = parser.parse_args()
+
+    setup_logging('warning', stream=sys.stderr)
+
+    workdir = tempfile.mkdtemp(prefix='opds-bench-')
+    library = args.library or os.path.join(workdir, 'biblioteca')
+    try:
+        print(f"Gerando biblioteca sintética com {args.books} livros em {library}...", file=sys.stderr)
+        paths, durations = timed(
+            make_library, library, args.books, depth=args.depth, categories=args.categories,
+            authors=args.authors, unicode_ratio=args.unicode, min_size=args.min_size * 1024,
+            max_size=args.max_size * 1024, seed=args.seed
+        )
+        print(f"  biblioteca criada em {durations[0]:.1f}s", file=sys.stderr)
+
+        print("Medindo escaneamento e geração do XML...", file=sys.stderr)
+        generator, catalog = bench_catalog(library, workdir, args.page_size)
+
+        rng = random.Random(args.seed)
+        index = generator.catalog_index
+        pages = max(1, -(-len(index.books) // args.page_size))
+        sample = rng.sample(index.books, min(len(index.books), 500))
+        scenarios = {
+            'opds_root': ['/opds'],
+            'opds_pages': [f'/opds/all?page={page}' for page in range(1, min(pages, 50) + 1)],
+            'books_legacy': [f'/books/{urllib.parse.quote(book.file_path)}' for book in sample],
+            'books_download': [
+                f'/download/{book.id}/{urllib.parse.quote(os.path.basename(book.file_path))}' for book in sample
+            ],
+        }
+        print(f"Medindo HTTP com {args.clients} clientes simultâneos...", file=sys.stderr)
+        http_results = bench_http(generator, library, scenarios, args.clients, args.requests,
+                                  args.workers, args.seed)
+
+        report = {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': vars(args),
+            'catalog': catalog,
+            'http': http_results,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"Resultados gravados em {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,22 @@ OPDS Generator - Sistema de geração de feed OPDS para KOReader
 """
 
 import argparse
+import logging
 import os
+import signal
 import sys
 import threading
 import time
 from pathlib import Path
 
 from opds_generator import OPDSGenerator
+from opds_logging import LOG_LEVELS, setup_logging
+from opds_prefork import PreforkWorkers, fork_process, prefork_supported, stop_processes
 from opds_server import OPDSServer
+from opds_watcher import LibraryWatcher
+
+
+logger = logging.getLogger('opds.main')
 
 
 def parse_arguments():
@@ -23,7 +31,10 @@ def parse_arguments():
         '-dir',
         '--directory',
         required=True,
-        help='Diretório contendo os livros'
+        action='append',
+        help='Diretório contendo os livros; repita a opção para servir várias raízes '
+             '(ex.: -dir livros=/mnt/livros -dir quadrinhos=/mnt/hq) em um único catálogo, '
+             'cada uma escaneada separadamente (padrão do nome: o nome do diretório)'
     )
     parser.add_argument(
         '-port',
@@ -45,79 +56,469 @@ def parse_arguments():
         default='0.0.0.0',
         help='Host para o servidor HTTP (padrão: 0.0.0.0)'
     )
+    parser.add_argument(
+        '-workers',
+        '--workers',
+        type=int,
+        default=8,
+        help='Número de conexões atendidas em paralelo; 0 usa o servidor de thread única (padrão: 8)'
+    )
+    parser.add_argument(
+        '-processes',
+        '--processes',
+        type=int,
+        default=1,
+        help='Processos de atendimento escutando na mesma porta (SO_REUSEPORT), cada um com '
+             '-workers threads; o processo principal apenas escaneia a biblioteca (padrão: 1)'
+    )
+    parser.add_argument(
+        '-queue-size',
+        '--queue-size',
+        type=int,
+        default=32,
+        help='Máximo de conexões aguardando um worker livre antes de responder 503 (padrão: 32)'
+    )
+    parser.add_argument(
+        '-keepalive-timeout',
+        '--keepalive-timeout',
+        type=int,
+        default=15,
+        help='Segundos de inatividade antes de fechar conexões keep-alive (padrão: 15)'
+    )
+    parser.add_argument(
+        '-scan-workers',
+        '--scan-workers',
+        type=int,
+        default=0,
+        help='Threads que listam diretórios em paralelo no escaneamento, também o máximo '
+             'de operações simultâneas no disco; útil em NFS/SMB (padrão: 0, escaneamento serial)'
+    )
+    parser.add_argument(
+        '-move-hash',
+        '--move-hash',
+        action='store_true',
+        help='Reconhece também pelo conteúdo (início e fim de cada arquivo) os livros movidos '
+             'que mudaram de inode, como cópias entre discos; lê parte de cada livro novo'
+    )
+    parser.add_argument(
+        '-compact-xml',
+        '--compact-xml',
+        action='store_true',
+        help='Gera os feeds OPDS sem indentação (menores e mais rápidos de gerar)'
+    )
+    parser.add_argument(
+        '-page-size',
+        '--page-size',
+        type=int,
+        default=50,
+        help='Quantidade de livros por página nos feeds de aquisição (padrão: 50)'
+    )
+    parser.add_argument(
+        '-watch',
+        '--watch',
+        action='store_true',
+        help='Detecta mudanças na biblioteca com inotify (Linux) em vez de reescanear '
+             'periodicamente; volta ao reescaneamento se o inotify não estiver disponível'
+    )
+    parser.add_argument(
+        '-cache-dir',
+        '--cache-dir',
+        default=None,
+        help='Diretório para os caches persistentes (padrão: o diretório de livros)'
+    )
+    parser.add_argument(
+        '-no-metadata',
+        '--no-metadata',
+        action='store_true',
+        help='Não lê metadados de dentro dos arquivos (usa apenas nomes de arquivos e pastas)'
+    )
+    parser.add_argument(
+        '-metadata-workers',
+        '--metadata-workers',
+        type=int,
+        default=None,
+        help='Processos para extração de metadados; 0 extrai no processo principal '
+             '(padrão: número de CPUs)'
+    )
+    parser.add_argument(
+        '-no-covers',
+        '--no-covers',
+        action='store_true',
+        help='Não oferece capas e miniaturas extraídas dos livros'
+    )
+    parser.add_argument(
+        '-cover-cache-size',
+        '--cover-cache-size',
+        type=int,
+        default=256,
+        help='Tamanho máximo do cache de capas em disco, em MB (padrão: 256)'
+    )
+    parser.add_argument(
+        '-page-cache-size',
+        '--page-cache-size',
+        type=int,
+        default=64,
+        help='Tamanho máximo do cache em memória de páginas de quadrinhos (CBZ) servidas '
+             'por streaming, em MB; 0 desativa o streaming de páginas (padrão: 64)'
+    )
+    parser.add_argument(
+        '-open-files',
+        '--open-files',
+        type=int,
+        default=64,
+        help='Livros mantidos abertos para downloads repetidos, sem reabrir o arquivo; '
+             '0 abre o arquivo a cada download (padrão: 64)'
+    )
+    parser.add_argument(
+        '-log-level',
+        '--log-level',
+        choices=list(LOG_LEVELS),
+        default='info',
+        help='Nível mínimo do log: debug inclui o rastreamento de cada requisição, '
+             'warning omite também o log de acesso (padrão: info)'
+    )
     
     return parser.parse_args()
 
 
-def rescan_books_periodically(generator, interval):
+def parse_libraries(directories):
+    """
+    Interpreta as raízes da biblioteca passadas em ``-dir``.
+    
+    Cada valor é ``diretório`` ou ``nome=diretório``. Uma raiz sozinha não
+    tem nome (os IDs dos livros são os de sempre); com várias, as raízes
+    sem nome usam o nome do diretório.
+    
+    Args:
+        directories: Valores de ``-dir``, na ordem da linha de comando
+    
+    Returns:
+        Lista de tuplas (nome, Path)
+    """
+    libraries = []
+    for value in directories:
+        name, separator, path = value.partition('=')
+        if not separator or not name or not path or '/' in name or os.sep in name:
+            name, path = '', value
+        libraries.append((name, Path(path)))
+    
+    if len(libraries) == 1:
+        return [('', libraries[0][1])]
+    return [(name or path.absolute().name, path) for name, path in libraries]
+
+
+def rescan_books_periodically(generator, library, interval):
     """
-    Thread que reescaneia o diretório de livros periodicamente.
+    Thread que reescaneia uma raiz da biblioteca periodicamente.
     
     O OPDS é gerado dinamicamente a cada requisição, mas precisamos
     reescanear os livros para detectar novos arquivos ou remoções.
     
     Args:
         generator: Instância do OPDSGenerator
+        library: Nome da raiz
         interval: Intervalo em segundos entre escaneamentos
     """
+    path = generator.get_library(library).path
     while True:
         time.sleep(interval)
-        print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] Reescaneando diretório de livros...")
+        logger.info("Reescaneando diretório de livros %s...", path)
         try:
-            generator.generate()
-            print(f"Escaneamento concluído! {len(generator.books_cache)} livros encontrados.")
-        except Exception as e:
-            print(f"Erro ao escanear livros: {e}")
+            generator.generate(library)
+            logger.info("Escaneamento concluído! %d livros no catálogo.", len(generator.books_cache))
+        except Exception:
+            logger.exception("Erro ao escanear livros de %s", path)
+
+
+def watch_library(generator, library, interval):
+    """
+    Thread que aplica as mudanças detectadas pelo inotify em uma raiz.
+    
+    Os watches são registrados aqui, depois do primeiro escaneamento, para
+    que percorrer a árvore de uma montagem lenta não atrase o início do
+    servidor nem as demais raízes. Se o inotify não estiver disponível, ou
+    o limite de watches for atingido, volta ao reescaneamento periódico.
+    
+    Args:
+        generator: Instância do OPDSGenerator
+        library: Nome da raiz
+        interval: Intervalo em segundos para o reescaneamento de reserva
+    """
+    watcher = LibraryWatcher(generator, library=library)
+    if watcher.start():
+        watcher.run()
+    logger.info("Usando reescaneamento periódico em %s (intervalo: %ds)", watcher.root, interval)
+    rescan_books_periodically(generator, library, interval)
+
+
+def initial_scan(next_step, generator, library, *args):
+    """
+    Thread que faz o primeiro escaneamento de uma raiz da biblioteca.
+    
+    O servidor já atende enquanto isso: com o catálogo restaurado do
+    snapshot (que é revalidado) ou, sem snapshot, com o catálogo parcial
+    publicado em lotes durante o escaneamento. Depois segue para o
+    monitoramento normal. Cada raiz tem a própria thread, então uma
+    montagem lenta não atrasa as demais.
+    
+    Args:
+        next_step: Função de monitoramento a executar em seguida
+        generator: Instância do OPDSGenerator
+        library: Nome da raiz
+        *args: Argumentos adicionais de ``next_step``
+    """
+    root = generator.get_library(library)
+    restored = root.books is not None
+    logger.info("Revalidando o catálogo restaurado de %s..." if restored
+                else "Escaneando %s pela primeira vez...", root.path)
+    try:
+        generator.generate(library)
+        logger.info("%s! %d livros no catálogo.",
+                    'Revalidação concluída' if restored else 'Escaneamento concluído', len(generator.books_cache))
+    except Exception:
+        logger.exception("Erro ao escanear livros de %s", root.path)
+    next_step(generator, library, *args)
+
+
+def follow_published_catalog(generator, catalog_file, interval=0.5):
+    """
+    Thread de um processo de atendimento que acompanha o catálogo publicado.
+    
+    Se o processo supervisor terminar sem encerrar este processo (ex.: morto
+    com SIGKILL), o processo de atendimento se encerra como com SIGTERM.
+    
+    Args:
+        generator: Instância do OPDSGenerator do processo de atendimento
+        catalog_file: Arquivo onde o processo principal publica o catálogo
+        interval: Intervalo em segundos entre verificações
+    """
+    supervisor = os.getppid()
+    while os.getppid() == supervisor:
+        try:
+            if generator.follow_catalog(catalog_file):
+                logger.debug("Catálogo publicado carregado: %d livros", len(generator.books_cache))
+        except Exception:
+            logger.exception("Erro ao carregar o catálogo publicado")
+        time.sleep(interval)
+    logger.warning("Processo supervisor terminou; encerrando o processo de atendimento %d", os.getpid())
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def serve_worker(slot, args, make_generator, catalog_file):
+    """
+    Processo de atendimento do modo multiprocesso.
+    
+    Cada processo tem seu próprio gerador (sem escaneamento) que acompanha
+    o catálogo publicado pelo processo principal, e seu próprio socket na
+    porta do servidor (SO_REUSEPORT).
+    
+    Args:
+        slot: Número do processo (a partir de 0)
+        args: Argumentos da linha de comando
+        make_generator: Função que cria um OPDSGenerator
+        catalog_file: Arquivo onde o processo principal publica o catálogo
+    """
+    # As threads do processo principal (inclusive a do log) não existem no filho
+    listener = setup_logging(args.log_level)
+    try:
+        generator = make_generator(extract_metadata=False)
+        generator.follow_catalog(catalog_file)
+        threading.Thread(
+            target=follow_published_catalog, args=(generator, catalog_file), daemon=True
+        ).start()
+        
+        server = OPDSServer(
+            generator.books_dir,
+            generator,
+            args.host,
+            args.port,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            keepalive_timeout=args.keepalive_timeout,
+            reuse_port=True
+        )
+        logger.debug("Processo de atendimento %d iniciado (pid %d)", slot, os.getpid())
+        server.start(banner=False)
+    finally:
+        listener.stop()
+
+
+def supervise_workers(workers, log_level):
+    """
+    Processo supervisor do modo multiprocesso.
+    
+    Criado antes de qualquer thread do processo principal, cria e recria os
+    processos de atendimento sem o risco de um filho herdar um lock seguro
+    por uma thread de escaneamento. A thread do log, a única deste processo,
+    é parada durante cada fork.
+    
+    Args:
+        workers: PreforkWorkers dos processos de atendimento
+        log_level: Nível do log
+    """
+    listener = setup_logging(log_level)
+    workers.before_fork = listener.stop
+    workers.after_fork = listener.start
+    try:
+        workers.run()
+    finally:
+        listener.stop()
 
 
 def main():
     """Função principal."""
     args = parse_arguments()
     
-    # Validar diretório
-    books_dir = Path(args.directory)
-    if not books_dir.exists():
-        print(f"Erro: Diretório '{args.directory}' não existe!", file=sys.stderr)
+    # Validar diretórios
+    libraries = parse_libraries(args.directory)
+    names = [name for name, _ in libraries]
+    if len(set(names)) != len(names):
+        print("Erro: Nomes de biblioteca repetidos (use -dir nome=diretório)", file=sys.stderr)
         sys.exit(1)
     
-    if not books_dir.is_dir():
-        print(f"Erro: '{args.directory}' não é um diretório!", file=sys.stderr)
-        sys.exit(1)
+    for name, books_dir in libraries:
+        if not books_dir.exists():
+            # Com várias raízes, uma montagem indisponível não impede as demais
+            if len(libraries) > 1:
+                print(f"Aviso: Diretório '{books_dir}' ({name}) não está acessível; "
+                      f"será escaneado quando estiver disponível", file=sys.stderr)
+                continue
+            print(f"Erro: Diretório '{books_dir}' não existe!", file=sys.stderr)
+            sys.exit(1)
+        
+        if not books_dir.is_dir():
+            print(f"Erro: '{books_dir}' não é um diretório!", file=sys.stderr)
+            sys.exit(1)
+
+    if args.cache_dir:
+        Path(args.cache_dir).mkdir(parents=True, exist_ok=True)
     
     print("=" * 60)
     print("OPDS Generator - Sistema de geração de feed OPDS")
     print("=" * 60)
-    print(f"Diretório de livros: {books_dir.absolute()}")
+    if len(libraries) == 1:
+        print(f"Diretório de livros: {libraries[0][1].absolute()}")
+    else:
+        print("Bibliotecas:")
+        for name, books_dir in libraries:
+            print(f"  {name}: {books_dir.absolute()}")
+    if args.cache_dir:
+        print(f"Diretório de cache: {Path(args.cache_dir).absolute()}")
     print(f"Servidor HTTP: http://{args.host}:{args.port}")
     print(f"Intervalo de reescaneamento: {args.interval} segundos")
+    print(f"Workers HTTP: {args.workers if args.workers > 0 else 'thread única'}")
+    if args.processes > 1 and not prefork_supported():
+        print("Modo multiprocesso indisponível nesta plataforma (requer fork e SO_REUSEPORT); "
+              "usando um processo.")
+        args.processes = 1
+    if args.processes > 1:
+        print(f"Processos de atendimento: {args.processes}")
+    print(f"Nível de log: {args.log_level}")
     print("=" * 60)
     
     # Criar gerador OPDS
-    generator = OPDSGenerator(books_dir, args.host, args.port)
+    def make_generator(**overrides):
+        options = dict(
+            pretty=not args.compact_xml,
+            page_size=args.page_size,
+            cache_dir=args.cache_dir,
+            extract_metadata=not args.no_metadata,
+            metadata_workers=args.metadata_workers,
+            covers=not args.no_covers,
+            cover_cache_size=args.cover_cache_size * 1024 * 1024,
+            page_cache_size=args.page_cache_size * 1024 * 1024,
+            open_files=args.open_files,
+            scan_workers=args.scan_workers,
+            move_hash=args.move_hash
+        )
+        options.update(overrides)
+        return OPDSGenerator(libraries, args.host, args.port, **options)
     
-    # Gerar OPDS inicial
-    print("\nEscaneando livros pela primeira vez...")
-    try:
-        generator.generate()
-        print(f"Escaneamento concluído! {len(generator.books_cache)} livros encontrados.")
-    except Exception as e:
-        print(f"Erro ao escanear livros: {e}", file=sys.stderr)
-        sys.exit(1)
+    # Modo multiprocesso: os processos de atendimento acompanham o catálogo
+    # que este processo publica. Eles são criados por um processo supervisor
+    # separado antes de qualquer thread (inclusive a do log) existir aqui
+    supervisor = None
+    if args.processes > 1:
+        catalog_file = Path(args.cache_dir or libraries[0][1]) / '.opds_catalog.published'
+        # Uma versão de outra execução não deve ser servida nem por um instante
+        for stale in (catalog_file, Path(OPDSGenerator.scan_metrics_file(catalog_file))):
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+        workers = PreforkWorkers(
+            args.processes,
+            lambda slot: serve_worker(slot, args, make_generator, catalog_file)
+        )
+        sys.stdout.flush()
+        supervisor = fork_process(supervise_workers, workers, args.log_level)
     
-    # Iniciar thread de reescaneamento periódico
-    rescan_thread = threading.Thread(
-        target=rescan_books_periodically,
-        args=(generator, args.interval),
-        daemon=True
-    )
-    rescan_thread.start()
-    print(f"\nThread de reescaneamento iniciada (intervalo: {args.interval}s)")
+    setup_logging(args.log_level)
+    generator = make_generator()
+    if supervisor is not None:
+        generator.catalog_file = catalog_file
+    
+    # Restaurar o catálogo da última execução; o escaneamento roda em segundo
+    # plano e o servidor começa a atender imediatamente
+    if generator.load_snapshot():
+        print(f"\nCatálogo restaurado do snapshot: {len(generator.books_cache)} livros "
+              f"(revalidando em segundo plano)")
+    else:
+        print("\nSem snapshot do catálogo: os livros serão publicados em lotes durante o escaneamento")
+    
+    # Cada raiz é escaneada e monitorada pela própria thread: uma montagem
+    # lenta ou indisponível não atrasa as demais
+    print()
+    for library in generator.roots:
+        label = f" ({library})" if library else ''
+        # Monitorar a raiz com inotify, se solicitado e disponível
+        if args.watch:
+            monitor = watch_library
+        else:
+            monitor = rescan_books_periodically
+        
+        # O primeiro escaneamento roda na mesma thread, antes do monitoramento
+        rescan_thread = threading.Thread(target=initial_scan,
+                                         args=(monitor, generator, library, args.interval), daemon=True)
+        rescan_thread.start()
+        if args.watch:
+            print(f"Monitoramento da biblioteca com inotify iniciado após o primeiro escaneamento{label}")
+        else:
+            print(f"Thread de reescaneamento iniciada{label} (intervalo: {args.interval}s)")
     print("O feed OPDS é gerado dinamicamente a cada requisição com URLs personalizadas.")
     
+    if supervisor is not None:
+        print(f"\nServidor OPDS rodando em http://{args.host}:{args.port} com {args.processes} processos")
+        print(f"Feed OPDS disponível em: http://{args.host}:{args.port}/opds")
+        print("\nPressione Ctrl+C para encerrar o servidor\n")
+        # SIGTERM (ex.: systemctl stop) encerra os processos de atendimento como o Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            os.waitpid(supervisor, 0)
+            logger.error("O processo supervisor terminou inesperadamente")
+            code = 1
+        except KeyboardInterrupt:
+            print("\n\nEncerrando servidor...")
+            code = 0
+        finally:
+            # O supervisor espera até 15s pelos processos de atendimento
+            stop_processes([supervisor], 20)
+        sys.exit(code)
+    
     # Iniciar servidor HTTP
     print(f"\nIniciando servidor HTTP em {args.host}:{args.port}...")
-    server = OPDSServer(books_dir, generator, args.host, args.port)
+    server = OPDSServer(
+        generator.books_dir,
+        generator,
+        args.host,
+        args.port,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        keepalive_timeout=args.keepalive_timeout
+    )
     
+    # SIGTERM (ex.: systemctl stop) drena as conexões em andamento como o Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
         server.start()
     except KeyboardInterrupt:
@@ -126,6 +527,10 @@ def main():
     except Exception as e:
         print(f"\nErro ao iniciar servidor: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        # O sinal pode chegar fora de serve_forever (ex.: ao criar o servidor)
+        if server.httpd is not None:
+            server.httpd.server_close()
 
 
 if __name__ == '__main__':
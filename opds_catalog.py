@@ -0,0 +1,253 @@
+"""
+Registro compacto de livros do catálogo
+"""
+
+import bisect
+import sys
+import threading
+from datetime import datetime, timedelta
+
+
+# MIME types por extensão de arquivo
+MIME_TYPES = {
+    '.epub': 'application/epub+zip',
+    '.pdf': 'application/pdf',
+    '.mobi': 'application/x-mobipocket-ebook',
+    '.azw': 'application/vnd.amazon.ebook',
+    '.azw3': 'application/vnd.amazon.ebook',
+    '.fb2': 'text/fb2+xml',
+    '.djvu': 'image/vnd.djvu',
+    '.cbz': 'application/x-cbz',
+    '.cbr': 'application/x-cbr',
+    '.txt': 'text/plain',
+}
+
+UNKNOWN_AUTHOR = 'Autor Desconhecido'
+
+# Números de dispositivo compartilhados entre os livros (como as strings internadas)
+_DEVICES = {}
+
+
+def _intern(value):
+    """Interna strings repetidas entre livros (categoria, autor, idioma...)."""
+    return sys.intern(value) if value else value
+
+
+class BookRecord:
+    """
+    Registro de um livro do catálogo.
+
+    Usa ``__slots__`` em vez de um dicionário por livro e guarda apenas os
+    dados brutos: o ID como os 16 bytes do MD5, a data de modificação como
+    inteiro (st_mtime_ns) e strings repetidas (categoria, autores, extensão,
+    idioma, série, biblioteca) internadas, compartilhadas entre todos os livros. O ID em
+    hexadecimal, a data ISO e o MIME type são calculados sob demanda.
+
+    O dispositivo e o inode do arquivo (e, opcionalmente, um hash parcial do
+    conteúdo) identificam o arquivo independentemente do caminho: um livro
+    movido ou renomeado é reconhecido pelo escaneador e mantém o ID.
+    """
+
+    __slots__ = (
+        'digest', 'title', 'authors', 'category', 'file_path', 'file_size',
+        'mtime_ns', 'extension', 'series', 'series_index', 'language', 'description',
+        'library', 'inode', 'device', 'content_hash', 'page_count',
+    )
+
+    def __init__(self, digest, title, authors, category, file_path, file_size, mtime_ns,
+                 extension, series=None, series_index=None, language=None, description=None,
+                 library='', inode=None, device=None, content_hash=None, page_count=None):
+        """
+        Cria o registro de um livro.
+
+        Args:
+            digest: MD5 (bytes) do caminho relativo onde o livro foi
+                    encontrado pela primeira vez, usado como ID
+            title: Título do livro
+            authors: Sequência de nomes de autores
+            category: Categoria (primeiro nível de diretórios)
+            file_path: Caminho relativo ao diretório de livros
+            file_size: Tamanho do arquivo em bytes
+            mtime_ns: Data de modificação do arquivo (st_mtime_ns)
+            extension: Extensão em minúsculas, com ponto
+            series: Nome da série (ou None)
+            series_index: Posição na série (ou None)
+            language: Código do idioma (ou None)
+            description: Sinopse (ou None)
+            library: Nome da raiz da biblioteca onde está o arquivo ('' para
+                     a raiz sem nome, quando há apenas um diretório)
+            inode: st_ino do arquivo (ou None)
+            device: st_dev do arquivo (ou None)
+            content_hash: Hash parcial do conteúdo (bytes), calculado pelo
+                          escaneador quando a detecção por conteúdo está ativa
+            page_count: Quantidade de páginas de um quadrinho (ou None), lida
+                        junto com os metadados embutidos
+        """
+        self.digest = digest
+        self.title = title
+        self.authors = tuple(_intern(author) for author in authors)
+        self.category = _intern(category)
+        self.file_path = file_path
+        self.file_size = file_size
+        self.mtime_ns = mtime_ns
+        self.extension = _intern(extension)
+        self.series = _intern(series)
+        self.series_index = series_index
+        self.language = _intern(language)
+        self.description = description
+        self.library = _intern(library)
+        self.inode = inode
+        self.device = _DEVICES.setdefault(device, device)
+        self.content_hash = content_hash
+        self.page_count = page_count
+
+    def __repr__(self):
+        return f'BookRecord({self.file_path!r})'
+
+    @property
+    def id(self):
+        """ID do livro em hexadecimal (usado em URLs e nos feeds)."""
+        return self.digest.hex()
+
+    @property
+    def author(self):
+        """Autor principal (o primeiro da lista)."""
+        return self.authors[0] if self.authors else UNKNOWN_AUTHOR
+
+    @property
+    def modified(self):
+        """Data de modificação no formato ISO 8601 usado nos feeds."""
+        # Aritmética inteira: dividir os nanossegundos como float perde precisão
+        seconds, nanoseconds = divmod(self.mtime_ns, 1_000_000_000)
+        moment = datetime.fromtimestamp(seconds) + timedelta(microseconds=(nanoseconds + 500) // 1000)
+        return moment.isoformat() + 'Z'
+
+    @property
+    def mime_type(self):
+        """MIME type do arquivo, pela extensão."""
+        return MIME_TYPES.get(self.extension, 'application/octet-stream')
+
+    def fields(self):
+        """Retorna todos os campos do registro, na ordem de ``__slots__``."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def update_metadata(self, data):
+        """
+        Aplica os metadados extraídos de dentro do arquivo.
+
+        Args:
+            data: Dicionário com title, authors, series, series_index,
+                  language, description e page_count (campos vazios são
+                  ignorados no título e nos autores)
+        """
+        self.title = data.get('title') or self.title
+        if data.get('authors'):
+            self.authors = tuple(_intern(author) for author in data['authors'])
+        self.series = _intern(data.get('series'))
+        self.series_index = data.get('series_index')
+        self.language = _intern(data.get('language'))
+        self.description = data.get('description')
+        self.page_count = data.get('page_count')
+
+
+class TimeIndex:
+    """
+    Livros do catálogo ordenados por data de modificação, do mais recente
+    ao mais antigo.
+
+    As chaves são tuplas ``(-mtime_ns, digest)`` em uma lista ordenada,
+    atualizada incrementalmente a partir dos ScanDelta dos escaneamentos;
+    encontrar os livros modificados depois de um instante é uma busca
+    binária.
+    """
+
+    def __init__(self):
+        """Inicializa um índice vazio."""
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Quantidade de livros indexados."""
+        return len(self._keys)
+
+    def rebuild(self, books):
+        """
+        Reconstrói o índice do zero.
+
+        Args:
+            books: Lista de BookRecord
+        """
+        keys = sorted((-book.mtime_ns, book.digest) for book in books)
+        with self._lock:
+            self._keys = keys
+
+    def update(self, delta):
+        """
+        Aplica as mudanças de um escaneamento ao índice.
+
+        Args:
+            delta: ScanDelta com livros adicionados, removidos e modificados
+        """
+        removed = delta.removed + [old for old, _ in delta.modified]
+        added = delta.added + [new for _, new in delta.modified]
+        with self._lock:
+            # Muitas mudanças: reordenar tudo sai mais barato que inserir uma a uma
+            if (len(removed) + len(added)) * 8 >= len(self._keys):
+                gone = {book.digest for book in removed}
+                keys = [key for key in self._keys if key[1] not in gone]
+                keys.extend((-book.mtime_ns, book.digest) for book in added)
+                keys.sort()
+                self._keys = keys
+                return
+            for book in removed:
+                key = (-book.mtime_ns, book.digest)
+                position = bisect.bisect_left(self._keys, key)
+                if position < len(self._keys) and self._keys[position] == key:
+                    del self._keys[position]
+            for book in added:
+                bisect.insort(self._keys, (-book.mtime_ns, book.digest))
+
+    def keys(self):
+        """Retorna uma cópia das chaves, para um CatalogIndex imutável."""
+        with self._lock:
+            return list(self._keys)
+
+
+class TimeOrderedBooks:
+    """
+    Sequência somente leitura de livros na ordem de um TimeIndex.
+
+    Converte chaves em BookRecord apenas nas fatias pedidas, então paginar
+    um feed não materializa a lista inteira.
+    """
+
+    def __init__(self, keys, by_id):
+        """
+        Args:
+            keys: Chaves ``(-mtime_ns, digest)`` ordenadas (de ``TimeIndex.keys``)
+            by_id: Dicionário digest -> BookRecord
+        """
+        self._keys = keys
+        self._by_id = by_id
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, selection):
+        if isinstance(selection, slice):
+            return [self._by_id[digest] for _, digest in self._keys[selection]]
+        return self._by_id[self._keys[selection][1]]
+
+    def newer_than(self, mtime_ns):
+        """
+        Retorna os livros modificados depois de um instante.
+
+        Args:
+            mtime_ns: Instante em nanossegundos desde a época
+
+        Returns:
+            TimeOrderedBooks com os livros mais recentes que ``mtime_ns``
+        """
+        # (-mtime_ns,) ordena antes de todas as chaves com a mesma data
+        position = bisect.bisect_left(self._keys, (-mtime_ns,))
+        return TimeOrderedBooks(self._keys[:position], self._by_id)
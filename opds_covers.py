@@ -0,0 +1,451 @@
+"""
+Extração de capas e cache de capas/miniaturas em disco
+"""
+
+import base64
+import hashlib
+import io
+import os
+import posixpath
+import re
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow é opcional: sem ele, a miniatura é a própria capa
+    Image = None
+
+
+IMAGE_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+}
+
+# Extensões de arquivo a partir do MIME type da imagem
+IMAGE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+
+# Formatos de livro dos quais sabemos extrair capas
+COVER_FORMATS = {'.epub', '.cbz', '.fb2'}
+
+# Altura máxima das miniaturas (em pixels)
+THUMBNAIL_HEIGHT = 300
+
+
+def natural_key(name):
+    """Chave de ordenação que compara números pelo valor (pagina2 < pagina10)."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def image_type(name):
+    """Retorna o MIME type de uma imagem pelo nome, ou None se não for imagem."""
+    return IMAGE_TYPES.get(os.path.splitext(name)[1].lower())
+
+
+def resize_image(data, max_width=None, max_height=None):
+    """
+    Reduz uma imagem mantendo a proporção (requer Pillow).
+
+    Args:
+        data: Bytes da imagem original
+        max_width: Largura máxima em pixels
+        max_height: Altura máxima em pixels
+
+    Returns:
+        Tupla (bytes, MIME type) da imagem reduzida, ou None se o Pillow não
+        estiver instalado, a imagem não puder ser lida ou já for pequena
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            scale = 1.0
+            if max_width and width > max_width:
+                scale = min(scale, max_width / width)
+            if max_height and height > max_height:
+                scale = min(scale, max_height / height)
+            if scale >= 1.0:
+                return None
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            resized = image.convert('RGB').resize(size, Image.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, 'JPEG', quality=85)
+            return output.getvalue(), 'image/jpeg'
+    except Exception:
+        return None
+
+
+def _local(tag):
+    """Remove o namespace de uma tag do ElementTree."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _epub_cover(path):
+    """Extrai a capa de um EPUB a partir do manifesto do OPF."""
+    with zipfile.ZipFile(path) as archive:
+        container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+        opf_path = next(
+            (e.get('full-path') for e in container.iter() if _local(e.tag) == 'rootfile'),
+            None
+        )
+        if not opf_path:
+            return None
+        opf = ElementTree.fromstring(archive.read(opf_path))
+
+        cover_id = None
+        items = []
+        for element in opf.iter():
+            tag = _local(element.tag)
+            if tag == 'meta' and element.get('name') == 'cover':
+                cover_id = element.get('content')
+            elif tag == 'item':
+                items.append(element)
+
+        def is_image(item):
+            return (item.get('media-type') or '').startswith('image/')
+
+        candidates = (
+            [i for i in items if 'cover-image' in (i.get('properties') or '').split()] +
+            [i for i in items if cover_id and i.get('id') == cover_id and is_image(i)] +
+            [i for i in items if is_image(i) and 'cover' in (i.get('id', '') + i.get('href', '')).lower()]
+        )
+        if not candidates:
+            return None
+
+        item = candidates[0]
+        base = posixpath.dirname(opf_path)
+        name = posixpath.normpath(posixpath.join(base, item.get('href')))
+        try:
+            data = archive.read(name)
+        except KeyError:
+            return None
+        return data, item.get('media-type') or image_type(name) or 'image/jpeg'
+
+
+def _cbz_cover(path):
+    """Extrai a primeira página (em ordem natural) de um CBZ."""
+    with zipfile.ZipFile(path) as archive:
+        pages = sorted(
+            (n for n in archive.namelist() if image_type(n) and not n.endswith('/')),
+            key=natural_key
+        )
+        if not pages:
+            return None
+        return archive.read(pages[0]), image_type(pages[0])
+
+
+def _fb2_cover(path):
+    """Extrai a imagem de <coverpage> de um FB2 (binário em base64)."""
+    cover_href = None
+    with open(path, 'rb') as f:
+        for _, element in ElementTree.iterparse(f, events=('end',)):
+            tag = _local(element.tag)
+            if tag == 'coverpage':
+                for image in element:
+                    href = next((v for k, v in image.attrib.items() if _local(k) == 'href'), '')
+                    cover_href = href.lstrip('#')
+                    break
+            elif tag == 'binary' and cover_href and element.get('id') == cover_href:
+                data = base64.b64decode(element.text or '')
+                return data, element.get('content-type') or 'image/jpeg'
+            elif tag == 'body':
+                # Libera o texto do livro da memória enquanto procura os binários
+                element.clear()
+    return None
+
+
+COVER_EXTRACTORS = {
+    '.epub': _epub_cover,
+    '.cbz': _cbz_cover,
+    '.fb2': _fb2_cover,
+}
+
+
+def extract_cover(path):
+    """
+    Extrai a imagem de capa de um livro.
+
+    Args:
+        path: Caminho do arquivo
+
+    Returns:
+        Tupla (bytes, MIME type) ou None se não houver capa
+    """
+    extractor = COVER_EXTRACTORS.get(os.path.splitext(str(path))[1].lower())
+    if extractor is None:
+        return None
+    try:
+        return extractor(path)
+    except Exception:
+        return None
+
+
+class CoverCache:
+    """
+    Cache LRU de capas e miniaturas em disco, limitado por tamanho total.
+
+    Cada livro tem suas imagens geradas no máximo uma vez por versão do
+    arquivo (tamanho e data de modificação): capa e miniatura são gravadas
+    juntas, e livros sem capa recebem um marcador vazio, então navegar de
+    novo pelo catálogo nunca reabre o arquivo do livro. A ordem de uso é
+    mantida pela data de modificação dos arquivos do cache, preservando o
+    LRU entre reinicializações.
+
+    Vários processos podem usar o mesmo diretório (``-processes``): o índice
+    em memória de cada um é apenas uma visão do disco. O limite de tamanho é
+    aplicado sobre a listagem do diretório, relida antes de remover arquivos
+    e a cada ``SYNC_INTERVAL`` segundos, e uma imagem removida por outro
+    processo é tirada do índice e gerada de novo.
+    """
+
+    # Intervalo máximo (em segundos) entre releituras do diretório do cache;
+    # limita quanto o cache pode passar do limite com vários processos
+    SYNC_INTERVAL = 5.0
+
+    # Idade mínima (em segundos) da data de modificação de uma imagem antes
+    # de atualizá-la em um acesso
+    TOUCH_INTERVAL = 60.0
+
+    # Ao passar do limite, remover arquivos até esta fração dele (evita
+    # reler o diretório a cada imagem gravada com o cache cheio)
+    EVICT_TARGET = 0.9
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        """
+        Inicializa o cache, carregando o índice dos arquivos existentes.
+
+        Args:
+            directory: Diretório onde as imagens são armazenadas
+            max_bytes: Tamanho máximo total do cache em bytes
+        """
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pending = {}            # chave -> [lock da extração, threads usando]
+        self._files = OrderedDict()   # nome do arquivo -> tamanho
+        self._names = {}              # (chave, tipo) -> nome do arquivo
+        self._total = 0
+        self._synced = 0.0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load(self._scan())
+
+    @staticmethod
+    def version(book):
+        """Identificador da versão do arquivo do livro (usado nas URLs das capas)."""
+        return hashlib.md5(f"{book.file_size}|{book.modified}".encode('utf-8')).hexdigest()[:8]
+
+    @classmethod
+    def cache_key(cls, book):
+        """Chave do livro no cache; muda quando o arquivo do livro muda."""
+        return f"{book.id}-{cls.version(book)}"
+
+    def get(self, book, books_dir, thumbnail=False):
+        """
+        Retorna o arquivo de capa (ou miniatura) de um livro, gerando se preciso.
+
+        Args:
+            book: BookRecord do livro
+            books_dir: Diretório raiz da biblioteca
+            thumbnail: Retornar a miniatura em vez da capa
+
+        Returns:
+            Tupla (caminho do arquivo, MIME type) ou None se não houver capa
+        """
+        if book.extension not in COVER_FORMATS:
+            return None
+
+        key = self.cache_key(book)
+        kind = 'thumb' if thumbnail else 'cover'
+
+        found = self._lookup(key, kind)
+        if found is not False:
+            with self._lock:
+                self.hits += 1
+            return found
+
+        # Apenas uma thread extrai a capa de cada livro por vez; a entrada só
+        # sai de _pending quando não há mais threads esperando por ela
+        with self._lock:
+            self.misses += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = [threading.Lock(), 0]
+            pending[1] += 1
+        try:
+            with pending[0]:
+                found = self._lookup(key, kind)
+                if found is False:
+                    self._generate(key, os.path.join(str(books_dir), book.file_path))
+                    found = self._lookup(key, kind)
+        finally:
+            with self._lock:
+                pending[1] -= 1
+                if not pending[1]:
+                    del self._pending[key]
+        return found or None
+
+    def _lookup(self, key, kind):
+        """
+        Procura uma imagem no índice, marcando-a como usada recentemente.
+
+        Returns:
+            Tupla (caminho, MIME type), None se o livro não tem capa, ou False
+            se a imagem ainda não foi gerada
+        """
+        with self._lock:
+            name = self._names.get((key, 'none'))
+            if name is None:
+                name = self._names.get((key, kind))
+            if name is None and kind == 'thumb':
+                # Sem Pillow (ou capa já pequena) a miniatura é a própria capa
+                name = self._names.get((key, 'cover'))
+            if name is None:
+                return False
+            self._touch(name)
+        path = os.path.join(self.directory, name)
+        try:
+            # A data de modificação é a ordem de uso compartilhada entre
+            # processos; atualizá-la a cada acesso seria uma escrita por capa
+            if os.stat(path).st_mtime < time.time() - self.TOUCH_INTERVAL:
+                os.utime(path)
+        except FileNotFoundError:
+            # Removida por outro processo: gerar de novo
+            with self._lock:
+                self._forget(name)
+            return False
+        except OSError:
+            pass
+        if name.endswith('.none'):
+            return None
+        return path, IMAGE_TYPES.get(os.path.splitext(name)[1], 'image/jpeg')
+
+    def _generate(self, key, book_path):
+        """
+        Extrai a capa do livro e grava capa e miniatura no cache.
+
+        Args:
+            key: Chave do livro no cache
+            book_path: Caminho absoluto do arquivo do livro
+        """
+        cover = extract_cover(book_path)
+        if cover is None:
+            self._write(f'{key}.none', b'')
+            return
+
+        data, mime = cover
+        extension = IMAGE_EXTENSIONS.get(mime, '.jpg')
+        self._write(f'{key}.cover{extension}', data)
+
+        thumbnail = resize_image(data, max_height=THUMBNAIL_HEIGHT)
+        if thumbnail is not None:
+            thumb_data, thumb_mime = thumbnail
+            self._write(f'{key}.thumb{IMAGE_EXTENSIONS.get(thumb_mime, ".jpg")}', thumb_data)
+
+    def _write(self, name, data):
+        """Grava um arquivo no cache de forma atômica e aplica o limite de tamanho."""
+        path = os.path.join(self.directory, name)
+        temp_path = os.path.join(self.directory, f'.{name}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._add(name, len(data))
+            sync = self._total > self.max_bytes or time.monotonic() - self._synced >= self.SYNC_INTERVAL
+        if sync:
+            # Outros processos também gravam no diretório: só a listagem
+            # mostra o tamanho real do cache
+            entries = self._scan()
+            with self._lock:
+                self._load(entries)
+        with self._lock:
+            self._evict()
+
+    def _scan(self):
+        """
+        Lista os arquivos do cache em disco.
+
+        Returns:
+            Lista de tuplas (nome, tamanho), dos menos aos mais usados
+            recentemente
+        """
+        entries = []
+        with os.scandir(self.directory) as listing:
+            for entry in listing:
+                # Arquivos temporários começam com ponto
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    # Removido por outro processo durante a listagem
+                    continue
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        entries.sort()
+        return [(name, size) for _, name, size in entries]
+
+    def _load(self, entries):
+        """Substitui o índice pela listagem de ``_scan`` (chamar com o lock)."""
+        self._files.clear()
+        self._names.clear()
+        self._total = 0
+        for name, size in entries:
+            self._add(name, size)
+        self._synced = time.monotonic()
+
+    def _add(self, name, size):
+        """Registra um arquivo no índice (chamar com o lock)."""
+        parts = name.split('.')
+        if len(parts) < 2:
+            return
+        key, kind = parts[0], parts[1]
+        if name in self._files:
+            self._total -= self._files.pop(name)
+        self._files[name] = size
+        self._names[(key, kind)] = name
+        self._total += size
+
+    def _forget(self, name):
+        """Tira do índice um arquivo que não existe mais (chamar com o lock)."""
+        size = self._files.pop(name, None)
+        if size is not None:
+            self._total -= size
+        key, kind = name.split('.')[:2]
+        if self._names.get((key, kind)) == name:
+            del self._names[(key, kind)]
+
+    def _touch(self, name):
+        """Marca um arquivo como usado recentemente (chamar com o lock)."""
+        if name in self._files:
+            self._files.move_to_end(name)
+
+    def _evict(self):
+        """Remove os arquivos menos usados até caber no limite (chamar com o lock)."""
+        if self._total <= self.max_bytes:
+            return
+        target = self.max_bytes * self.EVICT_TARGET
+        while self._total > target and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._total -= size
+            key, kind = name.split('.')[:2]
+            self._names.pop((key, kind), None)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
@@ -0,0 +1,209 @@
+"""
+Cache de arquivos abertos (descritor e stat) dos livros mais baixados
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class _Handle:
+    """Descritor aberto de um arquivo, com o stat lido na abertura."""
+
+    __slots__ = ('fd', 'size', 'mtime_ns', 'refs', 'evicted')
+
+    def __init__(self, fd, size, mtime_ns):
+        self.fd = fd
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.refs = 0
+        self.evicted = False
+
+
+class FileView:
+    """
+    Leitor de um descritor compartilhado com posição própria.
+
+    Várias requisições podem ler o mesmo descritor ao mesmo tempo: as
+    leituras usam ``os.pread`` e a posição fica neste objeto, nunca no
+    descritor. Serve como arquivo para ``socket.sendfile`` (que usa
+    ``os.sendfile`` com deslocamento explícito) e para a compressão.
+    """
+
+    def __init__(self, handle):
+        """
+        Cria um leitor posicionado no início do arquivo.
+
+        Args:
+            handle: _Handle do arquivo
+        """
+        self._fd = handle.fd
+        self.size = handle.size
+        self.mtime_ns = handle.mtime_ns
+        self._position = 0
+
+    def fileno(self):
+        """Descritor do arquivo."""
+        return self._fd
+
+    def tell(self):
+        """Posição atual de leitura."""
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Altera a posição de leitura (apenas deste leitor)."""
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def read(self, size=-1):
+        """Lê a partir da posição atual, avançando-a."""
+        if size is None or size < 0:
+            size = max(0, self.size - self._position)
+        data = os.pread(self._fd, size, self._position)
+        self._position += len(data)
+        return data
+
+
+class _Opened:
+    """Gerenciador de contexto que devolve o descritor ao cache na saída."""
+
+    def __init__(self, cache, handle):
+        self._cache = cache
+        self._handle = handle
+
+    def __enter__(self):
+        return FileView(self._handle)
+
+    def __exit__(self, *exc_info):
+        self._cache._release(self._handle)
+        return False
+
+
+class OpenFileCache:
+    """
+    Cache LRU de descritores abertos e do stat dos livros mais baixados.
+
+    Baixar de novo um livro popular (ex.: uma turma inteira baixando o
+    mesmo título) não reabre nem relê o stat do arquivo. Os descritores
+    são compartilhados entre as requisições, que leem com ``os.pread``;
+    um descritor removido do cache só é fechado depois que a última
+    requisição que o usa termina.
+
+    O escaneamento invalida as entradas dos livros alterados ou removidos
+    (ver ``invalidate``); até lá, um arquivo substituído (novo inode)
+    continua sendo servido na versão aberta. Um arquivo alterado no lugar
+    é detectado pelo ``fstat`` do descritor a cada uso e reaberto.
+    """
+
+    def __init__(self, max_files=64):
+        """
+        Inicializa o cache vazio.
+
+        Args:
+            max_files: Quantidade máxima de arquivos mantidos abertos
+                       (0 abre o arquivo a cada requisição)
+        """
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._handles = OrderedDict()   # caminho -> _Handle
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, path):
+        """
+        Abre um arquivo para leitura, reaproveitando o descritor em cache.
+
+        Args:
+            path: Caminho absoluto do arquivo
+
+        Returns:
+            Gerenciador de contexto que produz um FileView
+
+        Raises:
+            OSError: Se o arquivo não puder ser aberto (ex.: FileNotFoundError)
+        """
+        with self._lock:
+            handle = self._handles.get(path)
+            if handle is not None:
+                self._handles.move_to_end(path)
+                handle.refs += 1
+
+        if handle is not None:
+            # Um arquivo alterado no lugar (ex.: truncado) muda o stat do
+            # próprio descritor: o tamanho guardado não vale mais
+            try:
+                stat = os.fstat(handle.fd)
+                current = stat.st_size == handle.size and stat.st_mtime_ns == handle.mtime_ns
+            except OSError:
+                current = False
+            if current:
+                with self._lock:
+                    self.hits += 1
+                return _Opened(self, handle)
+            with self._lock:
+                if self._handles.get(path) is handle:
+                    del self._handles[path]
+                    handle.evicted = True
+            self._release(handle)
+
+        with self._lock:
+            self.misses += 1
+
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+        try:
+            stat = os.fstat(fd)
+        except OSError:
+            os.close(fd)
+            raise
+        handle = _Handle(fd, stat.st_size, stat.st_mtime_ns)
+        handle.refs = 1
+
+        with self._lock:
+            if self.max_files <= 0 or path in self._handles:
+                # Sem cache, ou outra thread abriu o mesmo arquivo antes
+                handle.evicted = True
+            else:
+                self._handles[path] = handle
+                while len(self._handles) > self.max_files:
+                    _, old = self._handles.popitem(last=False)
+                    self._evict(old)
+        return _Opened(self, handle)
+
+    def invalidate(self, paths):
+        """
+        Descarta os descritores de arquivos alterados ou removidos.
+
+        Args:
+            paths: Caminhos absolutos dos arquivos
+        """
+        with self._lock:
+            for path in paths:
+                handle = self._handles.pop(path, None)
+                if handle is not None:
+                    self._evict(handle)
+
+    def clear(self):
+        """Descarta todos os descritores em cache."""
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+            for handle in handles:
+                self._evict(handle)
+
+    def _release(self, handle):
+        """Devolve um descritor, fechando-o se já saiu do cache."""
+        with self._lock:
+            handle.refs -= 1
+            close = handle.evicted and handle.refs == 0
+        if close:
+            os.close(handle.fd)
+
+    def _evict(self, handle):
+        """Marca um descritor como fora do cache (chamar com o lock)."""
+        handle.evicted = True
+        if handle.refs == 0:
+            os.close(handle.fd)
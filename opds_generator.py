@@ -2,15 +2,195 @@
 Módulo para gerar feeds OPDS compatíveis com KOReader
 """
 
+import functools
+import json
+import logging
 import os
 import mimetypes
+import sqlite3
+import threading
+import time
 import urllib.parse
+import zlib
+from collections import OrderedDict, namedtuple
 from pathlib import Path
 from datetime import datetime
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+from xml.sax.saxutils import escape as _xml_escape
 import hashlib
 
+from opds_catalog import MIME_TYPES, BookRecord, TimeIndex, TimeOrderedBooks
+from opds_covers import COVER_FORMATS, CoverCache
+from opds_files import OpenFileCache
+from opds_metadata import MetadataCache
+from opds_metrics import SCAN_METRICS, Metrics, load_metrics, save_metrics
+from opds_pages import PSE_NAMESPACE, PSE_REL, PageStreamer
+from opds_scanner import LibraryScanner, ScanDelta, delta_is_empty
+from opds_search import SearchIndex, tokenize
+from opds_snapshot import load_catalog, load_snapshot, save_catalog, save_snapshot
+
+
+logger = logging.getLogger('opds.generator')
+
+
+# Feed renderizado e pronto para envio, com seus validadores HTTP
+# (content_encoding é 'gzip' ou 'deflate' nas variantes comprimidas)
+CachedFeed = namedtuple(
+    'CachedFeed', ['content', 'etag', 'last_modified', 'content_type', 'content_encoding'],
+    defaults=(None,)
+)
+
+# Codificações de conteúdo suportadas -> parâmetro wbits do zlib
+# (31 = formato gzip, 15 = formato zlib, que é o "deflate" do HTTP)
+CONTENT_ENCODINGS = {'gzip': 31, 'deflate': 15}
+
+# Índices do catálogo, reconstruídos uma vez a cada mudança de books_cache:
+# - books: todos os livros ordenados por (categoria, autor, título)
+# - categories: categoria -> autor -> livros ordenados por título
+# - by_id: MD5 do caminho (bytes, BookRecord.digest) -> livro
+# - libraries: nome da raiz -> (livros ordenados, categorias da raiz), apenas
+#   quando há mais de uma raiz (senão None)
+CatalogIndex = namedtuple('CatalogIndex', ['books', 'categories', 'by_id', 'by_time', 'libraries'])
+
+# Entrada de um feed de navegação
+NavigationEntry = namedtuple('NavigationEntry', ['id', 'title', 'href', 'content', 'kind'])
+
+
+def _escape(value):
+    """Escapa texto para XML (&, <, > e aspas duplas)."""
+    return _xml_escape(value, {'"': '&quot;'})
+
+
+def _quote_attr(value):
+    """Escapa e delimita um valor de atributo XML com aspas duplas."""
+    return '"' + _escape(value) + '"'
+
+
+def _quote(value):
+    """Codifica um nome (categoria, autor) para uso como segmento de URL."""
+    return urllib.parse.quote(value, safe='')
+
+
+def _link(rel, link_type, href, **extra):
+    """
+    Serializa um elemento <link/> do Atom.
+    
+    Args:
+        rel: Relação do link
+        link_type: MIME type do recurso apontado
+        href: URL do recurso
+        **extra: Atributos adicionais (ex: length)
+        
+    Returns:
+        String com o elemento XML
+    """
+    attrs = f'rel={_quote_attr(rel)} type={_quote_attr(link_type)} href={_quote_attr(href)}'
+    for key, value in extra.items():
+        attrs += f' {key}={_quote_attr(value)}'
+    return f'<link {attrs}/>'
+
+
+def compressor(encoding, level=6):
+    """
+    Cria um compressor zlib para uma codificação de conteúdo HTTP.
+    
+    No formato gzip o cabeçalho não inclui data, então a mesma entrada
+    sempre produz os mesmos bytes.
+    
+    Args:
+        encoding: 'gzip' ou 'deflate'
+        level: Nível de compressão (1-9)
+        
+    Returns:
+        Objeto de compressão do zlib
+    """
+    return zlib.compressobj(level, zlib.DEFLATED, CONTENT_ENCODINGS[encoding])
+
+
+def _parse_since(value):
+    """
+    Converte o instante de um feed ``/updated-since/`` em nanossegundos.
+    
+    Aceita a data no mesmo formato do ``<updated>`` das entradas (ISO 8601)
+    ou segundos desde a época. Como as datas dos feeds têm precisão de
+    microssegundos, livros exibidos com a mesma data informada não são
+    considerados mais novos (o cliente já os tem).
+    
+    Args:
+        value: Texto do instante
+        
+    Returns:
+        Instante em nanossegundos ou None se o valor for inválido
+    """
+    try:
+        microseconds = round(float(value) * 1_000_000)
+    except (ValueError, OverflowError):
+        try:
+            moment = datetime.fromisoformat(value[:-1] if value.endswith('Z') else value)
+            # Mesma conversão de BookRecord.modified, mas no sentido inverso
+            seconds = int(moment.replace(microsecond=0).timestamp())
+        except (ValueError, OverflowError, OSError):
+            return None
+        microseconds = seconds * 1_000_000 + moment.microsecond
+    return microseconds * 1000 + 499
+
+
+def _encode_chunks(parts, chunk_size=64 * 1024):
+    """
+    Codifica trechos de texto em UTF-8, agrupando-os em blocos maiores.
+    
+    Args:
+        parts: Iterador de strings
+        chunk_size: Tamanho aproximado de cada bloco em bytes
+        
+    Yields:
+        Blocos de bytes
+    """
+    buffer = []
+    size = 0
+    for part in parts:
+        data = part.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+class LibraryRoot:
+    """
+    Raiz da biblioteca, escaneada e mantida em cache de forma independente.
+    
+    Cada raiz tem o próprio escaneador, os próprios caches persistentes
+    (metadados e capas) e o próprio snapshot. Uma montagem lenta ou
+    indisponível atrasa apenas o escaneamento da sua raiz; o catálogo
+    publicado junta os livros de todas.
+    """
+    
+    def __init__(self, name, path, cache_dir):
+        """
+        Args:
+            name: Nome da raiz ('' quando há apenas um diretório)
+            path: Diretório da raiz
+            cache_dir: Diretório dos caches persistentes da raiz
+        """
+        self.name = name
+        self.path = Path(path)
+        self.absolute = str(self.path.absolute())
+        self.cache_dir = Path(cache_dir)
+        self.snapshot_file = self.cache_dir / '.opds_catalog.snapshot'
+        self.metadata = None
+        self.covers = None
+        self.scanner = None
+        self.last_delta = None
+        # Livros da raiz no catálogo publicado (None até o primeiro
+        # escaneamento ou a restauração do snapshot)
+        self.books = None
+        # Livros já publicados durante o primeiro escaneamento
+        self.published = 0
+
 
 class OPDSGenerator:
     """Gerador de feed OPDS para catálogos de livros."""
@@ -26,79 +206,368 @@ class OPDSGenerator:
         'xmlns': 'http://www.w3.org/2005/Atom',
         'xmlns:dc': 'http://purl.org/dc/elements/1.1/',
         'xmlns:opds': 'http://opds-spec.org/2010/catalog',
+        'xmlns:pse': PSE_NAMESPACE,
     }
     
-    def __init__(self, books_dir, host='0.0.0.0', port=8080):
+    # Tipos dos feeds OPDS
+    NAVIGATION_TYPE = 'application/atom+xml;profile=opds-catalog;kind=navigation'
+    ACQUISITION_TYPE = 'application/atom+xml;profile=opds-catalog;kind=acquisition'
+    OPENSEARCH_TYPE = 'application/opensearchdescription+xml'
+    OPDS2_TYPE = 'application/opds+json'
+    
+    # Quantidade máxima de feeds renderizados mantidos em cache
+    # (um por combinação de feed, página, URL base e codificação)
+    FEED_CACHE_SIZE = 256
+    
+    # Feeds menores que isso (em bytes) não compensam ser comprimidos
+    MIN_COMPRESS_SIZE = 1024
+    
+    # Livros novos necessários para publicar um lote durante o primeiro
+    # escaneamento (o lote mínimo cresce com o catálogo, mantendo o custo
+    # total de reconstruir os índices proporcional ao tamanho da biblioteca)
+    SCAN_BATCH_SIZE = 500
+    
+    # Quantidade de livros no feed de novidades
+    NEWEST_FEED_SIZE = 100
+    
+    def __init__(self, books_dir, host='0.0.0.0', port=8080, pretty=True, page_size=50,
+                 cache_dir=None, extract_metadata=True, metadata_workers=None,
+                 covers=True, cover_cache_size=256 * 1024 * 1024, scan_workers=0,
+                 page_cache_size=64 * 1024 * 1024, open_files=64, move_hash=False):
         """
         Inicializa o gerador OPDS.
         
         Args:
-            books_dir: Diretório contendo os livros
+            books_dir: Diretório contendo os livros, ou lista de tuplas
+                       (nome, diretório) com as raízes da biblioteca, que
+                       são escaneadas de forma independente e publicadas
+                       como um único catálogo
             host: Host do servidor
             port: Porta do servidor
+            pretty: Indentar o XML dos feeds (False gera XML compacto)
+            page_size: Quantidade de livros por página nos feeds de aquisição
+            cache_dir: Diretório dos caches persistentes (padrão: o diretório
+                       de cada raiz; com várias raízes, cada uma usa um
+                       subdiretório com o seu nome)
+            extract_metadata: Ler título, autores etc. de dentro dos arquivos
+            metadata_workers: Processos para extração de metadados
+                              (None = número de CPUs, 0 = sem pool)
+            covers: Oferecer capas e miniaturas extraídas dos livros
+            cover_cache_size: Tamanho máximo do cache de capas em bytes
+            scan_workers: Threads que listam diretórios em paralelo no
+                          escaneamento (0 = escaneamento serial)
+            page_cache_size: Tamanho máximo do cache de páginas de quadrinhos
+                             em bytes (0 desativa o streaming de páginas)
+            open_files: Livros mantidos abertos para downloads repetidos
+                        (0 abre o arquivo a cada download)
+            move_hash: Reconhecer pelo conteúdo (hash parcial) os livros
+                       movidos que mudaram de inode, além do inode
         """
-        self.books_dir = Path(books_dir)
+        if isinstance(books_dir, (str, os.PathLike)):
+            libraries = [('', books_dir)]
+        else:
+            libraries = list(books_dir)
         self.host = host
         self.port = port
+        self.pretty = pretty
+        self.page_size = max(1, page_size)
         self.base_url = None  # Será definido dinamicamente
-        self.opds_file = self.books_dir / '.opds_catalog.xml'
         self.books_cache = []
+        self.roots = OrderedDict()
+        for name, path in libraries:
+            if name in self.roots:
+                raise ValueError(f"Nome de biblioteca repetido: {name!r}")
+            if not cache_dir:
+                root_cache = Path(path)
+            elif len(libraries) > 1:
+                root_cache = Path(cache_dir) / name
+                try:
+                    root_cache.mkdir(parents=True, exist_ok=True)
+                except OSError as e:
+                    logger.warning("Não foi possível criar o diretório de cache %s: %s", root_cache, e)
+            else:
+                root_cache = Path(cache_dir)
+            root = LibraryRoot(name, path, root_cache)
+            if extract_metadata:
+                try:
+                    root.metadata = MetadataCache(root.cache_dir / '.opds_metadata.db', metadata_workers)
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning("Cache de metadados indisponível, usando apenas nomes de arquivos: %s", e)
+            if covers:
+                try:
+                    root.covers = CoverCache(root.cache_dir / '.opds_covers', cover_cache_size)
+                except OSError as e:
+                    logger.warning("Cache de capas indisponível, feeds sem capas: %s", e)
+            root.scanner = LibraryScanner(
+                root.path,
+                functools.partial(self._make_book, root),
+                self.SUPPORTED_EXTENSIONS,
+                skip=[root.cache_dir / '.opds_covers'],
+                workers=scan_workers,
+                content_hash=move_hash
+            )
+            self.roots[name] = root
+        
+        # Atalhos para a primeira raiz (a única, no caso comum)
+        default = self.get_library()
+        self.books_dir = default.path
+        self.cache_dir = Path(cache_dir) if cache_dir else default.cache_dir
+        self.scanner = default.scanner
+        self.last_delta = None
+        self.pages = PageStreamer(page_cache_size) if page_cache_size > 0 else None
+        self.open_files = OpenFileCache(open_files)
         
-    def scan_books(self):
+        # Versão do catálogo: muda apenas quando um escaneamento altera books_cache
+        self.catalog_version = 0
+        self.catalog_fingerprint = hashlib.md5().hexdigest()
+        self.catalog_updated = time.time()
+        self.search_index = SearchIndex()
+        self.time_index = TimeIndex()
+        self.catalog_index = self._build_index([])
+        # Modo multiprocesso: arquivo onde o processo de escaneamento publica
+        # cada versão do catálogo (e, ao lado, as métricas de escaneamento), e
+        # as versões já carregadas pelos processos de atendimento (ver
+        # ``follow_catalog``)
+        self.catalog_file = None
+        self._followed = None
+        self._followed_metrics = None
+        self.metrics = Metrics()
+        self.metrics.collect(self._collect_metrics)
+        self._scanning = set()   # raízes no primeiro escaneamento (publicado em lotes)
+        self._feed_cache = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializa a junção das raízes e a atualização do catálogo, feitas
+        # pelas threads de escaneamento de cada raiz
+        self._catalog_lock = threading.Lock()
+    
+    @property
+    def scan_in_progress(self):
+        """True enquanto alguma raiz estiver no primeiro escaneamento."""
+        return bool(self._scanning)
+    
+    def get_library(self, name=None):
         """
-        Escaneia o diretório de livros recursivamente.
+        Retorna uma raiz da biblioteca.
+        
+        Args:
+            name: Nome da raiz (padrão: a primeira)
         
         Returns:
-            Lista de dicionários com informações dos livros
+            LibraryRoot da raiz
+        
+        Raises:
+            KeyError: Se não houver raiz com esse nome
         """
-        books = []
+        if name is None:
+            return next(iter(self.roots.values()))
+        return self.roots[name]
+        
+    def scan_books(self, progressive=False, library=None):
+        """
+        Escaneia o diretório de uma raiz da biblioteca recursivamente.
+        
+        O escaneamento é incremental: diretórios que não mudaram desde o
+        escaneamento anterior não são listados novamente e os registros de
+        livros inalterados são reaproveitados. As mudanças encontradas
+        ficam em ``last_delta`` (do gerador e da raiz).
+        
+        Args:
+            progressive: Publicar o catálogo em lotes enquanto o escaneamento
+                         avança (usado quando ainda não há catálogo da raiz);
+                         os metadados e o índice de busca são aplicados lote a lote
+            library: Nome da raiz (padrão: a primeira)
+        
+        Returns:
+            Lista de BookRecord da raiz
+        """
+        root = self.get_library(library)
+        logger.info("Escaneando diretório: %s", root.path)
+        started = time.perf_counter()
+        
+        if progressive:
+            root.published = 0
+            with self._lock:
+                self._scanning.add(root.name)
+            books, delta = root.scanner.scan(progress=functools.partial(self._publish_progress, root))
+            self._publish_progress(root, delta, final=True)
+        else:
+            books, delta = root.scanner.scan()
+            self._apply_metadata(delta, root)
         
-        print(f"Escaneando diretório: {self.books_dir}")
-        
-        for file_path in self.books_dir.rglob('*'):
-            if file_path.is_file() and file_path.suffix.lower() in self.SUPPORTED_EXTENSIONS:
-                # Pular o arquivo OPDS
-                if file_path == self.opds_file:
-                    continue
-                
-                # Obter informações do arquivo
-                stat = file_path.stat()
-                relative_path = file_path.relative_to(self.books_dir)
-                
-                # Extrair informações do nome do arquivo e caminho
-                title = file_path.stem
-                category = relative_path.parent.name if relative_path.parent != Path('.') else 'Sem Categoria'
-                
-                book_info = {
-                    'title': title,
-                    'author': self._extract_author(file_path),
-                    'category': category,
-                    'file_path': str(relative_path),
-                    'file_size': stat.st_size,
-                    'modified': datetime.fromtimestamp(stat.st_mtime).isoformat() + 'Z',
-                    'extension': file_path.suffix.lower(),
-                    'mime_type': self._get_mime_type(file_path),
-                    'id': self._generate_id(str(relative_path)),
-                }
-                
-                books.append(book_info)
-        
-        print(f"Encontrados {len(books)} livros")
+        root.last_delta = self.last_delta = delta
+        self._record_scan(root, books, delta, started, 'scan')
+        logger.info(
+            "Encontrados %d livros%s (+%d novos, -%d removidos, ~%d modificados)",
+            len(books), f" em {root.name}" if root.name else '',
+            len(delta.added), len(delta.removed), len(delta.modified)
+        )
         return books
+
+    def _record_scan(self, root, books, delta, started, kind):
+        """
+        Registra a duração e o resultado de um escaneamento nas métricas.
+        
+        Com várias raízes, as amostras levam o rótulo ``library``.
+        
+        Args:
+            root: LibraryRoot escaneada
+            books: Livros encontrados
+            delta: ScanDelta do escaneamento
+            started: Valor de ``time.perf_counter()`` no início
+            kind: 'scan' (escaneamento da biblioteca) ou 'refresh' (diretórios
+                  apontados pelo inotify)
+        """
+        labels = {'library': root.name} if root.name else {}
+        self.metrics.observe('opds_scan_duration_seconds', time.perf_counter() - started, kind=kind, **labels)
+        self.metrics.set('opds_scan_books', len(books), **labels)
+        for change, books_changed in (('added', delta.added), ('removed', delta.removed),
+                                      ('modified', delta.modified)):
+            if books_changed:
+                self.metrics.inc('opds_scan_changes_total', len(books_changed), change=change, **labels)
+        
+        # No modo multiprocesso, quem atende /metrics são os processos de atendimento
+        if self.catalog_file is not None:
+            try:
+                save_metrics(self.scan_metrics_file(self.catalog_file), self.metrics.export(SCAN_METRICS))
+            except OSError as e:
+                logger.warning("Não foi possível publicar as métricas de escaneamento: %s", e)
     
-    def _extract_author(self, file_path):
+    @staticmethod
+    def scan_metrics_file(catalog_file):
+        """Arquivo das métricas de escaneamento publicadas junto com o catálogo."""
+        return f'{catalog_file}.metrics'
+
+    def _publish_progress(self, root, delta, final=False):
         """
-        Tenta extrair o autor do caminho do arquivo.
+        Publica os livros encontrados até agora no primeiro escaneamento.
+        
+        Chamado pelo escaneador após cada diretório. Quando há livros novos
+        suficientes, aplica metadados e busca apenas a eles e publica o
+        catálogo parcial (junto com os livros das outras raízes), que passa
+        a ser servido imediatamente.
         
         Args:
-            file_path: Caminho do arquivo
+            root: LibraryRoot sendo escaneada
+            delta: ScanDelta parcial do escaneamento em andamento
+            final: Processar os livros restantes sem publicar (a publicação
+                   final é feita por ``update_catalog``)
+        """
+        pending = delta.added[root.published:]
+        if not pending:
+            return
+        if not final and len(pending) < max(self.SCAN_BATCH_SIZE, root.published):
+            return
+        
+        batch = ScanDelta(pending, [], [])
+        self._apply_metadata(batch, root)
+        with self._catalog_lock:
+            self.search_index.update(batch)
+            self.time_index.update(batch)
+            root.published += len(pending)
+            # Os índices de busca e de data já contêm o lote: ele entra no
+            # catálogo mesmo que outra raiz publique antes desta
+            root.books = delta.added[:root.published]
+            if final:
+                return
+        
+            books = self._merged_books()
+            fingerprint = hashlib.md5(f'parcial:{len(books)}:{time.time()}'.encode('utf-8')).hexdigest()
+            self._publish(books, self._build_index(books), fingerprint, time.time())
+        logger.info("Escaneamento em andamento: %d livros publicados", len(books))
+    
+    def _make_book(self, root, file_path, relative_path, stat):
+        """
+        Monta o registro de um livro a partir do arquivo.
+        
+        Nas raízes com nome, o nome entra no ID: o mesmo caminho relativo em
+        duas raízes resulta em livros diferentes. O dispositivo e o inode
+        permitem ao escaneador reconhecer o livro se ele for movido.
+        
+        Args:
+            root: LibraryRoot onde está o arquivo
+            file_path: Caminho absoluto do arquivo
+            relative_path: Caminho relativo ao diretório da raiz
+            stat: Resultado de stat() do arquivo
             
+        Returns:
+            BookRecord do livro
+        """
+        file_path = Path(file_path)
+        relative_path = Path(relative_path)
+        
+        # Extrair informações do nome do arquivo e caminho
+        title = file_path.stem
+        category = relative_path.parent.name if relative_path.parent != Path('.') else 'Sem Categoria'
+        
+        author = self._extract_author(relative_path)
+        
+        relative = str(relative_path)
+        return BookRecord(
+            digest=self._generate_id(f'{root.name}/{relative}' if root.name else relative),
+            title=title,
+            authors=[author],
+            category=category,
+            file_path=str(relative_path),
+            file_size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            extension=file_path.suffix.lower(),
+            library=root.name,
+            inode=stat.st_ino,
+            device=stat.st_dev,
+        )
+    
+    def _apply_metadata(self, delta, root):
+        """
+        Completa os livros novos ou modificados com os metadados embutidos.
+        
+        Os metadados vêm do cache em disco da raiz quando o arquivo não
+        mudou; os demais são extraídos em um pool de processos. Os registros
+        dos livros movidos ou renomeados passam para o novo caminho antes da
+        consulta, então esses livros não são extraídos de novo.
+        
+        Args:
+            delta: ScanDelta do último escaneamento
+            root: LibraryRoot escaneada
+        """
+        if root.metadata is None:
+            return
+        books = delta.added + [new for _, new in delta.modified]
+        if not books:
+            return
+        
+        moved = [
+            ((old.file_path, old.file_size, old.modified), (new.file_path, new.file_size, new.modified))
+            for old, new in delta.modified
+            if old.file_path != new.file_path
+        ]
+        try:
+            if moved:
+                root.metadata.move(moved)
+            found = root.metadata.get_many(
+                root.path,
+                [(book.file_path, book.file_size, book.modified) for book in books]
+            )
+        except Exception as e:
+            logger.warning("Erro ao obter metadados: %s", e)
+            return
+        
+        for book in books:
+            data = found.get(book.file_path)
+            if data:
+                book.update_metadata(data)
+    
+    def _extract_author(self, relative):
+        """
+        Tenta extrair o autor do caminho do arquivo.
+        
+        Args:
+            relative: Caminho do arquivo relativo à raiz da biblioteca
+        
         Returns:
             Nome do autor ou "Desconhecido"
         """
         # Se o diretório pai for um autor (convenção comum)
-        relative = file_path.relative_to(self.books_dir)
-        
+
         # Verificar se há pelo menos 2 níveis (categoria/autor/livro.epub)
         if len(relative.parts) >= 2:
             # Assumir que o penúltimo diretório é o autor
@@ -119,21 +588,8 @@ class OPDSGenerator:
         Returns:
             String com o MIME type
         """
-        mime_map = {
-            '.epub': 'application/epub+zip',
-            '.pdf': 'application/pdf',
-            '.mobi': 'application/x-mobipocket-ebook',
-            '.azw': 'application/vnd.amazon.ebook',
-            '.azw3': 'application/vnd.amazon.ebook',
-            '.fb2': 'text/fb2+xml',
-            '.djvu': 'image/vnd.djvu',
-            '.cbz': 'application/x-cbz',
-            '.cbr': 'application/x-cbr',
-            '.txt': 'text/plain',
-        }
-        
         ext = file_path.suffix.lower()
-        return mime_map.get(ext, 'application/octet-stream')
+        return MIME_TYPES.get(ext, 'application/octet-stream')
     
     def _generate_id(self, path):
         """
@@ -143,18 +599,335 @@ class OPDSGenerator:
             path: Caminho relativo do arquivo
             
         Returns:
-            String com ID único
+            MD5 do caminho (16 bytes); em hexadecimal, é o ID usado nas URLs
+        """
+        return hashlib.md5(path.encode()).digest()
+    
+    def _fingerprint(self, books):
+        """
+        Calcula uma impressão digital estável do conteúdo do catálogo.
+        
+        Args:
+            books: Lista de BookRecord
+            
+        Returns:
+            String hexadecimal que muda sempre que algum livro muda
+        """
+        digest = hashlib.md5()
+        for book in sorted(books, key=lambda x: x.digest):
+            digest.update(repr(book.fields()).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def update_catalog(self, books, delta=None, indexed=False):
+        """
+        Substitui o catálogo em memória se o conteúdo tiver mudado.
+        
+        Os feeds em cache só são descartados quando o catálogo realmente muda.
+        Os índices de busca e de data são atualizados apenas com as mudanças
+        do escaneamento.
+        
+        Args:
+            books: Lista de BookRecord
+            delta: ScanDelta do escaneamento que produziu ``books``; se vazio,
+                   o catálogo é mantido sem recalcular a impressão digital.
+                   Sem delta, os índices de busca e de data são reconstruídos
+            indexed: Os índices de busca e de data já contêm as mudanças de ``delta``
+                     (escaneamento publicado em lotes)
+            
+        Returns:
+            True se o catálogo mudou, False caso contrário
+        """
+        if delta is not None and delta_is_empty(delta) and self.catalog_version:
+            return False
+        
+        fingerprint = self._fingerprint(books)
+        if fingerprint == self.catalog_fingerprint and self.catalog_version:
+            return False
+        
+        self._apply_changes(books, delta, indexed)
+        self._publish(books, self._build_index(books), fingerprint, time.time())
+        return True
+    
+    def _update_root(self, root, books, delta, indexed=False):
+        """
+        Substitui os livros de uma raiz e atualiza o catálogo combinado.
+        
+        Args:
+            root: LibraryRoot escaneada
+            books: Livros encontrados na raiz
+            delta: ScanDelta do escaneamento da raiz
+            indexed: Os índices de busca e de data já contêm as mudanças de ``delta``
+        
+        Returns:
+            True se o catálogo mudou, False caso contrário
+        """
+        with self._catalog_lock:
+            root.books = books
+            return self.update_catalog(self._merged_books(), delta, indexed)
+    
+    def _merged_books(self):
+        """Junta os livros de todas as raízes (chamar com ``_catalog_lock``)."""
+        books = []
+        for root in self.roots.values():
+            if root.books:
+                books.extend(root.books)
+        return books
+    
+    def _book_path(self, book):
+        """Caminho absoluto do arquivo de um livro."""
+        return os.path.join(self.roots[book.library].absolute, book.file_path)
+
+    def _apply_changes(self, books, delta, indexed=False):
+        """
+        Atualiza os índices e o cache de arquivos abertos para um novo catálogo.
+        
+        Args:
+            books: Lista de BookRecord do novo catálogo
+            delta: ScanDelta em relação ao catálogo atual (None reconstrói tudo)
+            indexed: Os índices de busca e de data já contêm as mudanças de ``delta``
+        """
+        if indexed:
+            pass
+        elif delta is not None:
+            self.search_index.update(delta)
+            self.time_index.update(delta)
+        else:
+            self.search_index.rebuild(books)
+            self.time_index.rebuild(books)
+        
+        # Arquivos alterados ou removidos não podem continuar abertos no cache
+        if delta is not None:
+            changed = delta.removed + [old for old, _ in delta.modified]
+            self.open_files.invalidate(self._book_path(book) for book in changed)
+        else:
+            self.open_files.clear()
+    
+    def _publish(self, books, index, fingerprint, updated):
+        """
+        Troca o catálogo em uso e descarta os feeds em cache.
+        
+        Args:
+            books: Lista de BookRecord
+            index: CatalogIndex construído a partir de ``books``
+            fingerprint: Impressão digital do catálogo
+            updated: Timestamp da última alteração do catálogo
         """
-        return hashlib.md5(path.encode()).hexdigest()
+        with self._lock:
+            self.books_cache = books
+            self.catalog_index = index
+            self.catalog_fingerprint = fingerprint
+            self.catalog_version += 1
+            self.catalog_updated = updated
+            self._feed_cache.clear()
+            scanning = tuple(self._scanning)
+        self._save_published(books, fingerprint, updated, scanning)
     
-    def generate_opds_xml(self, books, base_url=None):
+    def _save_published(self, books, fingerprint, updated, scanning):
+        """
+        Publica o catálogo para os processos de atendimento (modo multiprocesso).
+        
+        Args:
+            books: Lista de BookRecord
+            fingerprint: Impressão digital do catálogo
+            updated: Timestamp da última alteração do catálogo
+            scanning: Raízes no primeiro escaneamento (ver ``scan_in_progress``)
+        """
+        if self.catalog_file is None:
+            return
+        try:
+            save_catalog(self.catalog_file, books, fingerprint, updated, scanning)
+        except OSError as e:
+            logger.warning("Não foi possível publicar o catálogo: %s", e)
+    
+    def _follow_scan_metrics(self, path):
+        """
+        Carrega as métricas de escaneamento publicadas, se mudaram.
+        
+        Args:
+            path: Caminho do arquivo publicado (ver ``scan_metrics_file``)
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._followed_metrics:
+            return
+        state = load_metrics(path)
+        if state is not None:
+            self._followed_metrics = signature
+            self.metrics.replace(SCAN_METRICS, state)
+    
+    def follow_catalog(self, path):
+        """
+        Carrega a versão do catálogo publicada pelo processo de escaneamento.
+        
+        Usado pelos processos de atendimento no modo multiprocesso: verificar
+        se há versão nova custa um ``stat``. Só as diferenças em relação ao
+        catálogo atual são aplicadas aos índices, e os livros inalterados
+        continuam sendo os mesmos objetos. As métricas de escaneamento
+        publicadas ao lado do catálogo substituem as deste processo, que não
+        escaneia.
+        
+        Args:
+            path: Caminho do arquivo publicado (ver ``catalog_file``)
+        
+        Returns:
+            True se o catálogo mudou, False caso contrário
+        """
+        self._follow_scan_metrics(self.scan_metrics_file(path))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._followed:
+            return False
+        
+        loaded = load_catalog(path)
+        if loaded is None:
+            return False
+        books, fingerprint, updated, scanning = loaded
+        self._followed = signature
+        # O aviso de escaneamento em andamento segue o processo de escaneamento
+        scanning = set(scanning)
+        if scanning != self._scanning:
+            with self._lock:
+                self._scanning = scanning
+                self._feed_cache.clear()
+        if fingerprint == self.catalog_fingerprint and self.catalog_version:
+            return False
+        
+        current = {book.digest: book for book in self.books_cache}
+        added, modified = [], []
+        for position, book in enumerate(books):
+            old = current.pop(book.digest, None)
+            if old is None:
+                added.append(book)
+            elif old.fields() != book.fields():
+                modified.append((old, book))
+            else:
+                books[position] = old
+        delta = ScanDelta(added, list(current.values()), modified)
+        
+        self._apply_changes(books, delta)
+        # Mesma impressão digital e data do processo de escaneamento: os
+        # ETags são os mesmos em todos os processos
+        self._publish(books, self._build_index(books), fingerprint, updated)
+        return True
+    
+    def load_snapshot(self):
+        """
+        Restaura o catálogo salvo em disco pela última execução.
+        
+        Cada raiz tem o próprio snapshot; as raízes sem snapshot são
+        publicadas em lotes no primeiro escaneamento. O catálogo restaurado
+        pode ser servido imediatamente; o próximo ``generate()`` revalida
+        todos os diretórios, reaproveitando os livros que não mudaram. O
+        índice de busca é reconstruído em segundo plano (buscas feitas nesse
+        meio tempo aguardam a reconstrução).
+        
+        Returns:
+            True se algum snapshot foi carregado, False caso contrário
+        """
+        restored = []
+        for root in self.roots.values():
+            loaded = load_snapshot(root.snapshot_file, root.path)
+            if loaded is None:
+                continue
+            directories, fingerprint, updated = loaded
+            root.scanner.restore(directories)
+            books = root.scanner.books()
+            if books and books[0].library != root.name:
+                # Snapshot de quando a raiz tinha outro nome (os IDs mudaram)
+                root.scanner.restore({})
+                continue
+            root.books = books
+            restored.append((fingerprint, updated))
+        if not restored:
+            return False
+        
+        with self._catalog_lock:
+            books = self._merged_books()
+            # Todos os snapshots gravados com o mesmo catálogo: mesma impressão
+            # digital e data, e ETags e Last-Modified continuam válidos nos clientes
+            fingerprints = {fingerprint for fingerprint, _ in restored}
+            if len(restored) == len(self.roots) and len(fingerprints) == 1:
+                fingerprint = fingerprints.pop()
+            else:
+                fingerprint = self._fingerprint(books)
+            updated = max(updated for _, updated in restored)
+        
+            self.search_index.invalidate()
+            threading.Thread(target=self.search_index.rebuild, args=(books,), daemon=True).start()
+            self.time_index.rebuild(books)
+            self._publish(books, self._build_index(books), fingerprint, updated)
+        return True
+    
+    def save_snapshot(self, library=None):
+        """
+        Salva o índice de uma raiz em disco para a próxima inicialização.
+        
+        Args:
+            library: Nome da raiz (padrão: a primeira)
+        
+        Returns:
+            Caminho do snapshot ou None se não foi possível salvar
+        """
+        root = self.get_library(library)
+        try:
+            save_snapshot(
+                root.snapshot_file, root.path, root.scanner.directories(),
+                self.catalog_fingerprint, self.catalog_updated
+            )
+        except OSError as e:
+            logger.warning("Não foi possível salvar o snapshot do catálogo: %s", e)
+            return None
+        logger.info("Snapshot do catálogo salvo em: %s", root.snapshot_file)
+        return root.snapshot_file
+    
+    def _build_index(self, books):
+        """
+        Constrói os índices de categoria e autor a partir da lista de livros.
+        
+        A ordem por data vem de ``self.time_index``, que deve já refletir
+        ``books``.
+        
+        Args:
+            books: Lista de BookRecord
+            
+        Returns:
+            CatalogIndex com os livros ordenados e agrupados
+        """
+        ordered = sorted(books, key=lambda x: (x.category, x.author, x.title))
+        
+        categories = OrderedDict()
+        by_id = {}
+        libraries = None
+        if len(self.roots) > 1:
+            libraries = OrderedDict((name, ([], OrderedDict())) for name in self.roots)
+        for book in ordered:
+            authors = categories.setdefault(book.category, OrderedDict())
+            authors.setdefault(book.author, []).append(book)
+            by_id[book.digest] = book
+            if libraries is not None and book.library in libraries:
+                library_books, library_categories = libraries[book.library]
+                library_books.append(book)
+                library_categories.setdefault(book.category, OrderedDict()).setdefault(book.author, []).append(book)
+        
+        by_time = TimeOrderedBooks(self.time_index.keys(), by_id)
+        return CatalogIndex(books=ordered, categories=categories, by_id=by_id, by_time=by_time,
+                            libraries=libraries)
+    
+    def generate_opds_xml(self, books, base_url=None, updated=None):
         """
         Gera o XML do feed OPDS.
         
         Args:
-            books: Lista de dicionários com informações dos livros
+            books: Lista de BookRecord
             base_url: URL base para os links (ex: http://192.168.1.100:8080)
                      Se None, usa um placeholder
+            updated: Timestamp da última alteração do catálogo (padrão: agora)
             
         Returns:
             String com XML formatado
@@ -163,84 +936,366 @@ class OPDSGenerator:
         if base_url is None:
             base_url = f"http://SERVER_IP:{self.port}"
         
-        # Criar elemento raiz
-        feed = Element('feed')
-        for key, value in self.NAMESPACES.items():
-            feed.set(key, value)
-        
-        # Metadados do feed
-        SubElement(feed, 'id').text = 'opds-gen:root'
-        SubElement(feed, 'title').text = 'Catálogo de Livros'
-        SubElement(feed, 'updated').text = datetime.utcnow().isoformat() + 'Z'
-        
-        # Link para o próprio feed
-        link_self = SubElement(feed, 'link')
-        link_self.set('rel', 'self')
-        link_self.set('type', 'application/atom+xml;profile=opds-catalog;kind=acquisition')
-        link_self.set('href', f'{base_url}/opds')
-        
-        # Link de início
-        link_start = SubElement(feed, 'link')
-        link_start.set('rel', 'start')
-        link_start.set('type', 'application/atom+xml;profile=opds-catalog;kind=acquisition')
-        link_start.set('href', f'{base_url}/opds')
-        
-        # Adicionar cada livro como entry
-        for book in sorted(books, key=lambda x: (x['category'], x['author'], x['title'])):
-            entry = SubElement(feed, 'entry')
+        if updated is None:
+            updated = time.time()
+        
+        return ''.join(self.iter_opds_xml(books, base_url, updated))
+    
+    def iter_opds_xml(self, books, base_url, updated, pretty=None):
+        """
+        Gera o XML do feed OPDS de forma incremental.
+        
+        Cada entrada é escapada e produzida individualmente, sem montar a
+        árvore XML inteira na memória.
+        
+        Args:
+            books: Lista de BookRecord
+            base_url: URL base para os links
+            updated: Timestamp da última alteração do catálogo
+            pretty: Indentar o XML (padrão: configuração do gerador)
             
-            # ID e título
-            SubElement(entry, 'id').text = f"opds-gen:book:{book['id']}"
-            SubElement(entry, 'title').text = book['title']
-            SubElement(entry, 'updated').text = book['modified']
+        Yields:
+            Trechos de texto do documento XML
+        """
+        nl, indent = self._whitespace(pretty)
+        ordered = sorted(books, key=lambda x: (x.category, x.author, x.title))
+        return self._iter_feed(
+            'opds-gen:all', 'Catálogo de Livros', base_url, '/opds/all',
+            self.ACQUISITION_TYPE, updated, [],
+            (self._entry_xml(book, base_url, nl, indent) for book in ordered),
+            pretty,
+        )
+    
+    def _whitespace(self, pretty=None):
+        """
+        Retorna a quebra de linha e a unidade de indentação do XML.
+        
+        Args:
+            pretty: Indentar o XML (padrão: configuração do gerador)
             
-            # Autor
-            author = SubElement(entry, 'author')
-            SubElement(author, 'name').text = book['author']
+        Returns:
+            Tupla (quebra de linha, indentação)
+        """
+        if pretty is None:
+            pretty = self.pretty
+        return ('\n', '  ') if pretty else ('', '')
+    
+    def _iter_feed(self, feed_id, title, base_url, path, kind, updated, links, entries, pretty=None):
+        """
+        Produz um feed Atom incrementalmente.
+        
+        Args:
+            feed_id: Identificador do feed
+            title: Título do feed
+            base_url: URL base para os links
+            path: Caminho do próprio feed (com query string, se houver)
+            kind: MIME type do feed (navegação ou aquisição)
+            updated: Timestamp da última alteração do catálogo
+            links: Lista de tuplas (rel, tipo, caminho) com links adicionais
+            entries: Iterador de entries já serializadas
+            pretty: Indentar o XML (padrão: configuração do gerador)
             
-            # Categoria
-            category = SubElement(entry, 'category')
-            category.set('term', book['category'])
-            category.set('label', book['category'])
+        Yields:
+            Trechos de texto do documento XML
+        """
+        nl, indent = self._whitespace(pretty)
+        namespaces = ''.join(f' {key}={_quote_attr(value)}' for key, value in self.NAMESPACES.items())
+        
+        header = [
+            f'<?xml version="1.0" encoding="utf-8"?>{nl}',
+            f'<feed{namespaces}>{nl}',
+            f'{indent}<id>{_escape(feed_id)}</id>{nl}',
+            f'{indent}<title>{_escape(title)}</title>{nl}',
+            f'{indent}<updated>{datetime.utcfromtimestamp(updated).isoformat()}Z</updated>{nl}',
+            f'{indent}{_link("self", kind, base_url + path)}{nl}',
+            f'{indent}{_link("start", self.NAVIGATION_TYPE, base_url + "/opds")}{nl}',
+            f'{indent}{_link("search", self.OPENSEARCH_TYPE, base_url + "/opds/opensearch.xml")}{nl}',
+            f'{indent}{_link("search", self.ACQUISITION_TYPE, base_url + "/opds/search?q={searchTerms}")}{nl}',
+        ]
+        for rel, link_type, link_path in links:
+            header.append(f'{indent}{_link(rel, link_type, base_url + link_path)}{nl}')
+        yield ''.join(header)
+        
+        for entry in entries:
+            yield entry
+        
+        yield f'</feed>{nl}'
+    
+    def _navigation_entry_xml(self, entry, base_url, updated, nl, indent):
+        """
+        Serializa uma entry de navegação (link para outro feed).
+        
+        Args:
+            entry: NavigationEntry
+            base_url: URL base para os links
+            updated: Timestamp da última alteração do catálogo
+            nl: Quebra de linha ('' no modo compacto)
+            indent: Unidade de indentação ('' no modo compacto)
             
-            # Sumário/Descrição
-            summary = SubElement(entry, 'summary')
-            summary.set('type', 'text')
-            summary.text = f"{book['title']} por {book['author']} ({book['extension'].upper()})"
+        Returns:
+            String com o XML da entry
+        """
+        i1, i2 = indent, indent * 2
+        return (
+            f'{i1}<entry>{nl}'
+            f'{i2}<id>{_escape(entry.id)}</id>{nl}'
+            f'{i2}<title>{_escape(entry.title)}</title>{nl}'
+            f'{i2}<updated>{datetime.utcfromtimestamp(updated).isoformat()}Z</updated>{nl}'
+            f'{i2}<content type="text">{_escape(entry.content)}</content>{nl}'
+            f'{i2}{_link("subsection", entry.kind, base_url + entry.href)}{nl}'
+            f'{i1}</entry>{nl}'
+        )
+    
+    def _entry_xml(self, book, base_url, nl, indent):
+        """
+        Serializa a entry de aquisição de um livro.
+        
+        Args:
+            book: BookRecord do livro
+            base_url: URL base para os links
+            nl: Quebra de linha ('' no modo compacto)
+            indent: Unidade de indentação ('' no modo compacto)
             
-            # Link para download (aquisição)
-            link_acquisition = SubElement(entry, 'link')
-            link_acquisition.set('rel', 'http://opds-spec.org/acquisition')
-            link_acquisition.set('type', book['mime_type'])
+        Returns:
+            String com o XML da entry
+        """
+        i1, i2, i3 = indent, indent * 2, indent * 3
+        book_id = book.id
+        authors = book.authors
+        summary = book.description or (
+            f"{book.title} por {', '.join(authors)} ({book.extension.upper()})"
+        )
+        if book.series:
+            position = f" #{book.series_index}" if book.series_index else ''
+            summary = f"Série: {book.series}{position}\n{summary}"
+        
+        acquisition = _link(
+            'http://opds-spec.org/acquisition',
+            book.mime_type,
+            self._download_url(book, base_url),
+            length=str(book.file_size),
+        )
+        
+        images = ''
+        covers = self._cover_urls(book, base_url)
+        if covers:
+            cover, thumbnail = covers
+            images = (
+                f'{i2}{_link("http://opds-spec.org/image", "image/jpeg", cover)}{nl}'
+                f'{i2}{_link("http://opds-spec.org/image/thumbnail", "image/jpeg", thumbnail)}{nl}'
+            )
+        
+        # Streaming de páginas (OPDS-PSE): o cliente lê o quadrinho página a
+        # página, substituindo {pageNumber} e {maxWidth} na URL. A quantidade
+        # de páginas vem da extração de metadados: gerar o feed não abre arquivos
+        stream = ''
+        if self.pages is not None and book.page_count:
+            pages_url = (
+                f"{base_url}/pages/{book_id}?page={{pageNumber}}&width={{maxWidth}}"
+                f"&v={CoverCache.version(book)}"
+            )
+            stream = f'{i2}{_link(PSE_REL, "image/jpeg", pages_url, **{"pse:count": str(book.page_count)})}{nl}'
+        
+        return (
+            f'{i1}<entry>{nl}'
+            f'{i2}<id>opds-gen:book:{book_id}</id>{nl}'
+            f'{i2}<title>{_escape(book.title)}</title>{nl}'
+            f'{i2}<updated>{book.modified}</updated>{nl}'
+            + ''.join(
+                f'{i2}<author>{nl}'
+                f'{i3}<name>{_escape(author)}</name>{nl}'
+                f'{i2}</author>{nl}'
+                for author in authors
+            )
+            + (f'{i2}<dc:language>{_escape(book.language)}</dc:language>{nl}' if book.language else '')
+            + f'{i2}<category term={_quote_attr(book.category)} label={_quote_attr(book.category)}/>{nl}'
+            f'{i2}<summary type="text">{_escape(summary)}</summary>{nl}'
+            f'{i2}{acquisition}{nl}'
+            + images
+            + stream
+            + f'{i1}</entry>{nl}'
+        )
+    
+    def _download_url(self, book, base_url):
+        """
+        URL de download de um livro.
+        
+        O livro é identificado pelo ID (resolvido pelo índice do catálogo, sem
+        tocar no sistema de arquivos); o nome do arquivo vai na URL apenas para
+        os clientes que o usam ao salvar.
+        """
+        filename = urllib.parse.quote(os.path.basename(book.file_path), safe='')
+        return f"{base_url}/download/{book.id}/{filename}"
+    
+    def _cover_urls(self, book, base_url):
+        """
+        URLs da capa e da miniatura de um livro.
+        
+        A versão na URL muda com o arquivo, permitindo cache longo nos clientes.
+        
+        Returns:
+            Tupla (URL da capa, URL da miniatura) ou None se o formato não
+            tiver capa ou as capas estiverem desativadas
+        """
+        if book.extension not in COVER_FORMATS or self.roots[book.library].covers is None:
+            return None
+        query = f"{book.id}?v={CoverCache.version(book)}"
+        return f"{base_url}/covers/{query}", f"{base_url}/thumbnails/{query}"
+    
+    def _publication_json(self, book, base_url):
+        """
+        Serializa um livro como publicação de um feed OPDS 2.0.
+        
+        Args:
+            book: BookRecord
+            base_url: URL base para os links
             
-            # Encodar a URL corretamente para caracteres especiais
-            # Usar quote com safe='/' para manter as barras
-            encoded_path = urllib.parse.quote(book['file_path'], safe='')
-            link_acquisition.set('href', f"{base_url}/books/{encoded_path}")
+        Returns:
+            String com o objeto JSON da publicação
+        """
+        metadata = {
+            '@type': 'http://schema.org/Book',
+            'identifier': f'opds-gen:book:{book.id}',
+            'title': book.title,
+            'author': [{'name': author} for author in book.authors],
+            'modified': book.modified,
+            'subject': [{'name': book.category}],
+        }
+        if book.language:
+            metadata['language'] = book.language
+        if book.description:
+            metadata['description'] = book.description
+        if book.series:
+            series = {'name': book.series}
+            if book.series_index:
+                series['position'] = book.series_index
+            metadata['belongsTo'] = {'series': [series]}
+        
+        publication = {
+            'metadata': metadata,
+            'links': [{
+                'rel': 'http://opds-spec.org/acquisition',
+                'href': self._download_url(book, base_url),
+                'type': book.mime_type,
+            }],
+        }
+        covers = self._cover_urls(book, base_url)
+        if covers:
+            cover, thumbnail = covers
+            publication['images'] = [
+                {'href': cover, 'type': 'image/jpeg', 'rel': 'cover'},
+                {'href': thumbnail, 'type': 'image/jpeg', 'rel': 'http://opds-spec.org/image/thumbnail'},
+            ]
+        return json.dumps(publication, ensure_ascii=False, separators=(',', ':'))
+    
+    def _iter_json_feed(self, title, base_url, path, updated, links, items_key, items, pagination=None):
+        """
+        Produz um feed OPDS 2.0 (JSON) incrementalmente.
+        
+        O JSON é sempre compacto: ``pretty`` vale apenas para o XML.
+        
+        Args:
+            title: Título do feed
+            base_url: URL base para os links
+            path: Caminho do próprio feed (com query string, se houver)
+            updated: Timestamp da última alteração do catálogo
+            links: Lista de tuplas (rel, caminho) com links adicionais
+            items_key: 'navigation' ou 'publications'
+            items: Iterador de itens já serializados em JSON
+            pagination: Tupla (total de itens, página atual) nos feeds paginados
             
-            # Adicionar tamanho do arquivo como atributo
-            link_acquisition.set('length', str(book['file_size']))
+        Yields:
+            Trechos de texto do documento JSON
+        """
+        metadata = {
+            'title': title,
+            'modified': f'{datetime.utcfromtimestamp(updated).isoformat()}Z',
+        }
+        if pagination is not None:
+            total, page = pagination
+            metadata.update(numberOfItems=total, itemsPerPage=self.page_size, currentPage=page)
         
-        # Formatar XML de forma legível
-        xml_str = tostring(feed, encoding='unicode')
-        dom = minidom.parseString(xml_str)
-        return dom.toprettyxml(indent='  ', encoding='utf-8').decode('utf-8')
+        feed_links = [
+            {'rel': 'self', 'href': base_url + path, 'type': self.OPDS2_TYPE},
+            {'rel': 'start', 'href': f'{base_url}/opds/v2', 'type': self.OPDS2_TYPE},
+            {'rel': 'search', 'href': f'{base_url}/opds/v2/search{{?q}}', 'type': self.OPDS2_TYPE,
+             'templated': True},
+        ]
+        feed_links.extend({'rel': rel, 'href': base_url + link_path, 'type': self.OPDS2_TYPE}
+                          for rel, link_path in links)
+        
+        header = json.dumps({'metadata': metadata, 'links': feed_links}, ensure_ascii=False, separators=(',', ':'))
+        yield f'{header[:-1]},"{items_key}":['
+        first = True
+        for item in items:
+            yield item if first else ',' + item
+            first = False
+        yield ']}'
     
-    def generate(self):
-        """Gera o feed OPDS e salva em arquivo (versão estática para cache)."""
-        # Escanear livros
-        self.books_cache = self.scan_books()
+    def generate(self, library=None):
+        """
+        Escaneia os livros, atualiza o catálogo e salva o snapshot em disco.
+        
+        Args:
+            library: Nome da raiz a escanear (padrão: todas, uma após a outra)
         
-        # Gerar XML com placeholder (apenas para referência)
-        opds_xml = self.generate_opds_xml(self.books_cache)
+        Returns:
+            Caminho do snapshot (o da última raiz escaneada) ou None
+        """
+        if library is None:
+            snapshot = None
+            for name in self.roots:
+                snapshot = self.generate(name)
+            return snapshot
         
-        # Salvar arquivo
-        with open(self.opds_file, 'w', encoding='utf-8') as f:
-            f.write(opds_xml)
+        root = self.roots[library]
+        # Sem catálogo ainda da raiz (primeira execução), publicar em lotes durante o escaneamento
+        progressive = root.books is None
+        books = self.scan_books(progressive, library)
+        changed = self._update_root(root, books, root.last_delta, indexed=progressive)
+        if root.name in self._scanning:
+            # Publicado mesmo sem mudanças nos livros, para que os processos
+            # de atendimento deixem de mostrar o escaneamento em andamento
+            with self._catalog_lock:
+                with self._lock:
+                    self._scanning.discard(root.name)
+                    self._feed_cache.clear()
+                    published = (self.books_cache, self.catalog_fingerprint, self.catalog_updated,
+                                 tuple(self._scanning))
+                self._save_published(*published)
         
-        print(f"Feed OPDS salvo em: {self.opds_file}")
+        # Sem mudanças, os feeds em cache e o snapshot continuam válidos
+        if not changed and root.snapshot_file.exists():
+            return root.snapshot_file
         
-        return self.opds_file
+        return self.save_snapshot(library)
+    
+    def refresh(self, relative_dirs, library=None):
+        """
+        Atualiza o catálogo listando novamente apenas os diretórios indicados.
+        
+        Args:
+            relative_dirs: Diretórios relativos ao diretório da raiz que mudaram
+            library: Nome da raiz (padrão: a primeira)
+        
+        Returns:
+            True se o catálogo mudou, False caso contrário
+        """
+        root = self.get_library(library)
+        started = time.perf_counter()
+        books, delta = root.scanner.refresh(relative_dirs)
+        root.last_delta = self.last_delta = delta
+        self._apply_metadata(delta, root)
+        self._record_scan(root, books, delta, started, 'refresh')
+        if not self._update_root(root, books, delta):
+            return False
+        
+        logger.info(
+            "Catálogo atualizado: %d livros (+%d novos, -%d removidos, ~%d modificados)",
+            len(self.books_cache), len(delta.added), len(delta.removed), len(delta.modified)
+        )
+        self.save_snapshot(library)
+        return True
     
     def get_opds_content(self, base_url):
         """
@@ -250,7 +1305,565 @@ class OPDSGenerator:
             base_url: URL base para gerar os links (ex: http://192.168.1.100:8080)
         
         Returns:
-            String com o conteúdo XML do feed personalizado
+            String com o conteúdo XML do feed de navegação raiz
+        """
+        return self.get_feed(base_url).content.decode('utf-8')
+    
+    def _collect_metrics(self):
+        """Valores lidos na hora de exportar as métricas (ver ``Metrics.collect``)."""
+        samples = [('opds_catalog_version', self.catalog_version, {})]
+        covers = [root.covers for root in self.roots.values() if root.covers is not None]
+        if covers:
+            samples.append(('opds_cache_requests_total', sum(c.hits for c in covers),
+                            {'cache': 'covers', 'result': 'hit'}))
+            samples.append(('opds_cache_requests_total', sum(c.misses for c in covers),
+                            {'cache': 'covers', 'result': 'miss'}))
+        samples.append(('opds_cache_requests_total', self.open_files.hits, {'cache': 'files', 'result': 'hit'}))
+        samples.append(('opds_cache_requests_total', self.open_files.misses, {'cache': 'files', 'result': 'miss'}))
+        if self.pages is not None:
+            samples.append(('opds_cache_requests_total', self.pages.hits, {'cache': 'pages', 'result': 'hit'}))
+            samples.append(('opds_cache_requests_total', self.pages.misses, {'cache': 'pages', 'result': 'miss'}))
+        return samples
+    
+    def get_book(self, book_id):
+        """
+        Procura um livro do catálogo pelo ID.
+        
+        Args:
+            book_id: ID do livro em hexadecimal
+            
+        Returns:
+            BookRecord do livro ou None
+        """
+        try:
+            digest = bytes.fromhex(book_id)
+        except ValueError:
+            return None
+        return self.catalog_index.by_id.get(digest)
+    
+    def get_download(self, book_id):
         """
-        # Gerar OPDS dinâmico com a URL correta
-        return self.generate_opds_xml(self.books_cache, base_url)
+        Resolve o ID de um livro para o arquivo a ser enviado.
+        
+        O caminho vem do escaneamento, que já garante que o arquivo está
+        dentro do diretório da sua raiz; nenhuma chamada ao sistema de
+        arquivos é feita aqui.
+        
+        Args:
+            book_id: ID do livro em hexadecimal
+            
+        Returns:
+            Tupla (livro, caminho absoluto do arquivo) ou None se o livro
+            não existir
+        """
+        book = self.get_book(book_id)
+        if book is None:
+            return None
+        return book, self._book_path(book)
+    
+    def library_path(self, relative_path):
+        """
+        Resolve um caminho das URLs ``/books/`` para a raiz onde está o livro.
+        
+        Com várias raízes, o primeiro componente do caminho é o nome da raiz.
+        
+        Args:
+            relative_path: Caminho relativo (separado por '/')
+        
+        Returns:
+            Tupla (diretório da raiz, caminho relativo à raiz) ou None se a
+            raiz não existir
+        """
+        if len(self.roots) == 1:
+            return self.get_library().path, relative_path
+        name, _, rest = relative_path.lstrip('/').partition('/')
+        root = self.roots.get(name)
+        if root is None:
+            return None
+        return root.path, rest
+    
+    def get_cover(self, book_id, thumbnail=False):
+        """
+        Retorna a capa (ou miniatura) de um livro, extraindo-a na primeira vez.
+        
+        Args:
+            book_id: ID do livro
+            thumbnail: Retornar a miniatura em vez da capa
+            
+        Returns:
+            Tupla (livro, caminho da imagem, MIME type) ou None se o livro
+            não existir ou não tiver capa
+        """
+        book = self.get_book(book_id)
+        if book is None:
+            return None
+        root = self.roots[book.library]
+        if root.covers is None:
+            return None
+        found = root.covers.get(book, root.path, thumbnail)
+        if found is None:
+            return None
+        return (book,) + found
+    
+    def get_page(self, book_id, number, max_width=None):
+        """
+        Retorna uma página de um quadrinho (OPDS-PSE).
+        
+        Args:
+            book_id: ID do livro
+            number: Número da página (a partir de 0)
+            max_width: Largura máxima em pixels (ou None)
+            
+        Returns:
+            Tupla (livro, bytes da página, MIME type) ou None se o livro ou a
+            página não existirem
+        """
+        book = self.get_book(book_id)
+        if book is None or self.pages is None:
+            return None
+        found = self.pages.get_page(book, self.roots[book.library].path, number, max_width)
+        if found is None:
+            return None
+        return (book,) + found
+    
+    def get_feed(self, base_url, feed_path='', page=1, stream=False, query=None, encoding=None):
+        """
+        Retorna um feed OPDS renderizado para a URL base, usando o cache.
+        
+        Cada feed é renderizado no máximo uma vez por versão do catálogo,
+        página e URL base; as requisições seguintes reutilizam os bytes prontos.
+        
+        Args:
+            base_url: URL base para gerar os links (ex: http://192.168.1.100:8080)
+            feed_path: Caminho do feed após ``/opds`` (ex: ``/categories/Ficção``)
+                       ou a lista dos seus segmentos já decodificados, que
+                       podem conter '/' (ex: ``['categories', 'Rock', 'AC/DC']``)
+            page: Número da página (a partir de 1) nos feeds de aquisição
+            stream: Se True e o feed não estiver em cache, ``content`` é um
+                    iterador de blocos de bytes que preenche o cache ao final
+            query: Texto da busca (apenas para ``/search``)
+            encoding: Codificação aceita pelo cliente ('gzip', 'deflate' ou
+                      None); feeds pequenos são devolvidos sem compressão
+        
+        Returns:
+            CachedFeed com o conteúdo, o ETag, a data de modificação e o
+            MIME type, ou None se o feed ou a página não existir
+        """
+        if isinstance(feed_path, str):
+            feed_path = feed_path.split('/')
+        feed_path = tuple(part for part in feed_path if part)
+        # Consultas equivalentes ("Ação", "acao ") compartilham o mesmo feed em cache
+        query = ' '.join(tokenize(query)) if query else ''
+        if encoding:
+            return self._get_encoded_feed(base_url, feed_path, page, query, encoding)
+        return self._get_plain_feed(base_url, feed_path, page, stream, query)
+    
+    def _get_plain_feed(self, base_url, feed_path, page, stream, query, count=True):
+        """
+        Retorna um feed sem compressão, do cache ou renderizando-o.
+        
+        Args:
+            base_url: URL base para gerar os links
+            feed_path: Tupla com os segmentos do caminho do feed
+            page: Número da página
+            stream: Devolver um iterador se o feed não estiver em cache
+            query: Consulta normalizada
+            count: Registrar o acerto ou a falha do cache nas métricas (False
+                   quando a requisição já foi contada pela variante comprimida)
+        
+        Returns:
+            CachedFeed ou None se o feed ou a página não existir
+        """
+        with self._lock:
+            # O aviso de escaneamento em andamento muda o feed raiz sem mudar o
+            # catálogo: faz parte da chave e do ETag
+            scanning = bool(self._scanning)
+            key = (feed_path, page, base_url, query, scanning)
+            cached = self._feed_cache.get(key)
+            if cached is not None:
+                self._feed_cache.move_to_end(key)
+            index = self.catalog_index
+            version = self.catalog_version
+            fingerprint = self.catalog_fingerprint
+            updated = self.catalog_updated
+        if count:
+            self.metrics.inc('opds_cache_requests_total', cache='feed', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return cached
+        
+        started = time.perf_counter()
+        rendered = self._render_feed(feed_path, page, base_url, updated, index, query, scanning)
+        if rendered is None:
+            return None
+        content_type, parts = rendered
+        
+        # O ETag depende só do conteúdo do catálogo, do feed, da URL base e do
+        # formato, então é conhecido antes de renderizar (permite 304 e streaming)
+        path = '/'.join(_quote(part) for part in feed_path)
+        etag_source = f'{fingerprint}|/{path}|{page}|{base_url}|{self.pretty}|{query}|{scanning}'.encode('utf-8')
+        etag = '"' + hashlib.md5(etag_source).hexdigest() + '"'
+        chunks = _encode_chunks(parts)
+        
+        if stream:
+            return CachedFeed(
+                content=self._stream_and_cache(key, version, chunks, etag, updated, content_type, started),
+                etag=etag,
+                last_modified=updated,
+                content_type=content_type,
+            )
+        
+        feed = CachedFeed(b''.join(chunks), etag, updated, content_type)
+        self.metrics.observe('opds_feed_render_seconds', time.perf_counter() - started)
+        self._store_feed(key, version, feed)
+        return feed
+    
+    def _get_encoded_feed(self, base_url, feed_path, page, query, encoding):
+        """
+        Retorna a variante comprimida de um feed, comprimindo uma única vez.
+        
+        A variante fica no mesmo cache do feed original e é descartada junto
+        com ele quando o catálogo muda.
+        
+        Args:
+            base_url: URL base para gerar os links
+            feed_path: Tupla com os segmentos do caminho do feed
+            page: Número da página
+            query: Consulta normalizada
+            encoding: 'gzip' ou 'deflate'
+            
+        Returns:
+            CachedFeed comprimido (ou o original, se for pequeno) ou None
+        """
+        with self._lock:
+            key = (feed_path, page, base_url, query, bool(self._scanning), encoding)
+            cached = self._feed_cache.get(key)
+            if cached is not None:
+                self._feed_cache.move_to_end(key)
+            version = self.catalog_version
+        self.metrics.inc('opds_cache_requests_total', cache='feed_compressed',
+                         result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return cached
+        
+        # A requisição já foi contada acima, como variante comprimida
+        feed = self._get_plain_feed(base_url, feed_path, page, False, query, count=False)
+        if feed is None or len(feed.content) < self.MIN_COMPRESS_SIZE:
+            return feed
+        
+        compress = compressor(encoding)
+        encoded = feed._replace(
+            content=compress.compress(feed.content) + compress.flush(),
+            etag=f'{feed.etag[:-1]}-{encoding}"',
+            content_encoding=encoding,
+        )
+        self._store_feed(key, version, encoded)
+        return encoded
+    
+    def _render_feed(self, feed_path, page, base_url, updated, index, query='', scanning=False):
+        """
+        Prepara a renderização de um feed a partir dos índices do catálogo.
+        
+        Rotas (relativas a ``/opds``; com o prefixo ``/v2``, as mesmas rotas,
+        exceto a descrição OpenSearch, são geradas em OPDS 2.0/JSON):
+            /                           navegação raiz
+            /all                        todos os livros (paginado)
+            /newest                     livros modificados mais recentemente (paginado)
+            /updated-since/<instante>   livros modificados depois do instante (paginado)
+            /search?q=<termos>          resultados da busca (paginado)
+            /opensearch.xml             descrição OpenSearch da busca
+            /categories                 navegação por categoria
+            /categories/<cat>           navegação pelos autores da categoria
+            /categories/<cat>/<autor>   livros do autor na categoria (paginado)
+            /libraries                  navegação pelas raízes (com mais de uma)
+            /libraries/<nome>           navegação de uma raiz
+            /libraries/<nome>/all       livros da raiz (paginado)
+            /libraries/<nome>/categories[/<cat>[/<autor>]]
+                                        como ``/categories``, só com a raiz
+
+        Args:
+            feed_path: Tupla com os segmentos do caminho do feed
+            page: Número da página
+            base_url: URL base para os links
+            updated: Timestamp da última alteração do catálogo
+            index: CatalogIndex a ser usado
+            query: Consulta normalizada (apenas para ``/search``)
+            scanning: Mostrar o aviso de escaneamento em andamento na raiz
+            
+        Returns:
+            Tupla (MIME type, iterador de trechos XML ou JSON) ou None se não existir
+        """
+        nl, indent = self._whitespace()
+        parts = list(feed_path)
+        opds2 = parts[:1] == ['v2']
+        if opds2:
+            parts = parts[1:]
+        root = '/opds/v2' if opds2 else '/opds'
+        
+        def navigation(feed_id, title, path, entries, up=None):
+            if opds2:
+                items = (
+                    json.dumps({'href': base_url + e.href, 'title': e.title, 'type': self.OPDS2_TYPE},
+                               ensure_ascii=False, separators=(',', ':'))
+                    for e in entries
+                )
+                return self.OPDS2_TYPE, self._iter_json_feed(
+                    title, base_url, path, updated, [('up', up)] if up else [], 'navigation', items
+                )
+            return self.NAVIGATION_TYPE, self._iter_feed(
+                feed_id, title, base_url, path, self.NAVIGATION_TYPE, updated,
+                [('up', self.NAVIGATION_TYPE, up)] if up else [],
+                (self._navigation_entry_xml(e, base_url, updated, nl, indent) for e in entries),
+            )
+        
+        def acquisition(feed_id, title, path, books, up):
+            paginated = self._paginate(books, page)
+            if paginated is None:
+                return None
+            page_books, links = paginated
+            separator = '&' if '?' in path else '?'
+            self_path = f'{path}{separator}page={page}' if page > 1 else path
+            if opds2:
+                links = [('up', up)] + [(rel, f'{path}{separator}page={number}') for rel, number in links]
+                return self.OPDS2_TYPE, self._iter_json_feed(
+                    title, base_url, self_path, updated, links, 'publications',
+                    (self._publication_json(book, base_url) for book in page_books), (len(books), page)
+                )
+            links = [('up', self.NAVIGATION_TYPE, up)] + [
+                (rel, self.ACQUISITION_TYPE, f'{path}{separator}page={number}') for rel, number in links
+            ]
+            return self.ACQUISITION_TYPE, self._iter_feed(
+                feed_id, title, base_url, self_path, self.ACQUISITION_TYPE, updated, links,
+                (self._entry_xml(book, base_url, nl, indent) for book in page_books),
+            )
+        
+        def categories(feed_id, prefix, tree, parts):
+            # Navegação por categoria e autor sob ``prefix`` (o catálogo ou uma raiz)
+            path = f'{prefix}/categories'
+            if not parts:
+                entries = [
+                    NavigationEntry(
+                        f'{feed_id}:category:{_quote(category)}', category,
+                        f'{path}/{_quote(category)}',
+                        f'{len(authors)} autores, {sum(len(b) for b in authors.values())} livros',
+                        self.NAVIGATION_TYPE
+                    )
+                    for category, authors in tree.items()
+                ]
+                return navigation(f'{feed_id}:categories', 'Categorias', path, entries, prefix)
+        
+            category = parts[0]
+            authors = tree.get(category)
+            if authors is None or len(parts) > 2:
+                return None
+            category_id = f'{feed_id}:category:{_quote(category)}'
+            category_path = f'{path}/{_quote(category)}'
+        
+            if len(parts) == 1:
+                entries = [
+                    NavigationEntry(
+                        f'{category_id}:author:{_quote(author)}', author,
+                        f'{category_path}/{_quote(author)}',
+                        f'{len(books)} livros', self.ACQUISITION_TYPE
+                    )
+                    for author, books in authors.items()
+                ]
+                return navigation(category_id, category, category_path, entries, path)
+        
+            author = parts[1]
+            books = authors.get(author)
+            if books is None:
+                return None
+            return acquisition(
+                f'{category_id}:author:{_quote(author)}',
+                f'{author} ({category})', f'{category_path}/{_quote(author)}', books, category_path
+            )
+        
+        if not parts:
+            entries = [
+                NavigationEntry(
+                    'opds-gen:all', 'Todos os livros', f'{root}/all',
+                    f'{len(index.books)} livros', self.ACQUISITION_TYPE
+                ),
+                NavigationEntry(
+                    'opds-gen:newest', 'Novidades', f'{root}/newest',
+                    'Livros adicionados ou alterados recentemente', self.ACQUISITION_TYPE
+                ),
+                NavigationEntry(
+                    'opds-gen:categories', 'Categorias', f'{root}/categories',
+                    f'{len(index.categories)} categorias', self.NAVIGATION_TYPE
+                ),
+            ]
+            if index.libraries is not None:
+                entries.append(NavigationEntry(
+                    'opds-gen:libraries', 'Bibliotecas', f'{root}/libraries',
+                    f'{len(index.libraries)} bibliotecas', self.NAVIGATION_TYPE
+                ))
+            if scanning:
+                entries.insert(0, NavigationEntry(
+                    'opds-gen:scan', 'Escaneamento em andamento', f'{root}/all',
+                    f'{len(index.books)} livros encontrados até agora', self.ACQUISITION_TYPE
+                ))
+            return navigation('opds-gen:root', 'Catálogo de Livros', root, entries)
+        
+        if parts == ['all']:
+            return acquisition('opds-gen:all', 'Todos os livros', f'{root}/all', index.books, root)
+        
+        if parts == ['newest']:
+            return acquisition(
+                'opds-gen:newest', 'Novidades', f'{root}/newest',
+                index.by_time[:self.NEWEST_FEED_SIZE], root
+            )
+        
+        if len(parts) == 2 and parts[0] == 'updated-since':
+            since = _parse_since(parts[1])
+            if since is None:
+                return None
+            return acquisition(
+                f'opds-gen:updated-since:{_quote(parts[1])}', f'Alterados desde {parts[1]}',
+                f'{root}/updated-since/{_quote(parts[1])}', index.by_time.newer_than(since), root
+            )
+        
+        if parts == ['opensearch.xml'] and not opds2:
+            return self.OPENSEARCH_TYPE, self._iter_opensearch(base_url)
+        
+        if parts == ['search']:
+            # Empates na pontuação são desfeitos pelo título
+            results = sorted(
+                ((score, index.by_id[book_id]) for score, book_id in self.search_index.search(query)
+                 if book_id in index.by_id),
+                key=lambda x: (-x[0], x[1].title)
+            )
+            return acquisition(
+                f'opds-gen:search:{_quote(query)}', f'Busca: {query}',
+                f'{root}/search?q={_quote(query)}', [book for _, book in results], root
+            )
+        
+        if parts[0] == 'categories':
+            return categories('opds-gen', root, index.categories, parts[1:])
+        
+        if parts[0] != 'libraries' or index.libraries is None:
+            return None
+        
+        if len(parts) == 1:
+            entries = [
+                NavigationEntry(
+                    f'opds-gen:library:{_quote(name)}', name, f'{root}/libraries/{_quote(name)}',
+                    f'{len(books)} livros', self.NAVIGATION_TYPE
+                )
+                for name, (books, _) in index.libraries.items()
+            ]
+            return navigation('opds-gen:libraries', 'Bibliotecas', f'{root}/libraries', entries, root)
+        
+        name = parts[1]
+        library = index.libraries.get(name)
+        if library is None:
+            return None
+        books, tree = library
+        library_id = f'opds-gen:library:{_quote(name)}'
+        library_path = f'{root}/libraries/{_quote(name)}'
+        
+        if len(parts) == 2:
+            entries = [
+                NavigationEntry(
+                    f'{library_id}:all', 'Todos os livros', f'{library_path}/all',
+                    f'{len(books)} livros', self.ACQUISITION_TYPE
+                ),
+                NavigationEntry(
+                    f'{library_id}:categories', 'Categorias', f'{library_path}/categories',
+                    f'{len(tree)} categorias', self.NAVIGATION_TYPE
+                ),
+            ]
+            return navigation(library_id, name, library_path, entries, f'{root}/libraries')
+        
+        if parts[2:] == ['all']:
+            return acquisition(f'{library_id}:all', f'Todos os livros ({name})', f'{library_path}/all',
+                               books, library_path)
+        if parts[2] == 'categories':
+            return categories(library_id, library_path, tree, parts[3:])
+        return None
+    
+    def _iter_opensearch(self, base_url):
+        """
+        Produz o documento de descrição OpenSearch da busca.
+        
+        Args:
+            base_url: URL base para os links
+            
+        Yields:
+            Trechos de texto do documento XML
+        """
+        nl, indent = self._whitespace()
+        template = f'{base_url}/opds/search?q={{searchTerms}}'
+        yield (
+            f'<?xml version="1.0" encoding="utf-8"?>{nl}'
+            f'<OpenSearchDescription xmlns="http://a9.com/-/spec/opensearch/1.1/">{nl}'
+            f'{indent}<ShortName>OPDS Generator</ShortName>{nl}'
+            f'{indent}<Description>Busca por título, autor, categoria ou caminho</Description>{nl}'
+            f'{indent}<InputEncoding>UTF-8</InputEncoding>{nl}'
+            f'{indent}<OutputEncoding>UTF-8</OutputEncoding>{nl}'
+            f'{indent}<Url type={_quote_attr(self.ACQUISITION_TYPE)} template={_quote_attr(template)}/>{nl}'
+            f'</OpenSearchDescription>{nl}'
+        )
+    
+    def _paginate(self, items, page):
+        """
+        Seleciona uma página de itens e calcula os links de paginação.
+        
+        Args:
+            items: Lista completa de itens
+            page: Número da página (a partir de 1)
+            
+        Returns:
+            Tupla (itens da página, lista de (rel, número da página)) ou None
+            se a página não existir
+        """
+        pages = max(1, -(-len(items) // self.page_size))
+        if page < 1 or page > pages:
+            return None
+        
+        start = (page - 1) * self.page_size
+        links = []
+        if pages > 1:
+            links.append(('first', 1))
+            if page > 1:
+                links.append(('previous', page - 1))
+            if page < pages:
+                links.append(('next', page + 1))
+            links.append(('last', pages))
+        return items[start:start + self.page_size], links
+    
+    def _stream_and_cache(self, key, version, chunks, etag, updated, content_type, started):
+        """
+        Repassa os blocos do feed e guarda o resultado completo no cache.
+        
+        Args:
+            key: Chave do feed no cache
+            version: Versão do catálogo usada na renderização
+            chunks: Iterador de blocos de bytes
+            etag: ETag do feed
+            updated: Timestamp da última alteração do catálogo
+            content_type: MIME type do feed
+            started: Valor de ``time.perf_counter()`` no início da renderização
+            
+        Yields:
+            Blocos de bytes do feed
+        """
+        parts = []
+        # Mede só a renderização, descontando o tempo de envio de cada bloco
+        rendering = 0.0
+        for chunk in chunks:
+            rendering += time.perf_counter() - started
+            parts.append(chunk)
+            yield chunk
+            started = time.perf_counter()
+        rendering += time.perf_counter() - started
+        self.metrics.observe('opds_feed_render_seconds', rendering)
+        self._store_feed(key, version, CachedFeed(b''.join(parts), etag, updated, content_type))
+    
+    def _store_feed(self, key, version, feed):
+        """Guarda um feed renderizado se o catálogo não mudou durante a renderização."""
+        with self._lock:
+            if version == self.catalog_version:
+                self._feed_cache[key] = feed
+                while len(self._feed_cache) > self.FEED_CACHE_SIZE:
+                    self._feed_cache.popitem(last=False)
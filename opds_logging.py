@@ -0,0 +1,53 @@
+"""
+Configuração do log com níveis e escrita em segundo plano
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s %(name)s: %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def setup_logging(level='info', stream=None):
+    """
+    Configura o logger ``opds`` (e os loggers ``opds.*`` dos módulos).
+
+    As threads que atendem requisições apenas colocam os registros em uma
+    fila (``QueueHandler``); a escrita no terminal é feita por uma thread
+    separada (``QueueListener``), fora do caminho das requisições. Mensagens
+    abaixo do nível configurado são descartadas antes mesmo de serem
+    formatadas.
+
+    Args:
+        level: Nível mínimo ('debug', 'info', 'warning' ou 'error')
+        stream: Destino do log (padrão: saída padrão)
+
+    Returns:
+        QueueListener em execução (parado automaticamente ao sair)
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+
+    logger = logging.getLogger('opds')
+    logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+    logger.setLevel(LOG_LEVELS[level])
+    logger.propagate = False
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,554 @@
+"""
+Extração de metadados embutidos nos livros (EPUB, FB2, CBZ e PDF)
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from opds_covers import image_type
+
+
+logger = logging.getLogger('opds.metadata')
+
+
+# Campos de metadados extraídos (todos opcionais); page_count é a quantidade
+# de páginas dos quadrinhos, anunciada nos links de streaming (OPDS-PSE)
+METADATA_FIELDS = (
+    'title', 'authors', 'series', 'series_index', 'language', 'description', 'page_count',
+)
+
+# Versão do formato dos metadados em cache; incrementar ao mudar os extratores
+METADATA_VERSION = 2
+
+# Tamanho máximo de descrições armazenadas
+MAX_DESCRIPTION = 2000
+
+
+def _local(tag):
+    """Remove o namespace de uma tag do ElementTree."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element):
+    """Retorna o texto completo de um elemento, com espaços normalizados."""
+    if element is None:
+        return ''
+    return ' '.join(''.join(element.itertext()).split())
+
+
+def _clean(metadata):
+    """Remove campos vazios e limita o tamanho da descrição."""
+    result = {}
+    for key in METADATA_FIELDS:
+        value = metadata.get(key)
+        if not value:
+            continue
+        if key == 'description':
+            value = re.sub(r'<[^>]+>', ' ', value)
+            value = ' '.join(value.split())[:MAX_DESCRIPTION]
+        result[key] = value
+    return result
+
+
+def extract_epub(path):
+    """
+    Lê os metadados do pacote OPF de um EPUB.
+
+    Args:
+        path: Caminho do arquivo
+
+    Returns:
+        Dicionário com os metadados encontrados
+    """
+    with zipfile.ZipFile(path) as archive:
+        container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+        opf_path = None
+        for element in container.iter():
+            if _local(element.tag) == 'rootfile' and element.get('full-path'):
+                opf_path = element.get('full-path')
+                break
+        if opf_path is None:
+            return {}
+        opf = ElementTree.fromstring(archive.read(opf_path))
+
+    metadata = {'authors': []}
+    refines = {}
+    for element in opf.iter():
+        tag = _local(element.tag)
+        if tag == 'title' and 'title' not in metadata:
+            metadata['title'] = _text(element)
+        elif tag == 'creator':
+            role = next((v for k, v in element.attrib.items() if _local(k) == 'role'), 'aut')
+            if role == 'aut':
+                metadata['authors'].append(_text(element))
+        elif tag == 'language' and 'language' not in metadata:
+            metadata['language'] = _text(element)
+        elif tag == 'description' and 'description' not in metadata:
+            metadata['description'] = _text(element)
+        elif tag == 'meta':
+            name = element.get('name')
+            if name == 'calibre:series':
+                metadata['series'] = element.get('content', '')
+            elif name == 'calibre:series_index':
+                metadata['series_index'] = element.get('content', '')
+            elif element.get('property') == 'belongs-to-collection':
+                metadata.setdefault('series', _text(element))
+                refines[element.get('id')] = 'series'
+            elif element.get('property') == 'group-position':
+                refines.setdefault('#position', {})[element.get('refines', '').lstrip('#')] = _text(element)
+
+    positions = refines.get('#position', {})
+    for collection_id in [key for key, value in refines.items() if value == 'series']:
+        if collection_id in positions:
+            metadata.setdefault('series_index', positions[collection_id])
+
+    return metadata
+
+
+def extract_fb2(path):
+    """
+    Lê os metadados do cabeçalho <description> de um FB2.
+
+    Apenas o início do arquivo é processado; as imagens embutidas no
+    restante do documento não são lidas.
+
+    Args:
+        path: Caminho do arquivo
+
+    Returns:
+        Dicionário com os metadados encontrados
+    """
+    metadata = {'authors': []}
+    with open(path, 'rb') as f:
+        for _, element in ElementTree.iterparse(f, events=('end',)):
+            tag = _local(element.tag)
+            if tag == 'title-info':
+                for child in element:
+                    child_tag = _local(child.tag)
+                    if child_tag == 'book-title':
+                        metadata['title'] = _text(child)
+                    elif child_tag == 'author':
+                        parts = {_local(part.tag): _text(part) for part in child}
+                        name = ' '.join(
+                            parts[key] for key in ('first-name', 'middle-name', 'last-name')
+                            if parts.get(key)
+                        ) or parts.get('nickname', '')
+                        if name:
+                            metadata['authors'].append(name)
+                    elif child_tag == 'lang':
+                        metadata['language'] = _text(child)
+                    elif child_tag == 'annotation':
+                        metadata['description'] = _text(child)
+                    elif child_tag == 'sequence':
+                        metadata['series'] = child.get('name', '')
+                        metadata['series_index'] = child.get('number', '')
+            elif tag == 'description':
+                break
+    return metadata
+
+
+def extract_cbz(path):
+    """
+    Lê os metadados do ComicInfo.xml de um CBZ e conta as suas páginas.
+
+    Args:
+        path: Caminho do arquivo
+
+    Returns:
+        Dicionário com os metadados encontrados
+    """
+    with zipfile.ZipFile(path) as archive:
+        # Mesmo critério de PageStreamer: as páginas são os membros de imagem
+        page_count = sum(1 for info in archive.infolist() if image_type(info.filename) and not info.is_dir())
+        name = next((n for n in archive.namelist() if n.lower().rsplit('/', 1)[-1] == 'comicinfo.xml'), None)
+        if name is None:
+            return {'page_count': page_count}
+        root = ElementTree.fromstring(archive.read(name))
+
+    fields = {_local(child.tag): _text(child) for child in root}
+    writers = [w.strip() for w in fields.get('Writer', '').split(',') if w.strip()]
+    return {
+        'title': fields.get('Title'),
+        'authors': writers,
+        'series': fields.get('Series'),
+        'series_index': fields.get('Number'),
+        'language': fields.get('LanguageISO'),
+        'description': fields.get('Summary'),
+        'page_count': page_count,
+    }
+
+
+# Quantidade de bytes lidos do final do PDF e de cada objeto
+_PDF_TAIL = 64 * 1024
+_PDF_OBJECT = 64 * 1024
+
+
+def _pdf_string(data):
+    """
+    Decodifica uma string PDF (literal ou hexadecimal).
+
+    Args:
+        data: Bytes da string, incluindo os delimitadores
+
+    Returns:
+        Texto decodificado
+    """
+    if data.startswith(b'<'):
+        raw = bytes.fromhex(re.sub(rb'\s', b'', data[1:-1]).decode('ascii'))
+    else:
+        escapes = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+        def unescape(match):
+            value = match.group(1)
+            if value in escapes:
+                return escapes[value]
+            if value[:1].isdigit():
+                return bytes([int(value, 8) & 0xFF])
+            if value in (b'\n', b'\r', b'\r\n'):
+                return b''
+            return value
+
+        raw = re.sub(rb'\\([0-7]{1,3}|\r\n|.)', unescape, data[1:-1], flags=re.S)
+
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be', errors='replace')
+    if raw.startswith(b'\xef\xbb\xbf'):
+        return raw[3:].decode('utf-8', errors='replace')
+    return raw.decode('latin-1')
+
+
+def _pdf_dict_value(dictionary, key):
+    """Retorna o texto de uma chave do tipo string (literal ou hex) em um dicionário PDF."""
+    match = re.search(rb'/' + key + rb'\s*(\((?:\\.|[^\\)]|\((?:\\.|[^\\)])*\))*\)|<[0-9A-Fa-f\s]*>)', dictionary, re.S)
+    return _pdf_string(match.group(1)) if match else None
+
+
+def _png_unpredict(data, columns):
+    """
+    Desfaz os filtros PNG (predictor >= 10) de um stream de xref.
+
+    Args:
+        data: Stream descomprimido, com um byte de filtro por linha
+        columns: Bytes por linha
+
+    Returns:
+        Dados sem os filtros, ou None se houver um filtro não suportado
+    """
+    output = bytearray()
+    previous = bytearray(columns)
+    for start in range(0, len(data) - columns, columns + 1):
+        kind = data[start]
+        row = bytearray(data[start + 1:start + 1 + columns])
+        if kind == 1:
+            for i in range(1, columns):
+                row[i] = (row[i] + row[i - 1]) & 0xFF
+        elif kind == 2:
+            for i in range(columns):
+                row[i] = (row[i] + previous[i]) & 0xFF
+        elif kind != 0:
+            return None
+        output += row
+        previous = row
+    return bytes(output)
+
+
+def _pdf_xref_offset(f, number, xref_offset):
+    """
+    Procura o deslocamento de um objeto nas tabelas de referência cruzada.
+
+    Suporta tabelas clássicas e streams de xref (PDF 1.5+), seguindo /Prev.
+
+    Args:
+        f: Arquivo PDF aberto em modo binário
+        number: Número do objeto
+        xref_offset: Deslocamento da seção xref mais recente
+
+    Returns:
+        Deslocamento do objeto no arquivo, ou None
+    """
+    seen = set()
+    while xref_offset is not None and xref_offset not in seen:
+        seen.add(xref_offset)
+        f.seek(xref_offset)
+        data = f.read(_PDF_OBJECT)
+
+        if data.startswith(b'xref'):
+            position = 4
+            trailer = data.find(b'trailer', position)
+            section = data[position:trailer if trailer >= 0 else len(data)]
+            lines = section.split(b'\n')
+            index = 0
+            while index < len(lines):
+                header = lines[index].split()
+                index += 1
+                if len(header) != 2:
+                    continue
+                start, count = int(header[0]), int(header[1])
+                if start <= number < start + count:
+                    entry = lines[index + number - start].split()
+                    if len(entry) >= 3 and entry[2] == b'n':
+                        return int(entry[0])
+                    return None
+                index += count
+            dictionary = data[trailer:] if trailer >= 0 else b''
+        else:
+            match = re.match(rb'\s*\d+\s+\d+\s+obj\s*(<<.*?>>)\s*stream\r?\n', data, re.S)
+            if not match:
+                return None
+            dictionary = match.group(1)
+            widths = re.search(rb'/W\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s*\]', dictionary)
+            length = re.search(rb'/Length\s+(\d+)(?!\s+\d+\s+R)', dictionary)
+            if not widths or not length:
+                return None
+            widths = [int(w) for w in widths.groups()]
+            stream = data[match.end():match.end() + int(length.group(1))]
+            try:
+                stream = zlib.decompress(stream) if b'/FlateDecode' in dictionary else stream
+            except zlib.error:
+                return None
+            predictor = re.search(rb'/Predictor\s+(\d+)', dictionary)
+            if predictor and int(predictor.group(1)) >= 10:
+                stream = _png_unpredict(stream, sum(widths))
+                if stream is None:
+                    return None
+            size = re.search(rb'/Size\s+(\d+)', dictionary)
+            index_ranges = re.search(rb'/Index\s*\[([\d\s]+)\]', dictionary)
+            if index_ranges:
+                values = [int(v) for v in index_ranges.group(1).split()]
+                ranges = list(zip(values[::2], values[1::2]))
+            else:
+                ranges = [(0, int(size.group(1)) if size else 0)]
+            entry_size = sum(widths)
+            position = 0
+            for start, count in ranges:
+                if start <= number < start + count:
+                    offset = position + (number - start) * entry_size
+                    entry = stream[offset:offset + entry_size]
+                    fields, cursor = [], 0
+                    for width in widths:
+                        fields.append(int.from_bytes(entry[cursor:cursor + width], 'big') if width else 1)
+                        cursor += width
+                    # Tipo 1: objeto não comprimido; tipo 2 (object stream) não é suportado
+                    return fields[1] if fields[0] == 1 else None
+                position += count * entry_size
+
+        previous = re.search(rb'/Prev\s+(\d+)', dictionary)
+        xref_offset = int(previous.group(1)) if previous else None
+    return None
+
+
+def extract_pdf(path):
+    """
+    Lê o dicionário /Info de um PDF.
+
+    Apenas o final do arquivo, a tabela xref e o objeto /Info são lidos.
+
+    Args:
+        path: Caminho do arquivo
+
+    Returns:
+        Dicionário com os metadados encontrados
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(0, size - _PDF_TAIL))
+        tail = f.read()
+
+        startxref = re.findall(rb'startxref\s+(\d+)', tail)
+        if not startxref:
+            return {}
+        xref_offset = int(startxref[-1])
+
+        info = re.findall(rb'/Info\s+(\d+)\s+(\d+)\s+R', tail)
+        if not info:
+            f.seek(xref_offset)
+            info = re.findall(rb'/Info\s+(\d+)\s+(\d+)\s+R', f.read(_PDF_OBJECT))
+        if not info:
+            return {}
+        number, generation = int(info[-1][0]), int(info[-1][1])
+
+        offset = _pdf_xref_offset(f, number, xref_offset)
+        if offset is None:
+            return {}
+        f.seek(offset)
+        data = f.read(_PDF_OBJECT)
+
+    match = re.match(rb'\s*%d\s+%d\s+obj\s*(<<.*?>>)\s*endobj' % (number, generation), data, re.S)
+    if not match:
+        return {}
+    dictionary = match.group(1)
+
+    author = _pdf_dict_value(dictionary, b'Author')
+    return {
+        'title': _pdf_dict_value(dictionary, b'Title'),
+        'authors': [a.strip() for a in re.split(r'[;&]|\s+and\s+', author) if a.strip()] if author else [],
+        'description': _pdf_dict_value(dictionary, b'Subject'),
+    }
+
+
+EXTRACTORS = {
+    '.epub': extract_epub,
+    '.fb2': extract_fb2,
+    '.cbz': extract_cbz,
+    '.pdf': extract_pdf,
+}
+
+
+def extract_metadata(path):
+    """
+    Extrai os metadados embutidos de um livro.
+
+    Erros de leitura ou arquivos malformados resultam em um dicionário
+    vazio: os dados derivados do nome do arquivo continuam valendo.
+
+    Args:
+        path: Caminho do arquivo
+
+    Returns:
+        Dicionário com os campos de METADATA_FIELDS encontrados
+    """
+    extractor = EXTRACTORS.get(os.path.splitext(path)[1].lower())
+    if extractor is None:
+        return {}
+    try:
+        return _clean(extractor(path))
+    except Exception:
+        return {}
+
+
+class MetadataCache:
+    """
+    Cache em disco (SQLite) dos metadados extraídos.
+
+    Cada registro é identificado pelo caminho relativo do livro e só é
+    reaproveitado se o tamanho e a data de modificação do arquivo
+    continuarem iguais.
+    Os livros sem registro válido são processados em um pool de processos.
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, db_path, workers=None):
+        """
+        Inicializa o cache.
+
+        Args:
+            db_path: Caminho do arquivo SQLite
+            workers: Processos para extração (None = número de CPUs, 0 = sem pool)
+        """
+        self.db_path = str(db_path)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                ' path TEXT PRIMARY KEY, size INTEGER, mtime TEXT,'
+                ' version INTEGER, data TEXT)'
+            )
+
+    def _connect(self):
+        """Abre uma conexão com o banco do cache."""
+        return sqlite3.connect(self.db_path)
+
+    def lookup(self, items):
+        """
+        Busca metadados válidos no cache.
+
+        Args:
+            items: Lista de tuplas (caminho relativo, tamanho, data de modificação)
+
+        Returns:
+            Dicionário caminho relativo -> metadados, apenas para acertos
+        """
+        found = {}
+        wanted = {path: (size, mtime) for path, size, mtime in items}
+        paths = list(wanted)
+        with self._connect() as db:
+            for start in range(0, len(paths), self.BATCH_SIZE):
+                batch = paths[start:start + self.BATCH_SIZE]
+                rows = db.execute(
+                    'SELECT path, size, mtime, version, data FROM metadata WHERE path IN (%s)'
+                    % ','.join('?' * len(batch)),
+                    batch
+                )
+                for path, size, mtime, version, data in rows:
+                    if (size, mtime) == wanted[path] and version == METADATA_VERSION:
+                        found[path] = json.loads(data)
+        return found
+
+    def store(self, items):
+        """
+        Grava metadados extraídos no cache.
+
+        Args:
+            items: Lista de tuplas (caminho relativo, tamanho, data de modificação, metadados)
+        """
+        with self._connect() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO metadata (path, size, mtime, version, data) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (path, size, mtime, METADATA_VERSION, json.dumps(data, ensure_ascii=False))
+                    for path, size, mtime, data in items
+                ]
+            )
+
+    def move(self, pairs):
+        """
+        Transfere para o novo caminho os registros de livros movidos.
+
+        Um registro só é transferido se ainda valia para o arquivo antigo.
+        A data de modificação passa a ser a do arquivo novo: um livro
+        reconhecido pelo conteúdo pode ter sido copiado com outra data.
+
+        Args:
+            pairs: Lista de pares de tuplas (caminho relativo, tamanho, data de
+                   modificação), a do livro antigo e a do livro movido
+        """
+        with self._connect() as db:
+            db.executemany(
+                'UPDATE OR REPLACE metadata SET path = ?, size = ?, mtime = ?'
+                ' WHERE path = ? AND size = ? AND mtime = ?',
+                [new + old for old, new in pairs]
+            )
+
+    def get_many(self, root, items):
+        """
+        Retorna os metadados de vários livros, extraindo apenas os que faltam.
+
+        Args:
+            root: Diretório raiz da biblioteca
+            items: Lista de tuplas (caminho relativo, tamanho, data de modificação)
+
+        Returns:
+            Dicionário caminho relativo -> metadados
+        """
+        items = [item for item in items if os.path.splitext(item[0])[1].lower() in EXTRACTORS]
+        if not items:
+            return {}
+
+        found = self.lookup(items)
+        missing = [item for item in items if item[0] not in found]
+        if not missing:
+            return found
+
+        paths = [os.path.join(root, path) for path, _, _ in missing]
+        logger.info("Extraindo metadados de %d livros...", len(missing))
+        if self.workers and len(missing) > 1:
+            # 'spawn' evita herdar locks de threads do servidor no processo filho
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+                results = list(pool.map(extract_metadata, paths, chunksize=16))
+        else:
+            results = [extract_metadata(path) for path in paths]
+
+        self.store([item + (data,) for item, data in zip(missing, results)])
+        for (path, _, _), data in zip(missing, results):
+            found[path] = data
+        return found
@@ -0,0 +1,247 @@
+"""
+Métricas internas no formato de texto do Prometheus
+"""
+
+import bisect
+import marshal
+import os
+import threading
+
+
+# Limites (em segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Limites (em segundos) do histograma de duração dos escaneamentos
+SCAN_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Métricas conhecidas: nome -> (tipo, descrição, limites do histograma)
+METRICS = {
+    'opds_http_requests_total': (
+        'counter', 'Requisições HTTP atendidas, por rota e código de status', None),
+    'opds_http_request_duration_seconds': (
+        'histogram', 'Tempo de atendimento das requisições HTTP, por rota', LATENCY_BUCKETS),
+    'opds_http_response_bytes_total': (
+        'counter', 'Bytes enviados nas respostas HTTP (incluindo cabeçalhos), por rota', None),
+    'opds_http_connections': (
+        'gauge', 'Conexões HTTP abertas, por estado (ativa ou ociosa em keep-alive)', None),
+    'opds_feed_render_seconds': (
+        'histogram', 'Tempo de renderização dos feeds (apenas quando não estão em cache)', LATENCY_BUCKETS),
+    'opds_cache_requests_total': (
+        'counter', 'Consultas aos caches, por cache e resultado (hit ou miss)', None),
+    'opds_scan_duration_seconds': (
+        'histogram', 'Duração dos escaneamentos da biblioteca', SCAN_BUCKETS),
+    'opds_scan_books': (
+        'gauge', 'Livros encontrados no último escaneamento', None),
+    'opds_scan_changes_total': (
+        'counter', 'Livros adicionados, removidos e modificados encontrados pelos escaneamentos', None),
+    'opds_catalog_version': (
+        'gauge', 'Versão atual do catálogo (muda a cada alteração)', None),
+}
+
+# Métricas medidas pelo escaneamento; no modo multiprocesso, o processo
+# principal as publica e os processos de atendimento as exibem
+SCAN_METRICS = ('opds_scan_duration_seconds', 'opds_scan_books', 'opds_scan_changes_total')
+
+
+def save_metrics(path, state):
+    """
+    Publica métricas exportadas por ``Metrics.export`` para outros processos.
+
+    O arquivo é gravado com outro nome e substitui o anterior com
+    ``os.replace``, então quem lê nunca vê um arquivo pela metade.
+
+    Args:
+        path: Caminho do arquivo publicado
+        state: Resultado de ``Metrics.export``
+    """
+    path = str(path)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(marshal.dumps(state))
+    os.replace(temp_path, path)
+
+
+def load_metrics(path):
+    """
+    Carrega métricas publicadas por ``save_metrics``.
+
+    Args:
+        path: Caminho do arquivo publicado
+
+    Returns:
+        Estado para ``Metrics.replace`` ou None se o arquivo não existir ou
+        estiver corrompido
+    """
+    try:
+        with open(path, 'rb') as f:
+            return marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def _format_labels(labels):
+    """Formata os rótulos de uma amostra ({a="1",b="2"})."""
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    """Formata um valor numérico (inteiros sem casa decimal)."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+class Metrics:
+    """
+    Registro de métricas (contadores, medidores e histogramas) com rótulos.
+
+    Todas as métricas precisam estar em ``METRICS``. As atualizações são
+    apenas somas em dicionários protegidas por um lock, baratas o bastante
+    para o caminho das requisições. Valores que já existem em outros objetos
+    (conexões abertas, versão do catálogo...) são lidos só na hora de gerar
+    o texto, por funções registradas com ``collect``.
+    """
+
+    def __init__(self):
+        """Inicializa um registro vazio."""
+        self._lock = threading.Lock()
+        self._values = {}       # (nome, rótulos) -> valor
+        self._histograms = {}   # (nome, rótulos) -> [contagem por limite..., +Inf, soma, total]
+        self._collectors = []
+
+    def inc(self, name, value=1, **labels):
+        """
+        Soma um valor a um contador.
+
+        Args:
+            name: Nome da métrica
+            value: Valor a somar
+            **labels: Rótulos da amostra
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Define o valor de um medidor.
+
+        Args:
+            name: Nome da métrica
+            value: Novo valor
+            **labels: Rótulos da amostra
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Registra uma observação em um histograma.
+
+        Args:
+            name: Nome da métrica
+            value: Valor observado (em segundos, para durações)
+            **labels: Rótulos da amostra
+        """
+        buckets = METRICS[name][2]
+        position = bisect.bisect_left(buckets, value)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(buckets) + 3)
+            counts[position] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def export(self, names):
+        """
+        Retorna os valores atuais de algumas métricas, para outro processo.
+
+        Args:
+            names: Nomes das métricas
+
+        Returns:
+            Tupla (valores, histogramas), listas de tuplas (nome, rótulos,
+            valor ou contagens) apenas com tipos básicos
+        """
+        with self._lock:
+            values = [(name, labels, value) for (name, labels), value in self._values.items() if name in names]
+            histograms = [
+                (name, labels, list(counts))
+                for (name, labels), counts in self._histograms.items()
+                if name in names
+            ]
+        return values, histograms
+
+    def replace(self, names, state):
+        """
+        Substitui algumas métricas pelos valores exportados por outro processo.
+
+        Args:
+            names: Nomes das métricas substituídas (as amostras atuais delas
+                   são descartadas)
+            state: Resultado de ``export`` no outro processo
+        """
+        values, histograms = state
+        with self._lock:
+            for store in (self._values, self._histograms):
+                for key in [key for key in store if key[0] in names]:
+                    del store[key]
+            for name, labels, value in values:
+                self._values[(name, labels)] = value
+            for name, labels, counts in histograms:
+                self._histograms[(name, labels)] = list(counts)
+
+    def collect(self, collector):
+        """
+        Registra uma função chamada a cada ``render``.
+
+        Args:
+            collector: Função sem argumentos que retorna tuplas
+                       (nome, valor, dicionário de rótulos)
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """
+        Gera o texto de todas as métricas no formato de exposição do Prometheus.
+
+        Returns:
+            String no formato text/plain; version=0.0.4
+        """
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: list(counts) for key, counts in self._histograms.items()}
+        for collector in self._collectors:
+            for name, value, labels in collector():
+                values[(name, tuple(sorted(labels.items())))] = value
+
+        samples = {}
+        for (name, labels), value in values.items():
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), counts in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(METRICS[name][2] + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(counts[-2])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {counts[-1]}')
+
+        output = []
+        for name, (kind, description, _) in METRICS.items():
+            if name not in samples:
+                continue
+            output.append(f'# HELP {name} {description}')
+            output.append(f'# TYPE {name} {kind}')
+            output.extend(sorted(samples[name]) if kind != 'histogram' else samples[name])
+        return '\n'.join(output) + '\n'
@@ -0,0 +1,157 @@
+"""
+Streaming de páginas de quadrinhos (OPDS-PSE) com cache em memória
+"""
+
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+from opds_covers import image_type, natural_key, resize_image
+
+
+# Formatos cujas páginas podem ser servidas individualmente
+PSE_FORMATS = {'.cbz'}
+
+# Namespace e relação dos links de streaming de páginas
+PSE_NAMESPACE = 'http://vaemendis.net/opds-pse/ns'
+PSE_REL = 'http://vaemendis.net/opds-pse/stream'
+
+
+class PageStreamer:
+    """
+    Serve páginas de arquivos CBZ individualmente, sem extrair o arquivo.
+
+    Dois caches LRU em memória tornam a leitura página a página barata:
+    o dos arquivos abertos, com o diretório central do ZIP já lido e a lista
+    de páginas em ordem natural, e o das páginas servidas recentemente
+    (inclusive as reduzidas), limitado pelo tamanho total. Avançar uma
+    página custa apenas a leitura de um membro do arquivo. A quantidade de
+    páginas anunciada nos feeds não passa por aqui: é contada na extração
+    de metadados e guardada no registro do livro.
+
+    As chaves incluem a versão do arquivo (tamanho e data de modificação),
+    então um livro alterado nunca recebe páginas da versão anterior.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_archives=16):
+        """
+        Inicializa os caches vazios.
+
+        Args:
+            max_bytes: Tamanho máximo total das páginas em cache
+            max_archives: Quantidade máxima de arquivos mantidos abertos
+        """
+        self.max_bytes = max_bytes
+        self.max_archives = max_archives
+        self._lock = threading.Lock()
+        self._archives = OrderedDict()   # chave -> (ZipFile, lista de membros)
+        self._pages = OrderedDict()      # (chave, página, largura) -> (bytes, MIME type)
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(book):
+        """Chave do livro nos caches; muda quando o arquivo muda."""
+        return (book.digest, book.file_size, book.mtime_ns)
+
+    def get_page(self, book, books_dir, number, max_width=None):
+        """
+        Retorna uma página de um quadrinho.
+
+        Args:
+            book: BookRecord do livro
+            books_dir: Diretório raiz da biblioteca
+            number: Número da página (a partir de 0, como no OPDS-PSE)
+            max_width: Largura máxima em pixels (reduz a página se o Pillow
+                       estiver instalado; None serve a página original)
+
+        Returns:
+            Tupla (bytes, MIME type) ou None se a página não existir
+        """
+        if book.extension not in PSE_FORMATS or number < 0:
+            return None
+        key = self.cache_key(book)
+        page_key = (key, number, max_width)
+        with self._lock:
+            page = self._pages.get(page_key)
+            if page is not None:
+                self._pages.move_to_end(page_key)
+                self.hits += 1
+                return page
+            self.misses += 1
+
+        opened = self._archive(book, books_dir)
+        if opened is None:
+            return None
+        archive, members = opened
+        if number >= len(members):
+            return None
+        try:
+            data = archive.read(members[number])
+        except (OSError, zipfile.BadZipFile, KeyError):
+            # Arquivo alterado ou truncado desde que foi aberto
+            self._forget(key)
+            return None
+
+        page = (data, image_type(members[number].filename))
+        if max_width:
+            page = resize_image(data, max_width=max_width) or page
+        self._store(page_key, page)
+        return page
+
+    def _archive(self, book, books_dir):
+        """
+        Retorna o arquivo aberto e suas páginas, abrindo-o se preciso.
+
+        Returns:
+            Tupla (ZipFile, lista de ZipInfo das páginas) ou None se o
+            arquivo não puder ser lido
+        """
+        key = self.cache_key(book)
+        with self._lock:
+            opened = self._archives.get(key)
+            if opened is not None:
+                self._archives.move_to_end(key)
+                return opened
+
+        # Abre fora do lock; se duas threads abrirem o mesmo arquivo, a
+        # segunda apenas substitui a entrada da primeira
+        try:
+            archive = zipfile.ZipFile(os.path.join(str(books_dir), book.file_path))
+        except (OSError, zipfile.BadZipFile):
+            return None
+        members = sorted(
+            (info for info in archive.infolist() if image_type(info.filename) and not info.is_dir()),
+            key=lambda info: natural_key(info.filename)
+        )
+
+        opened = (archive, members)
+        with self._lock:
+            self._archives[key] = opened
+            # Arquivos removidos do cache são fechados pelo coletor quando a
+            # última leitura em andamento terminar
+            while len(self._archives) > self.max_archives:
+                self._archives.popitem(last=False)
+        return opened
+
+    def _store(self, page_key, page):
+        """Guarda uma página no cache e aplica o limite de tamanho."""
+        size = len(page[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._pages.pop(page_key, None)
+            if previous is not None:
+                self._total -= len(previous[0])
+            self._pages[page_key] = page
+            self._total += size
+            while self._total > self.max_bytes:
+                _, (data, _) = self._pages.popitem(last=False)
+                self._total -= len(data)
+
+    def _forget(self, key):
+        """Descarta o arquivo aberto de um livro."""
+        with self._lock:
+            self._archives.pop(key, None)
@@ -0,0 +1,201 @@
+"""
+Processos de atendimento (pre-fork) escutando na mesma porta
+"""
+
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+
+logger = logging.getLogger('opds.prefork')
+
+
+def prefork_supported():
+    """Retorna True se a plataforma tem ``os.fork`` e ``SO_REUSEPORT``."""
+    return hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')
+
+
+def fork_process(target, *args):
+    """
+    Executa ``target(*args)`` em um processo filho criado com ``os.fork``.
+
+    No filho, SIGTERM interrompe ``target`` como o Ctrl+C, e o processo
+    termina quando ``target`` retorna, sem nunca voltar ao código do pai.
+
+    Returns:
+        PID do processo filho
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        target(*args)
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        logger.exception("Erro no processo %d", os.getpid())
+        code = 1
+    finally:
+        # os._exit não esvazia os buffers nem executa os handlers do atexit
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def stop_processes(pids, timeout):
+    """
+    Encerra processos filhos: SIGTERM e, passado o prazo, SIGKILL.
+
+    Args:
+        pids: PIDs dos processos
+        timeout: Segundos máximos de espera antes do SIGKILL
+    """
+    pending = set()
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            pending.add(pid)
+        except ProcessLookupError:
+            pass
+
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for pid in list(pending):
+            try:
+                finished, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                finished = pid
+            if finished:
+                pending.discard(pid)
+        time.sleep(0.05)
+
+    for pid in pending:
+        logger.warning("Processo %d não terminou; forçando", pid)
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+
+class PreforkWorkers:
+    """
+    Conjunto de processos filhos que atendem as requisições HTTP.
+
+    Cada processo abre o próprio socket na mesma porta com ``SO_REUSEPORT``
+    e o kernel distribui as conexões entre eles, então a renderização dos
+    feeds e o processamento das requisições usam vários núcleos apesar do
+    GIL. O processo pai não atende requisições: escaneia a biblioteca,
+    publica o catálogo e recria os filhos que terminarem inesperadamente.
+
+    Os processos são criados com ``os.fork``. Um filho herda apenas a thread
+    que chamou o fork, mas também os locks que as outras threads seguravam
+    naquele instante, então quem cria os processos não pode ter threads de
+    trabalho: ``run`` deve rodar em um processo supervisor criado com
+    ``fork_process`` antes de qualquer thread (e antes das threads de
+    escaneamento do processo principal). A única thread do supervisor, a do
+    log, é parada em ``before_fork`` e retomada em ``after_fork``.
+    """
+
+    # Espera mínima entre recriações de um mesmo processo
+    RESPAWN_DELAY = 1.0
+
+    def __init__(self, processes, target, before_fork=None, after_fork=None):
+        """
+        Args:
+            processes: Quantidade de processos de atendimento
+            target: Função executada em cada filho, com o número do processo
+                    (a partir de 0) como argumento
+            before_fork: Função chamada no pai antes de cada fork (opcional)
+            after_fork: Função chamada no pai depois de cada fork (opcional)
+        """
+        self.processes = processes
+        self.target = target
+        self.before_fork = before_fork
+        self.after_fork = after_fork
+        self._children = {}   # pid -> número do processo
+        self._started = {}    # número do processo -> instante da última criação
+        self._stopping = False
+
+    def start(self):
+        """Cria todos os processos de atendimento."""
+        for slot in range(self.processes):
+            self._spawn(slot)
+
+    def _spawn(self, slot):
+        """Cria o processo de atendimento ``slot``."""
+        self._started[slot] = time.monotonic()
+        if self.before_fork is not None:
+            self.before_fork()
+        try:
+            pid = fork_process(self.target, slot)
+        finally:
+            # Só o pai chega aqui: o filho termina em fork_process
+            if self.after_fork is not None:
+                self.after_fork()
+        self._children[pid] = slot
+
+    def run(self):
+        """
+        Cria os processos de atendimento e os recria até ser interrompido.
+
+        Ao receber Ctrl+C ou SIGTERM, encerra os processos de atendimento.
+        """
+        try:
+            self.start()
+            self.supervise()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Um segundo sinal não deve interromper o encerramento dos filhos
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            self.stop()
+
+    def supervise(self):
+        """
+        Aguarda os processos filhos, recriando os que terminarem.
+
+        Retorna apenas depois de ``stop`` ou quando não houver mais filhos.
+        """
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot = self._children.pop(pid, None)
+            if slot is None or self._stopping:
+                continue
+
+            if os.WIFSIGNALED(status):
+                reason = f"pelo sinal {os.WTERMSIG(status)}"
+            else:
+                reason = f"com código {os.WEXITSTATUS(status)}"
+            logger.warning("Processo de atendimento %d (pid %d) terminou %s; recriando", slot, pid, reason)
+            # Evita recriar em laço um processo que falha ao iniciar
+            delay = self._started[slot] + self.RESPAWN_DELAY - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._spawn(slot)
+
+    def stop(self, timeout=15):
+        """
+        Encerra os processos de atendimento.
+
+        Cada filho recebe SIGTERM e termina as conexões em andamento; os que
+        não terminarem dentro do prazo recebem SIGKILL.
+
+        Args:
+            timeout: Segundos máximos de espera pelos filhos
+        """
+        self._stopping = True
+        stop_processes(list(self._children), timeout)
+        self._children.clear()
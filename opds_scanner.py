@@ -0,0 +1,512 @@
+"""
+Escaneamento incremental do diretório de livros
+"""
+
+import hashlib
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger('opds.scanner')
+
+
+# Resultado de um escaneamento em relação ao anterior:
+# - added: livros novos
+# - removed: livros que deixaram de existir
+# - modified: tuplas (livro antigo, livro novo) para arquivos alterados
+ScanDelta = namedtuple('ScanDelta', ['added', 'removed', 'modified'])
+
+# Estado de um diretório no índice:
+# - mtime: st_mtime_ns do diretório na última listagem
+# - files: nome -> (tamanho, st_mtime_ns, livro)
+# - subdirs: nomes dos subdiretórios
+DirectoryState = namedtuple('DirectoryState', ['mtime', 'files', 'subdirs'])
+
+# Bytes lidos do início e do fim de cada arquivo no hash parcial do conteúdo
+HASH_CHUNK = 16 * 1024
+
+
+def delta_is_empty(delta):
+    """Retorna True se o escaneamento não encontrou nenhuma mudança."""
+    return not (delta.added or delta.removed or delta.modified)
+
+
+def partial_hash(path, size):
+    """
+    Calcula um hash parcial do conteúdo de um arquivo.
+
+    Lê apenas o início e o fim do arquivo (``HASH_CHUNK`` bytes de cada).
+    Junto com o tamanho, basta para distinguir livros: nos formatos
+    compactados (EPUB, CBZ) o fim do arquivo é o diretório central do ZIP,
+    com os nomes e CRCs de todos os membros.
+
+    Args:
+        path: Caminho do arquivo
+        size: Tamanho do arquivo em bytes
+
+    Returns:
+        MD5 (bytes) do tamanho, do início e do fim do arquivo, ou None se o
+        arquivo não puder ser lido
+    """
+    digest = hashlib.md5(str(size).encode())
+    try:
+        with open(path, 'rb') as f:
+            digest.update(f.read(HASH_CHUNK))
+            if size > HASH_CHUNK:
+                f.seek(max(HASH_CHUNK, size - HASH_CHUNK))
+                digest.update(f.read(HASH_CHUNK))
+    except OSError:
+        return None
+    return digest.digest()
+
+
+class LibraryScanner:
+    """
+    Escaneador incremental baseado em ``os.scandir``.
+
+    Mantém um índice com o mtime de cada diretório e os registros dos
+    livros encontrados nele. Diretórios cujo mtime não mudou não são
+    listados novamente: seus livros são reaproveitados e apenas os
+    subdiretórios são visitados (um ``stat`` por diretório em vez de um
+    por arquivo).
+
+    Alterações feitas dentro de um arquivo existente não mudam o mtime do
+    diretório; por isso, a cada ``verify_every`` escaneamentos todos os
+    diretórios são listados novamente.
+
+    Com ``workers`` > 1, os diretórios são listados em paralelo por um pool
+    de threads (útil em montagens de rede, onde cada ``stat`` é uma ida e
+    volta ao servidor). O resultado é idêntico ao do escaneamento serial.
+
+    Livros movidos ou renomeados são reconhecidos pelo dispositivo e pelo
+    inode (ver ``_match_moves``) e mantêm o ID do registro anterior.
+    """
+
+    def __init__(self, root, make_book, extensions, skip=(), verify_every=12, workers=0,
+                 content_hash=False):
+        """
+        Inicializa o escaneador.
+
+        Args:
+            root: Diretório raiz da biblioteca
+            make_book: Função (caminho, caminho relativo, stat) -> BookRecord do livro
+            extensions: Conjunto de extensões aceitas (minúsculas, com ponto)
+            skip: Caminhos absolutos de arquivos ou diretórios a ignorar
+            verify_every: A cada quantos escaneamentos listar todos os diretórios
+                          (0 desativa a verificação completa periódica)
+            workers: Threads que listam diretórios em paralelo; também é o
+                     máximo de operações simultâneas no sistema de arquivos
+                     (0 ou 1 escaneia em série)
+            content_hash: Reconhecer também pelo conteúdo os livros movidos
+                          que mudaram de inode (lê o início e o fim de cada
+                          livro novo ou alterado)
+        """
+        self.root = str(root)
+        self.make_book = make_book
+        self.extensions = extensions
+        self.skip = {str(path) for path in skip}
+        self.verify_every = verify_every
+        self.workers = workers
+        self.content_hash = content_hash
+        self.scans = 0
+        self._dirs = {}
+
+    def scan(self, progress=None):
+        """
+        Escaneia a biblioteca, reaproveitando o que não mudou.
+
+        Args:
+            progress: Função chamada com o ScanDelta parcial após cada
+                      diretório listado (ex: para publicar o catálogo aos
+                      poucos durante o primeiro escaneamento)
+
+        Returns:
+            Tupla (lista de livros, ScanDelta)
+        """
+        first = not self._dirs
+        full = first or (self.verify_every and self.scans % self.verify_every == 0)
+        self.scans += 1
+        delta = ScanDelta([], [], [])
+
+        try:
+            root_mtime = os.stat(self.root).st_mtime_ns
+        except OSError as e:
+            logger.warning("Não foi possível acessar %s: %s", self.root, e)
+            return self.books(), delta
+
+        dirs = {}
+        walk = self._walk_parallel if self.workers > 1 else self._walk
+        walk('', root_mtime, self._dirs, dirs, full, delta, progress)
+
+        # Diretórios que sumiram: todos os seus livros foram removidos
+        for relative_dir, state in self._dirs.items():
+            if relative_dir not in dirs:
+                delta.removed.extend(book for _, _, book in state.files.values())
+
+        self._match_moves(dirs, delta, first)
+        self._dirs = dirs
+        return self.books(), delta
+
+    def refresh(self, relative_dirs):
+        """
+        Lista novamente apenas os diretórios indicados.
+
+        Usado quando se sabe exatamente quais diretórios mudaram (ex: eventos
+        do inotify). Subdiretórios novos são escaneados por completo e os que
+        desapareceram têm seus livros removidos.
+
+        Args:
+            relative_dirs: Caminhos de diretórios relativos à raiz ('' para a raiz)
+
+        Returns:
+            Tupla (lista de livros, ScanDelta)
+        """
+        delta = ScanDelta([], [], [])
+        dirs = dict(self._dirs)
+
+        for relative_dir in sorted(set(relative_dirs)):
+            parent = os.path.dirname(relative_dir)
+            if relative_dir not in dirs and relative_dir and parent not in dirs:
+                # Será encontrado ao listar um diretório ancestral
+                continue
+            try:
+                mtime = os.stat(os.path.join(self.root, relative_dir)).st_mtime_ns
+            except FileNotFoundError:
+                self._drop_subtree(relative_dir, dirs, delta)
+                continue
+            except OSError as e:
+                logger.warning("Não foi possível acessar %s: %s", relative_dir, e)
+                continue
+
+            previous = dirs.get(relative_dir)
+            state = self._scan_directory(relative_dir, mtime, previous, True, delta)
+            dirs[relative_dir] = state
+
+            known = set(previous.subdirs) if previous is not None else set()
+            for name in known - set(state.subdirs):
+                self._drop_subtree(self._join(relative_dir, name), dirs, delta)
+            for name in state.subdirs:
+                relative_sub = self._join(relative_dir, name)
+                if relative_sub not in dirs:
+                    try:
+                        sub_mtime = os.stat(os.path.join(self.root, relative_sub)).st_mtime_ns
+                    except OSError:
+                        continue
+                    self._walk(relative_sub, sub_mtime, dirs, dirs, False, delta)
+
+        self._match_moves(dirs, delta, not self._dirs)
+        self._dirs = dirs
+        return self.books(), delta
+
+    def directories(self):
+        """Retorna o índice de diretórios (diretório relativo -> DirectoryState)."""
+        return self._dirs
+
+    def restore(self, directories):
+        """
+        Restaura um índice salvo anteriormente (ex: snapshot em disco).
+        
+        O próximo escaneamento lista todos os diretórios, reaproveitando os
+        livros cujo tamanho e data de modificação não mudaram.
+        
+        Args:
+            directories: Índice de diretórios (diretório relativo -> DirectoryState)
+        """
+        self._dirs = directories
+        self.scans = 0
+
+    def books(self):
+        """Retorna todos os livros conhecidos pelo índice."""
+        return [book for state in self._dirs.values() for _, _, book in state.files.values()]
+
+    def _match_moves(self, dirs, delta, first):
+        """
+        Reconhece livros movidos ou renomeados entre os removidos e os novos.
+
+        Um livro novo com o mesmo dispositivo, inode, tamanho e data de
+        modificação de um livro removido é o mesmo arquivo em outro caminho
+        (``mv`` dentro da mesma montagem). Com ``content_hash``, também são
+        reconhecidos pelo tamanho e pelo hash parcial do conteúdo os livros
+        que mudaram de inode (cópia entre montagens, sincronização que recria
+        os arquivos); o hash só é calculado para os livros novos ou alterados
+        que não foram reconhecidos pelo inode, e fica guardado no registro
+        para quando o arquivo sumir.
+
+        O livro movido recebe o ID do registro antigo e sai de ``added`` e
+        ``removed`` para ``modified``, como (livro antigo, livro novo): os
+        caches e índices chaveados pelo ID continuam valendo.
+
+        Args:
+            dirs: Índice novo
+            delta: ScanDelta do escaneamento, alterado no lugar
+            first: Primeiro escaneamento (não há livros anteriores)
+        """
+        changed = [new for _, new in delta.modified]
+        added = delta.added
+        moved = []
+        if added and delta.removed:
+            by_inode = {(book.device, book.inode): book for book in delta.removed if book.inode}
+            added = []
+            for book in delta.added:
+                key = (book.device, book.inode)
+                old = by_inode.get(key) if book.inode else None
+                if old is not None and old.file_size == book.file_size and old.mtime_ns == book.mtime_ns:
+                    del by_inode[key]
+                    book.content_hash = old.content_hash
+                    moved.append((old, book))
+                else:
+                    added.append(book)
+
+        if self.content_hash:
+            self._hash_books(added + changed)
+            if added and delta.removed:
+                matched = {id(old) for old, _ in moved}
+                by_content = {}
+                for book in delta.removed:
+                    if book.content_hash is not None and id(book) not in matched:
+                        by_content.setdefault((book.file_size, book.content_hash), []).append(book)
+                remaining = []
+                for book in added:
+                    candidates = by_content.get((book.file_size, book.content_hash))
+                    if book.content_hash is not None and candidates:
+                        moved.append((candidates.pop(), book))
+                    else:
+                        remaining.append(book)
+                added = remaining
+
+        if moved:
+            matched = {id(old) for old, _ in moved}
+            delta.removed[:] = [book for book in delta.removed if id(book) not in matched]
+            for old, book in moved:
+                book.digest = old.digest
+            delta.modified.extend(moved)
+            delta.added[:] = added
+            logger.info("%d livros movidos ou renomeados mantêm o ID anterior", len(moved))
+
+        if added and not first:
+            self._unique_ids(dirs, added)
+
+    def _hash_books(self, books):
+        """
+        Calcula o hash parcial do conteúdo dos livros que ainda não o têm.
+
+        Args:
+            books: Lista de BookRecord
+        """
+        books = [book for book in books if book.content_hash is None]
+        if not books:
+            return
+        paths = [os.path.join(self.root, book.file_path) for book in books]
+        sizes = [book.file_size for book in books]
+        if self.workers > 1 and len(books) > 1:
+            with ThreadPoolExecutor(self.workers, thread_name_prefix='opds-hash') as executor:
+                hashes = list(executor.map(partial_hash, paths, sizes))
+        else:
+            hashes = [partial_hash(path, size) for path, size in zip(paths, sizes)]
+        for book, value in zip(books, hashes):
+            book.content_hash = value
+
+    def _unique_ids(self, dirs, added):
+        """
+        Garante que os livros novos não repitam o ID de outro livro.
+
+        O ID de um livro novo é o MD5 do caminho, que pode ser o ID mantido
+        por um livro que esteve nesse caminho antes de ser movido. Nesse
+        caso, o ID é derivado novamente até não colidir.
+
+        Args:
+            dirs: Índice novo
+            added: Livros novos do escaneamento
+        """
+        new = {id(book) for book in added}
+        taken = {
+            book.digest
+            for state in dirs.values()
+            for _, _, book in state.files.values()
+            if id(book) not in new
+        }
+        for book in added:
+            while book.digest in taken:
+                book.digest = hashlib.md5(book.digest).digest()
+            taken.add(book.digest)
+
+    def _join(self, relative_dir, name):
+        """Junta um diretório relativo e um nome ('' representa a raiz)."""
+        return os.path.join(relative_dir, name) if relative_dir else name
+
+    def _drop_subtree(self, relative_dir, dirs, delta):
+        """
+        Remove um diretório e seus descendentes do índice.
+
+        Args:
+            relative_dir: Diretório relativo à raiz
+            dirs: Índice sendo atualizado
+            delta: ScanDelta que recebe os livros removidos
+        """
+        prefix = relative_dir + os.sep
+        for key in [key for key in dirs if key == relative_dir or key.startswith(prefix)]:
+            delta.removed.extend(book for _, _, book in dirs.pop(key).files.values())
+
+    def _walk(self, relative_dir, mtime, previous_dirs, dirs, full, delta, progress=None):
+        """
+        Percorre uma subárvore, atualizando o índice.
+
+        Args:
+            relative_dir: Diretório inicial relativo à raiz
+            mtime: st_mtime_ns atual do diretório inicial
+            previous_dirs: Índice anterior, usado para reaproveitar estados
+            dirs: Índice novo, preenchido com os diretórios visitados
+            full: Listar todos os diretórios mesmo com mtime inalterado
+            delta: ScanDelta a ser preenchido com as mudanças encontradas
+            progress: Função chamada com ``delta`` após cada diretório (opcional)
+        """
+        stack = [(relative_dir, mtime)]
+        while stack:
+            relative_dir, mtime = stack.pop()
+            previous = previous_dirs.get(relative_dir)
+            state = self._scan_directory(relative_dir, mtime, previous, full, delta)
+            dirs[relative_dir] = state
+            if progress is not None:
+                progress(delta)
+
+            for name in state.subdirs:
+                relative_sub = self._join(relative_dir, name)
+                try:
+                    sub_mtime = os.stat(os.path.join(self.root, relative_sub)).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    # Falha temporária (ex: montagem de rede): manter o estado anterior
+                    logger.warning("Não foi possível acessar %s: %s", relative_sub, e)
+                    sub_mtime = None
+                stack.append((relative_sub, sub_mtime))
+
+    def _walk_parallel(self, relative_dir, mtime, previous_dirs, dirs, full, delta, progress=None):
+        """
+        Percorre uma subárvore listando os diretórios em paralelo.
+
+        Cada diretório é uma tarefa do pool, que o lista e agenda seus
+        subdiretórios como novas tarefas. Os resultados são incorporados na
+        mesma ordem do percurso serial de ``_walk`` (mesmos argumentos), então
+        o índice e o ScanDelta não dependem da ordem em que as tarefas
+        terminam. Cada thread faz uma operação no sistema de arquivos por vez,
+        então o número de threads limita as operações simultâneas.
+        """
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='opds-scan') as executor:
+            stack = [executor.submit(self._scan_task, executor, relative_dir, previous_dirs, full, mtime)]
+            while stack:
+                result = stack.pop().result()
+                if result is None:
+                    continue
+                relative_dir, state, found, children = result
+                dirs[relative_dir] = state
+                delta.added.extend(found.added)
+                delta.removed.extend(found.removed)
+                delta.modified.extend(found.modified)
+                if progress is not None:
+                    progress(delta)
+                stack.extend(children)
+
+    def _scan_task(self, executor, relative_dir, previous_dirs, full, mtime=None):
+        """
+        Tarefa de ``_walk_parallel``: lista um diretório e agenda os subdiretórios.
+
+        Args:
+            executor: Pool onde os subdiretórios são agendados
+            relative_dir: Diretório relativo à raiz
+            previous_dirs: Índice anterior, usado para reaproveitar estados
+            full: Listar o diretório mesmo com mtime inalterado
+            mtime: st_mtime_ns do diretório, se já conhecido
+
+        Returns:
+            Tupla (diretório, DirectoryState, ScanDelta do diretório, futures dos
+            subdiretórios) ou None se o diretório deixou de existir
+        """
+        if mtime is None:
+            try:
+                mtime = os.stat(os.path.join(self.root, relative_dir)).st_mtime_ns
+            except FileNotFoundError:
+                return None
+            except OSError as e:
+                # Falha temporária (ex: montagem de rede): manter o estado anterior
+                logger.warning("Não foi possível acessar %s: %s", relative_dir, e)
+
+        found = ScanDelta([], [], [])
+        state = self._scan_directory(relative_dir, mtime, previous_dirs.get(relative_dir), full, found)
+        children = [
+            executor.submit(self._scan_task, executor, self._join(relative_dir, name), previous_dirs, full)
+            for name in state.subdirs
+        ]
+        return relative_dir, state, found, children
+
+    def _scan_directory(self, relative_dir, mtime, previous, full, delta):
+        """
+        Atualiza o estado de um diretório, listando-o apenas se necessário.
+
+        Args:
+            relative_dir: Caminho do diretório relativo à raiz ('' para a raiz)
+            mtime: st_mtime_ns atual do diretório (None se inacessível)
+            previous: DirectoryState anterior do diretório (ou None)
+            full: Forçar a listagem mesmo com mtime inalterado
+            delta: ScanDelta a ser preenchido com as mudanças encontradas
+
+        Returns:
+            DirectoryState atualizado
+        """
+        if previous is not None and (mtime is None or (mtime == previous.mtime and not full)):
+            return previous
+        previous_files = previous.files if previous is not None else {}
+        files = {}
+        subdirs = []
+        directory = os.path.join(self.root, relative_dir)
+
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.skip:
+                                subdirs.append(entry.name)
+                            continue
+                        if os.path.splitext(entry.name)[1].lower() not in self.extensions:
+                            continue
+                        if not entry.is_file() or entry.path in self.skip:
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+
+                    known = previous_files.get(entry.name)
+                    if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                        files[entry.name] = known
+                        continue
+
+                    relative_path = self._join(relative_dir, entry.name)
+                    book = self.make_book(entry.path, relative_path, stat)
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns, book)
+                    if known is None:
+                        delta.added.append(book)
+                    else:
+                        # Mesmo arquivo alterado: mantém o ID, que pode ter
+                        # vindo de um caminho anterior (livro movido)
+                        book.digest = known[2].digest
+                        delta.modified.append((known[2], book))
+        except FileNotFoundError:
+            # O diretório sumiu depois do stat: seus livros foram removidos (os
+            # dos subdiretórios saem junto com eles, por não estarem no índice novo)
+            delta.removed.extend(book for _, _, book in previous_files.values())
+            return DirectoryState(mtime, {}, [])
+        except OSError as e:
+            logger.warning("Não foi possível listar %s: %s", directory, e)
+            if previous is not None:
+                return previous
+            return DirectoryState(None, {}, [])
+
+        for name, (_, _, book) in previous_files.items():
+            if name not in files:
+                delta.removed.append(book)
+
+        subdirs.sort()
+        return DirectoryState(mtime, files, subdirs)
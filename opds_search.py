@@ -0,0 +1,206 @@
+"""
+Índice invertido em memória para a busca do catálogo
+"""
+
+import bisect
+import re
+import threading
+import unicodedata
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Peso de cada campo no ranking (um termo no título vale mais que no caminho)
+FIELD_WEIGHTS = (
+    ('title', 8),
+    ('authors', 4),
+    ('category', 2),
+    ('file_path', 1),
+)
+
+# Termos mais curtos que isso só casam exatamente (sem busca por prefixo)
+MIN_PREFIX_LENGTH = 2
+
+# Fator aplicado ao peso quando o termo casa apenas como prefixo
+PREFIX_FACTOR = 0.5
+
+
+def normalize(text):
+    """Converte para minúsculas e remove acentos (ação -> acao)."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Divide um texto em termos normalizados."""
+    return TOKEN_PATTERN.findall(normalize(text))
+
+
+class SearchIndex:
+    """
+    Índice invertido de termos para IDs de livros.
+
+    Cada termo aponta para os livros que o contêm, com um peso que depende
+    do campo onde aparece. Os termos também ficam em uma lista ordenada, o
+    que permite encontrar todos os termos com um dado prefixo por busca
+    binária. O índice é atualizado incrementalmente a partir dos ScanDelta
+    dos escaneamentos.
+    """
+
+    def __init__(self):
+        """Inicializa um índice vazio."""
+        self._postings = {}  # termo -> {digest do livro: peso}
+        self._terms = []     # termos ordenados, para busca por prefixo
+        self._docs = {}      # digest do livro -> {termo: peso}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._ready.set()
+
+    def __len__(self):
+        """Quantidade de livros indexados."""
+        return len(self._docs)
+
+    def invalidate(self):
+        """Faz as buscas aguardarem até a próxima chamada de ``rebuild``."""
+        self._ready.clear()
+
+    def rebuild(self, books):
+        """
+        Reconstrói o índice do zero.
+
+        Args:
+            books: Lista de BookRecord
+        """
+        with self._lock:
+            self._postings = {}
+            self._docs = {}
+            for book in books:
+                self._add(book)
+            self._terms = sorted(self._postings)
+        self._ready.set()
+
+    def update(self, delta):
+        """
+        Aplica as mudanças de um escaneamento ao índice.
+
+        Args:
+            delta: ScanDelta com livros adicionados, removidos e modificados
+        """
+        self._ready.wait()
+        with self._lock:
+            for book in delta.removed:
+                self._remove(book.digest)
+            for old, _ in delta.modified:
+                self._remove(old.digest)
+            new_terms = []
+            for book in delta.added + [new for _, new in delta.modified]:
+                new_terms.extend(self._add(book))
+            new_terms = [term for term in set(new_terms) if term in self._postings]
+            if not new_terms:
+                return
+            # Poucos termos novos: inserir na posição; muitos: reordenar tudo
+            if len(new_terms) * 8 < len(self._terms):
+                for term in new_terms:
+                    bisect.insort(self._terms, term)
+            else:
+                self._terms = sorted(self._postings)
+
+    def search(self, query):
+        """
+        Busca livros que contenham todos os termos da consulta.
+
+        Termos com pelo menos MIN_PREFIX_LENGTH caracteres também casam como
+        prefixo de termos maiores, com peso menor que o do termo exato.
+
+        Args:
+            query: Texto da consulta
+
+        Returns:
+            Lista de tuplas (pontuação, digest do livro), da maior para a menor
+            pontuação
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        self._ready.wait()
+        with self._lock:
+            matches = [self._match(term) for term in terms]
+
+        # Interseção começando pelo termo mais seletivo
+        matches.sort(key=len)
+        scores = dict(matches[0])
+        for match in matches[1:]:
+            scores = {book_id: score + match[book_id] for book_id, score in scores.items() if book_id in match}
+            if not scores:
+                return []
+
+        return sorted(((score, book_id) for book_id, score in scores.items()), key=lambda x: -x[0])
+
+    def _match(self, term):
+        """
+        Retorna os livros que casam com um termo (chamar com o lock).
+
+        Returns:
+            Dicionário digest do livro -> pontuação
+        """
+        found = dict(self._postings.get(term, {}))
+        if len(term) < MIN_PREFIX_LENGTH:
+            return found
+
+        start = bisect.bisect_right(self._terms, term)
+        for position in range(start, len(self._terms)):
+            other = self._terms[position]
+            if not other.startswith(term):
+                break
+            for book_id, weight in self._postings[other].items():
+                score = weight * PREFIX_FACTOR
+                if found.get(book_id, 0) < score:
+                    found[book_id] = score
+        return found
+
+    def _add(self, book):
+        """
+        Indexa um livro (chamar com o lock).
+
+        Returns:
+            Lista de termos que passaram a existir no índice (ainda fora de
+            ``self._terms``)
+        """
+        self._remove(book.digest)
+        weights = {}
+        for field, weight in FIELD_WEIGHTS:
+            value = getattr(book, field)
+            if not value:
+                continue
+            if isinstance(value, tuple):
+                value = ' '.join(value)
+            for term in tokenize(value):
+                weights[term] = max(weights.get(term, 0), weight)
+
+        book_id = book.digest
+        self._docs[book_id] = weights
+        new_terms = []
+        for term, weight in weights.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                new_terms.append(term)
+            posting[book_id] = weight
+        return new_terms
+
+    def _remove(self, book_id):
+        """Remove um livro do índice (chamar com o lock)."""
+        weights = self._docs.pop(book_id, None)
+        if weights is None:
+            return
+        for term in weights:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(book_id, None)
+            if not posting:
+                del self._postings[term]
+                position = bisect.bisect_left(self._terms, term)
+                if position < len(self._terms) and self._terms[position] == term:
+                    del self._terms[position]
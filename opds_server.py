@@ -2,11 +2,99 @@
 Servidor HTTP para servir o feed OPDS e os arquivos de livros
 """
 
+import email.utils
+import logging
 import os
+import queue
+import socket
+import threading
+import time
 import urllib.parse
+import uuid
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from pathlib import Path
 
+from opds_catalog import MIME_TYPES
+from opds_covers import CoverCache
+from opds_generator import compressor
+
+
+logger = logging.getLogger('opds.server')
+
+# Rótulo de rota nas métricas, pelo prefixo do caminho (mantém poucas séries)
+METRIC_ROUTES = (
+    ('/opds', 'opds'),
+    ('/download/', 'download'),
+    ('/books/', 'books'),
+    ('/covers/', 'covers'),
+    ('/thumbnails/', 'covers'),
+    ('/pages/', 'pages'),
+    ('/metrics', 'metrics'),
+)
+
+
+def _metric_route(path):
+    """Retorna o rótulo de rota de um caminho requisitado."""
+    for prefix, route in METRIC_ROUTES:
+        if path.startswith(prefix):
+            return route
+    return 'other'
+
+
+def _quality_values(header):
+    """
+    Interpreta um cabeçalho com pesos (Accept, Accept-Encoding...).
+    
+    Args:
+        header: Valor do cabeçalho (ex.: ``gzip;q=1.0, deflate;q=0.5``)
+        
+    Returns:
+        Dicionário valor -> peso (q), com os valores em minúsculas
+    """
+    weights = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    weight = float(param[2:])
+                except ValueError:
+                    weight = None
+        if weight is not None:
+            weights[name.strip().lower()] = weight
+    return weights
+
+
+def _book_validators(size, mtime_ns):
+    """
+    Calcula os validadores HTTP de um arquivo de livro.
+    
+    Args:
+        size: Tamanho do arquivo em bytes
+        mtime_ns: Data de modificação do arquivo (st_mtime_ns)
+        
+    Returns:
+        Tupla (ETag, timestamp da última modificação)
+    """
+    return f'"{size:x}-{mtime_ns:x}"', mtime_ns / 1e9
+
+
+class _CountingWriter:
+    """Envolve o ``wfile`` de uma conexão contando os bytes escritos."""
+    
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self.count = 0
+    
+    def write(self, data):
+        self.count += len(data)
+        return self._wfile.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self._wfile, name)
+
 
 class OPDSRequestHandler(SimpleHTTPRequestHandler):
     """Handler HTTP personalizado para servir OPDS e livros."""
@@ -15,21 +103,83 @@ class OPDSRequestHandler(SimpleHTTPRequestHandler):
     # e definir protocolo HTTP/1.1
     protocol_version = 'HTTP/1.1'
     
+    # Cabeçalhos e corpo são escritos separadamente; com o algoritmo de Nagle
+    # ligado, o corpo de respostas pequenas em keep-alive esperaria o ACK
+    # atrasado do cliente (~40 ms por requisição)
+    disable_nagle_algorithm = True
+    
+    # Máximo de intervalos aceitos em um único cabeçalho Range
+    MAX_RANGES = 16
+    
+    # Formatos de livro que valem a pena comprimir no envio (texto puro);
+    # EPUB, CBZ, PDF etc. já são comprimidos e são enviados como estão
+    COMPRESSIBLE_EXTENSIONS = {'.txt', '.fb2'}
+    
     def __init__(self, *args, books_dir=None, generator=None, **kwargs):
         """
         Inicializa o handler.
         
         Args:
-            books_dir: Diretório contendo os livros
+            books_dir: Diretório contendo os livros (a primeira raiz; os
+                       caminhos são resolvidos pelas raízes do gerador)
             generator: Instância do OPDSGenerator
         """
         self.books_dir = books_dir
         self.generator = generator
         super().__init__(*args, **kwargs)
     
+    def setup(self):
+        """Aplica o timeout de inatividade das conexões keep-alive."""
+        self.timeout = getattr(self.server, 'keepalive_timeout', None)
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+    
+    def handle_one_request(self):
+        """Processa uma requisição, marcando a conexão como ociosa enquanto espera."""
+        track = getattr(self.server, 'connection_idle', None)
+        if track:
+            track(self.connection)
+        self._started = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._started is not None:
+                self._record_request()
+        # Durante o encerramento, não manter a conexão aberta após a resposta
+        if getattr(self.server, 'draining', False):
+            self.close_connection = True
+    
+    def parse_request(self):
+        """Marca a conexão como ocupada assim que a linha de requisição chega."""
+        track = getattr(self.server, 'connection_busy', None)
+        if track:
+            track(self.connection)
+        # O tempo da requisição conta a partir daqui (sem a espera em keep-alive)
+        self._started = time.perf_counter()
+        self._status = None
+        self.wfile.count = 0
+        return super().parse_request()
+    
+    def send_response(self, code, message=None):
+        """Guarda o código de status para as métricas."""
+        self._status = code
+        super().send_response(code, message)
+    
+    def _record_request(self):
+        """Registra a duração, o status e os bytes da requisição nas métricas."""
+        metrics = self.generator.metrics
+        route = _metric_route(urllib.parse.urlsplit(getattr(self, 'path', '')).path)
+        metrics.observe('opds_http_request_duration_seconds', time.perf_counter() - self._started, route=route)
+        metrics.inc('opds_http_requests_total', route=route, code=self._status or 0)
+        metrics.inc('opds_http_response_bytes_total', self.wfile.count, route=route)
+    
     def log_message(self, format, *args):
-        """Override para logar mensagens de forma mais limpa."""
-        print(f"[{self.log_date_time_string()}] {format % args}")
+        """Registra o log de acesso (nível info; formatado só se for exibido)."""
+        logger.info(f'%s {format}', self.address_string(), *args)
+    
+    def log_error(self, format, *args):
+        """Registra erros do protocolo HTTP como avisos."""
+        logger.warning(f'%s {format}', self.address_string(), *args)
     
     def do_GET(self):
         """Processa requisições GET."""
@@ -39,18 +189,53 @@ class OPDSRequestHandler(SimpleHTTPRequestHandler):
             
             # Decodificar o caminho (converte %20 para espaço, etc)
             path = urllib.parse.unquote(parsed_path.path, encoding='utf-8', errors='replace')
-            
-            # Log da requisição
-            print(f"[GET] Caminho requisitado: {path}")
-            
-            # Rota para o feed OPDS
-            if path == '/opds' or path == '/opds/':
-                self.serve_opds()
-            # Rota para livros
+            # Nos feeds, cada segmento é decodificado separadamente: um autor
+            # "AC/DC" chega como AC%2FDC e continua sendo um único segmento
+            segments = [
+                urllib.parse.unquote(segment, encoding='utf-8', errors='replace')
+                for segment in parsed_path.path.split('/')
+            ]
+        
+            logger.debug("GET %s", path)
+        
+            # Rotas dos feeds OPDS (navegação e aquisição)
+            if segments[1:2] == ['opds']:
+                query = urllib.parse.parse_qs(parsed_path.query)
+                try:
+                    page = int(query.get('page', ['1'])[0])
+                except ValueError:
+                    self.send_error(400, "Página inválida")
+                    return
+                self.serve_opds(segments[2:], page, query.get('q', [''])[0])
+            # Download pelo ID do catálogo: /download/<id>/<nome do arquivo>
+            elif path.startswith('/download/'):
+                book_id = path[10:].partition('/')[0]
+                self.serve_download(book_id)
+            # Rota antiga para livros, pelo caminho relativo
             elif path.startswith('/books/'):
                 # Remove '/books/' e qualquer barra inicial extra
                 relative_path = path[7:].lstrip('/')
                 self.serve_book(relative_path)
+            # Capas e miniaturas extraídas dos livros
+            elif path.startswith('/covers/') or path.startswith('/thumbnails/'):
+                kind, _, book_id = path[1:].partition('/')
+                version = urllib.parse.parse_qs(parsed_path.query).get('v', [None])[0]
+                self.serve_cover(book_id, kind == 'thumbnails', version)
+            # Páginas de quadrinhos (OPDS-PSE): /pages/<id>?page=N&width=W
+            elif path.startswith('/pages/'):
+                query = urllib.parse.parse_qs(parsed_path.query)
+                try:
+                    number = int(query.get('page', [''])[0])
+                    # Clientes que não substituem {maxWidth} recebem a página original
+                    width = query.get('width', [''])[0]
+                    max_width = int(width) if width.isdigit() and int(width) > 0 else None
+                except ValueError:
+                    self.send_error(400, "Página inválida")
+                    return
+                self.serve_page(path[7:], number, max_width, query.get('v', [None])[0])
+            # Métricas no formato do Prometheus
+            elif path == '/metrics':
+                self.serve_metrics()
             # Rota raiz - redirecionar para OPDS
             elif path == '/' or path == '':
                 self.send_response(302)
@@ -59,12 +244,19 @@ class OPDSRequestHandler(SimpleHTTPRequestHandler):
             else:
                 self.send_error(404, "Recurso não encontrado")
         except Exception as e:
-            print(f"[ERRO] Erro ao processar requisição: {e}")
-            print(f"[ERRO] Caminho original: {self.path}")
+            logger.exception("Erro ao processar requisição %s", self.path)
             self.send_error(500, f"Erro ao processar requisição: {str(e)}")
     
-    def serve_opds(self):
-        """Serve o feed OPDS com URLs personalizadas baseadas no Host da requisição."""
+    def serve_opds(self, feed_path=(), page=1, query=''):
+        """
+        Serve um feed OPDS com URLs personalizadas baseadas no Host da requisição.
+        
+        Args:
+            feed_path: Segmentos do caminho do feed após ``/opds``, já
+                       decodificados (podem conter '/')
+            page: Número da página nos feeds de aquisição
+            query: Texto da busca (parâmetro ``q``)
+        """
         # Obter o Host do cabeçalho da requisição
         host_header = self.headers.get('Host')
         
@@ -77,89 +269,618 @@ class OPDSRequestHandler(SimpleHTTPRequestHandler):
             server_ip = self.request.getsockname()[0]
             base_url = f"http://{server_ip}:{self.generator.port}"
         
-        # Gerar OPDS dinâmico com a URL correta
-        opds_content = self.generator.get_opds_content(base_url)
+        # Clientes que preferem OPDS 2.0 recebem o feed JSON equivalente
+        feed_path = [segment for segment in feed_path if segment]
+        if feed_path[:1] != ['v2'] and self._prefers_opds2():
+            feed_path = ['v2'] + feed_path
+        
+        # Obter o feed renderizado (do cache, se o catálogo não mudou).
+        # Clientes HTTP/1.0 não suportam chunked, então recebem o feed completo;
+        # variantes comprimidas também vêm completas (comprimidas uma vez só)
+        encoding = self._accepted_encoding()
+        chunked = self.request_version != 'HTTP/1.0' and encoding is None
+        feed = self.generator.get_feed(
+            base_url, feed_path, page, stream=chunked, query=query, encoding=encoding
+        )
+        
+        if feed is None:
+            self.send_error(404, "Feed não encontrado")
+            return
         
-        if opds_content:
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/atom+xml;profile=opds-catalog;kind=acquisition')
-            self.send_header('Content-Length', len(opds_content.encode('utf-8')))
+        if self._is_not_modified(feed.etag, feed.last_modified):
+            self.send_response(304)
+            self.send_header('ETag', feed.etag)
+            self.send_header('Last-Modified', self.date_time_string(feed.last_modified))
+            self.send_header('Vary', 'Accept, Accept-Encoding')
             self.end_headers()
-            self.wfile.write(opds_content.encode('utf-8'))
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', feed.content_type)
+        self.send_header('ETag', feed.etag)
+        self.send_header('Last-Modified', self.date_time_string(feed.last_modified))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        if feed.content_encoding:
+            self.send_header('Content-Encoding', feed.content_encoding)
+        
+        if isinstance(feed.content, bytes):
+            self.send_header('Content-Length', len(feed.content))
+            self.end_headers()
+            self.wfile.write(feed.content)
         else:
-            self.send_error(500, "Feed OPDS não disponível")
+            # Feed ainda não renderizado: enviar enquanto é gerado
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self._write_chunked(feed.content)
+    
+    def serve_metrics(self):
+        """Serve as métricas internas no formato de texto do Prometheus."""
+        body = self.generator.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', len(body))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _write_chunked(self, chunks):
+        """
+        Envia um corpo com Transfer-Encoding: chunked.
+        
+        Args:
+            chunks: Iterador de blocos de bytes
+        """
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception:
+            # A resposta já começou: não há como enviar um erro, só encerrar
+            self.close_connection = True
+            raise
+    
+    def _accepted_encoding(self):
+        """
+        Escolhe a codificação de conteúdo a partir do cabeçalho Accept-Encoding.
+        
+        Returns:
+            'gzip', 'deflate' ou None (sem compressão)
+        """
+        header = self.headers.get('Accept-Encoding')
+        if not header:
+            return None
+        
+        weights = _quality_values(header)
+        
+        # Em caso de empate, gzip tem preferência
+        best = None
+        for encoding in ('gzip', 'deflate'):
+            weight = weights.get(encoding, weights.get('*', 0))
+            if weight > 0 and (best is None or weight > weights.get(best, weights.get('*', 0))):
+                best = encoding
+        return best
+    
+    def _prefers_opds2(self):
+        """
+        Verifica pelo cabeçalho Accept se o cliente prefere feeds OPDS 2.0 (JSON).
+        
+        Sem o cabeçalho, ou com preferências empatadas, vale o Atom (OPDS 1.2),
+        que é o formato entendido pela maioria dos leitores.
+        
+        Returns:
+            True se application/opds+json (ou application/json) tem peso
+            maior que o do Atom
+        """
+        header = self.headers.get('Accept')
+        if not header:
+            return False
+        
+        weights = _quality_values(header)
+        json_weight = max(weights.get('application/opds+json', 0), weights.get('application/json', 0))
+        atom_weight = weights.get('application/atom+xml', weights.get('application/*', weights.get('*/*', 0)))
+        return json_weight > atom_weight
+    
+    def _send_book_not_modified(self, size, mtime_ns):
+        """
+        Responde 304 se o cliente já tem a versão atual do livro.
+        
+        Args:
+            size: Tamanho do arquivo em bytes
+            mtime_ns: Data de modificação do arquivo (st_mtime_ns)
+            
+        Returns:
+            True se a resposta 304 foi enviada
+        """
+        etag, last_modified = _book_validators(size, mtime_ns)
+        if not self._is_not_modified(etag, last_modified):
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(last_modified))
+        self.end_headers()
+        return True
+    
+    def _if_range_matches(self, etag, last_modified):
+        """
+        Avalia o cabeçalho If-Range de uma requisição com Range.
+        
+        Args:
+            etag: ETag atual do recurso
+            last_modified: Timestamp da última modificação do recurso
+            
+        Returns:
+            True se o Range deve ser atendido (sem If-Range, ou se o
+            validador informado ainda é o atual); False para enviar o
+            arquivo inteiro
+        """
+        if_range = self.headers.get('If-Range')
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        # ETags fracos nunca valem para If-Range
+        if if_range.startswith('"'):
+            return if_range == etag
+        if if_range.startswith('W/'):
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_range)
+        except (TypeError, ValueError, IndexError):
+            return False
+        return since is not None and int(last_modified) == int(since.timestamp())
+    
+    def _is_not_modified(self, etag, last_modified):
+        """
+        Avalia os cabeçalhos condicionais If-None-Match e If-Modified-Since.
+        
+        Args:
+            etag: ETag atual do recurso
+            last_modified: Timestamp da última modificação do recurso
+            
+        Returns:
+            True se o cliente já tem a versão atual (resposta 304)
+        """
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            # If-None-Match tem precedência sobre If-Modified-Since
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError):
+                return False
+            if since is None:
+                return False
+            return int(last_modified) <= since.timestamp()
+        
+        return False
+    
+    def serve_download(self, book_id):
+        """
+        Serve um arquivo de livro a partir do seu ID no catálogo.
+        
+        O ID é resolvido pelo índice em memória para um caminho já validado
+        no escaneamento, com o MIME type do registro; diferente de
+        ``serve_book``, nenhum ``resolve()``/``exists()``/``stat()`` é feito
+        antes de abrir o arquivo.
+        
+        Args:
+            book_id: ID do livro em hexadecimal
+        """
+        found = self.generator.get_download(book_id)
+        if found is None:
+            self.send_error(404, "Livro não encontrado")
+            return
+        book, book_path = found
+        logger.debug("Servindo livro: %s", book.file_path)
+        # Validadores do tamanho e da data já registrados no catálogo: um
+        # download repetido recebe 304 sem nem abrir o arquivo
+        self._send_book(book_path, book.mime_type, book.file_path, (book.file_size, book.mtime_ns))
     
     def serve_book(self, relative_path):
         """
-        Serve um arquivo de livro.
+        Serve um arquivo de livro pelo caminho relativo (URLs ``/books/``).
+        
+        Mantido para clientes com links antigos; os feeds usam ``/download/``.
+        Com várias raízes, o primeiro componente do caminho é o nome da raiz.
         
         Args:
             relative_path: Caminho relativo do livro
         """
         try:
-            print(f"[BOOK] Servindo livro: {relative_path}")
-            
+            logger.debug("Servindo livro: %s", relative_path)
+        
             # Construir caminho completo
             # Normalizar o caminho para lidar com diferentes separadores
             relative_path = relative_path.replace('\\', '/')
-            book_path = self.books_dir / relative_path
-            
-            print(f"[BOOK] Caminho completo: {book_path}")
-            
+            resolved = self.generator.library_path(relative_path)
+            if resolved is None:
+                logger.debug("Biblioteca não encontrada: %s", relative_path)
+                self.send_error(404, "Livro não encontrado")
+                return
+            books_dir, book_relative = resolved
+            book_path = books_dir / book_relative
+        
             # Resolver o caminho (resolve links simbólicos e ..)
             book_path = book_path.resolve()
-            books_dir_resolved = self.books_dir.resolve()
-            
-            print(f"[BOOK] Caminho resolvido: {book_path}")
-            print(f"[BOOK] Diretório base: {books_dir_resolved}")
+            books_dir_resolved = books_dir.resolve()
+            logger.debug("Caminho resolvido: %s (diretório base: %s)", book_path, books_dir_resolved)
             
             # Verificação de segurança: garantir que o arquivo está dentro do diretório permitido
             if not str(book_path).startswith(str(books_dir_resolved)):
-                print(f"[ERRO] Tentativa de acesso fora do diretório permitido")
+                logger.warning("Tentativa de acesso fora do diretório permitido: %s", relative_path)
                 self.send_error(403, "Acesso negado")
                 return
             
             if not book_path.exists():
-                print(f"[ERRO] Arquivo não encontrado: {book_path}")
+                logger.debug("Arquivo não encontrado: %s", book_path)
                 self.send_error(404, "Livro não encontrado")
                 return
             
             if not book_path.is_file():
-                print(f"[ERRO] Não é um arquivo: {book_path}")
+                logger.debug("Não é um arquivo: %s", book_path)
                 self.send_error(400, "Recurso inválido")
                 return
+        except Exception:
+            logger.exception("Erro ao servir livro '%s'", relative_path)
+            self.send_error(500, "Erro ao servir arquivo")
+            return
+        
+        self._send_book(str(book_path), self._get_mime_type(book_path), relative_path)
+    
+    def _send_book(self, book_path, mime_type, label, version=None):
+        """
+        Envia um arquivo de livro, com suporte a Range, compressão e GET condicional.
+        
+        O ETag e o Last-Modified vêm do tamanho e da data de modificação do
+        arquivo; ``If-None-Match``/``If-Modified-Since`` resultam em 304 e
+        ``If-Range`` só mantém o Range se o arquivo não mudou. O arquivo é
+        aberto pelo cache de arquivos abertos do gerador.
+        
+        Args:
+            book_path: Caminho absoluto do arquivo
+            mime_type: MIME type do livro
+            label: Caminho relativo do livro (para os logs)
+            version: Tupla (tamanho, st_mtime_ns) do catálogo, ou None para
+                     usar o stat do arquivo aberto
+        """
+        try:
+            if version is not None and self._send_book_not_modified(*version):
+                return
             
-            # Determinar MIME type
-            mime_type = self._get_mime_type(book_path)
+            # Servir arquivo em blocos, sem carregar o conteúdo na memória
+            with self.generator.open_files.open(book_path) as f:
+                if version != (f.size, f.mtime_ns):
+                    # Sem versão do catálogo, ou arquivo alterado desde o
+                    # último escaneamento: valem o tamanho e a data do arquivo
+                    version = (f.size, f.mtime_ns)
+                    if self._send_book_not_modified(*version):
+                        return
+                etag, last_modified = _book_validators(*version)
+                file_size = f.size
+                filename = os.path.basename(book_path)
+                logger.debug("Enviando arquivo: %s (%d bytes, %s)", filename, file_size, mime_type)
+                
+                ranges = None
+                if self._if_range_matches(etag, last_modified):
+                    ranges = self._parse_range(self.headers.get('Range'), file_size)
+                
+                if ranges == []:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{file_size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                
+                # Encoding do nome do arquivo para o cabeçalho
+                filename_encoded = urllib.parse.quote(filename.encode('utf-8'))
+                disposition = f'attachment; filename*=UTF-8\'\'{filename_encoded}'
+                
+                # Formatos de texto podem ser comprimidos (nunca em respostas parciais)
+                compressible = os.path.splitext(filename)[1].lower() in self.COMPRESSIBLE_EXTENSIONS
+                encoding = None
+                if compressible and ranges is None and self.request_version != 'HTTP/1.0':
+                    encoding = self._accepted_encoding()
+                
+                if encoding:
+                    logger.debug("Enviando com compressão %s", encoding)
+                    self.send_response(200)
+                    self.send_header('Content-Type', mime_type)
+                    self.send_header('Content-Encoding', encoding)
+                    self.send_header('Content-Disposition', disposition)
+                    # Os bytes comprimidos não são os do arquivo: ETag fraco
+                    self.send_header('ETag', f'W/{etag}')
+                    self.send_header('Last-Modified', self.date_time_string(last_modified))
+                    self.send_header('Vary', 'Accept-Encoding')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    self._write_chunked(self._compress_file(f, encoding))
+                elif ranges is None:
+                    self.send_response(200)
+                    self.send_header('Content-Type', mime_type)
+                    self.send_header('Content-Length', file_size)
+                    self.send_header('Content-Disposition', disposition)
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', self.date_time_string(last_modified))
+                    if compressible:
+                        self.send_header('Vary', 'Accept-Encoding')
+                    self.end_headers()
+                    self._send_file_range(f, 0, file_size)
+                elif len(ranges) == 1:
+                    start, end = ranges[0]
+                    logger.debug("Enviando intervalo %d-%d/%d", start, end, file_size)
+                    self.send_response(206)
+                    self.send_header('Content-Type', mime_type)
+                    self.send_header('Content-Length', end - start + 1)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+                    self.send_header('Content-Disposition', disposition)
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', self.date_time_string(last_modified))
+                    self.end_headers()
+                    self._send_file_range(f, start, end - start + 1)
+                else:
+                    logger.debug("Enviando %d intervalos (multipart/byteranges)", len(ranges))
+                    self._send_multipart_ranges(
+                        f, ranges, file_size, mime_type, disposition, (etag, last_modified)
+                    )
             
-            # Servir arquivo
-            file_size = book_path.stat().st_size
-            print(f"[BOOK] Enviando arquivo: {book_path.name} ({file_size} bytes, {mime_type})")
+        except FileNotFoundError:
+            # Removido do disco depois do último escaneamento
+            logger.debug("Arquivo não encontrado: %s", book_path)
+            self.send_error(404, "Livro não encontrado")
+        except (BrokenPipeError, ConnectionResetError):
+            # O cliente cancelou o download; não há para quem responder
+            logger.debug("Cliente desconectou durante o envio de '%s'", label)
+            self.close_connection = True
+        except Exception:
+            logger.exception("Erro ao servir livro '%s'", label)
+            self.send_error(500, "Erro ao servir arquivo")
+    
+    def serve_cover(self, book_id, thumbnail=False, version=None):
+        """
+        Serve a capa ou a miniatura de um livro a partir do cache em disco.
+        
+        URLs com a versão atual do arquivo (``?v=``) nunca mudam de conteúdo,
+        então podem ser guardadas pelo cliente indefinidamente.
+        
+        Args:
+            book_id: ID do livro
+            thumbnail: Servir a miniatura em vez da capa
+            version: Versão do livro informada na URL (ou None)
+        """
+        # Uma imagem removida do cache (limite de tamanho ou outro processo)
+        # entre a consulta e a abertura é gerada de novo na segunda consulta
+        for _ in range(2):
+            found = self.generator.get_cover(book_id, thumbnail)
+            if found is None:
+                break
+            book, image_path, mime_type = found
+            try:
+                image = open(image_path, 'rb')
+            except FileNotFoundError:
+                continue
             
-            with open(book_path, 'rb') as f:
-                content = f.read()
+            current = CoverCache.version(book)
+            etag = f'"{CoverCache.cache_key(book)}{"-t" if thumbnail else ""}"'
+            if version == current:
+                cache_control = 'public, max-age=31536000, immutable'
+            else:
+                cache_control = 'no-cache'
             
-            self.send_response(200)
-            self.send_header('Content-Type', mime_type)
-            self.send_header('Content-Length', len(content))
-            # Encoding do nome do arquivo para o cabeçalho
-            filename_encoded = urllib.parse.quote(book_path.name.encode('utf-8'))
-            self.send_header('Content-Disposition', f'attachment; filename*=UTF-8\'\'{filename_encoded}')
-            self.send_header('Accept-Ranges', 'bytes')
+            try:
+                with image as f:
+                    stat = os.fstat(f.fileno())
+                    if self._is_not_modified(etag, stat.st_mtime):
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.send_header('Cache-Control', cache_control)
+                        self.end_headers()
+                        return
+                    
+                    self.send_response(200)
+                    self.send_header('Content-Type', mime_type)
+                    self.send_header('Content-Length', stat.st_size)
+                    self.send_header('ETag', etag)
+                    self.send_header('Cache-Control', cache_control)
+                    self.end_headers()
+                    self._send_file_range(f, 0, stat.st_size)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+            return
+        
+        self.send_error(404, "Capa não encontrada")
+    
+    def serve_page(self, book_id, number, max_width=None, version=None):
+        """
+        Serve uma página de um quadrinho, lida diretamente de dentro do arquivo.
+        
+        Como nas capas, URLs com a versão atual do arquivo (``?v=``) podem
+        ser guardadas pelo cliente indefinidamente.
+        
+        Args:
+            book_id: ID do livro
+            number: Número da página (a partir de 0)
+            max_width: Largura máxima em pixels (ou None)
+            version: Versão do livro informada na URL (ou None)
+        """
+        found = self.generator.get_page(book_id, number, max_width)
+        if found is None:
+            self.send_error(404, "Página não encontrada")
+            return
+        book, data, mime_type = found
+        
+        etag = f'"{CoverCache.cache_key(book)}-p{number}-w{max_width or 0}"'
+        if version == CoverCache.version(book):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+        
+        if self._is_not_modified(etag, book.mtime_ns / 1e9):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
             self.end_headers()
-            self.wfile.write(content)
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', mime_type)
+        self.send_header('Content-Length', len(data))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(book.mtime_ns / 1e9))
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+    
+    def _compress_file(self, f, encoding, block_size=64 * 1024):
+        """
+        Lê um arquivo em blocos, produzindo-o comprimido.
+        
+        Args:
+            f: Arquivo aberto em modo binário
+            encoding: 'gzip' ou 'deflate'
+            block_size: Tamanho dos blocos lidos do arquivo
             
-            print(f"[BOOK] Arquivo enviado com sucesso!")
+        Yields:
+            Blocos de bytes comprimidos
+        """
+        compress = compressor(encoding)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield compress.compress(block)
+        yield compress.flush()
+    
+    def _parse_range(self, range_header, file_size):
+        """
+        Interpreta o cabeçalho Range (apenas unidade ``bytes``).
+        
+        Args:
+            range_header: Valor do cabeçalho Range (ou None)
+            file_size: Tamanho do arquivo em bytes
             
-        except Exception as e:
-            print(f"[ERRO] Erro ao servir livro '{relative_path}': {e}")
-            import traceback
-            traceback.print_exc()
-            self.send_error(500, "Erro ao servir arquivo")
+        Returns:
+            None para servir o arquivo inteiro (sem Range ou Range inválido),
+            lista vazia se nenhum intervalo for satisfatível, ou lista de
+            tuplas (início, fim) inclusivas
+        """
+        if not range_header:
+            return None
+        
+        unit, _, spec = range_header.strip().partition('=')
+        if unit.strip().lower() != 'bytes' or not spec:
+            return None
+        
+        specs = [part.strip() for part in spec.split(',') if part.strip()]
+        if not specs or len(specs) > self.MAX_RANGES:
+            return None
+        
+        ranges = []
+        for part in specs:
+            first, sep, last = part.partition('-')
+            if not sep:
+                return None
+            first, last = first.strip(), last.strip()
+            try:
+                if first:
+                    start = int(first)
+                    end = int(last) if last else None
+                    if start < 0 or (end is not None and end < start):
+                        return None
+                    if end is None:
+                        end = file_size - 1
+                elif last:
+                    # Sufixo: últimos N bytes
+                    length = int(last)
+                    if length <= 0:
+                        continue
+                    start = max(file_size - length, 0)
+                    end = file_size - 1
+                else:
+                    return None
+            except ValueError:
+                return None
+            
+            if start >= file_size:
+                continue
+            ranges.append((start, min(end, file_size - 1)))
+        
+        return ranges
+    
+    def _send_file_range(self, f, offset, length):
+        """
+        Envia um trecho do arquivo para o cliente.
+        
+        Usa ``socket.sendfile`` (``os.sendfile`` sem cópia para o espaço do
+        usuário quando disponível, com cópia em blocos como alternativa).
+        
+        Args:
+            f: Arquivo aberto em modo binário
+            offset: Posição inicial no arquivo
+            length: Quantidade de bytes a enviar
+        """
+        if length <= 0:
+            return
+        self.wfile.flush()
+        sent = self.connection.sendfile(f, offset, length)
+        self.wfile.count += sent
+        if sent < length:
+            # Arquivo encolheu durante o envio: o Content-Length anunciado
+            # não será cumprido e a conexão não pode ser reaproveitada
+            logger.warning("Arquivo menor que o esperado: %d de %d bytes enviados", sent, length)
+            self.close_connection = True
+    
+    def _send_multipart_ranges(self, f, ranges, file_size, mime_type, disposition, validators):
+        """
+        Envia vários intervalos como ``multipart/byteranges``.
+        
+        Args:
+            f: Arquivo aberto em modo binário
+            ranges: Lista de tuplas (início, fim) inclusivas
+            file_size: Tamanho total do arquivo
+            mime_type: MIME type do arquivo
+            disposition: Valor do cabeçalho Content-Disposition
+            validators: Tupla (ETag, timestamp da última modificação)
+        """
+        boundary = uuid.uuid4().hex
+        part_headers = [
+            (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {mime_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+            ).encode('latin-1')
+            for start, end in ranges
+        ]
+        closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+        content_length = sum(len(h) for h in part_headers) + len(closing)
+        content_length += sum(end - start + 1 for start, end in ranges)
+        
+        self.send_response(206)
+        self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+        self.send_header('Content-Length', content_length)
+        self.send_header('Content-Disposition', disposition)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', validators[0])
+        self.send_header('Last-Modified', self.date_time_string(validators[1]))
+        self.end_headers()
+        
+        for header, (start, end) in zip(part_headers, ranges):
+            self.wfile.write(header)
+            self._send_file_range(f, start, end - start + 1)
+        self.wfile.write(closing)
     
     def _get_mime_type(self, file_path):
         """
-        Retorna o MIME type do arquivo.
+        Retorna o MIME type do arquivo, pela mesma tabela usada nos feeds.
         
         Args:
             file_path: Caminho do arquivo
@@ -167,40 +888,183 @@ class OPDSRequestHandler(SimpleHTTPRequestHandler):
         Returns:
             String com o MIME type
         """
-        mime_map = {
-            '.epub': 'application/epub+zip',
-            '.pdf': 'application/pdf',
-            '.mobi': 'application/x-mobipocket-ebook',
-            '.azw': 'application/vnd.amazon.ebook',
-            '.azw3': 'application/vnd.amazon.ebook',
-            '.fb2': 'text/fb2+xml',
-            '.djvu': 'image/vnd.djvu',
-            '.cbz': 'application/x-cbz',
-            '.cbr': 'application/x-cbr',
-            '.txt': 'text/plain',
-        }
+        return MIME_TYPES.get(file_path.suffix.lower(), 'application/octet-stream')
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    Servidor HTTP com um pool fixo de workers e fila de conexões limitada.
+    
+    A thread principal apenas aceita conexões e as coloca na fila; cada
+    worker atende uma conexão por vez (incluindo as requisições keep-alive
+    seguintes). Quando a fila está cheia, a conexão é recusada com 503.
+    """
+    
+    REJECT_RESPONSE = (
+        b'HTTP/1.1 503 Service Unavailable\r\n'
+        b'Retry-After: 1\r\n'
+        b'Content-Length: 0\r\n'
+        b'Connection: close\r\n\r\n'
+    )
+    
+    def __init__(self, server_address, handler_class, workers=8, queue_size=32,
+                 keepalive_timeout=15, drain_timeout=10, reuse_port=False):
+        """
+        Inicializa o servidor e inicia os workers.
+        
+        Args:
+            server_address: Tupla (host, porta)
+            handler_class: Classe (ou fábrica) do handler HTTP
+            workers: Número de threads que atendem conexões
+            queue_size: Máximo de conexões aceitas aguardando um worker
+            keepalive_timeout: Segundos de inatividade antes de fechar uma conexão
+            drain_timeout: Segundos máximos de espera pelos workers ao encerrar
+            reuse_port: Abrir o socket com SO_REUSEPORT, para que vários
+                        processos escutem na mesma porta (o kernel distribui
+                        as conexões entre eles)
+        """
+        self.request_queue_size = max(queue_size, 5)
+        self.reuse_port = reuse_port
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.keepalive_timeout = keepalive_timeout
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self._worker,
+                name=f'opds-worker-{i}',
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+    
+    def server_bind(self):
+        """Associa o socket ao endereço, com SO_REUSEPORT se solicitado."""
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+    
+    def process_request(self, request, client_address):
+        """Enfileira a conexão para um worker ou a recusa se a fila estiver cheia."""
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            logger.warning("Fila cheia, recusando conexão de %s", client_address[0])
+            try:
+                request.sendall(self.REJECT_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+    
+    def _worker(self):
+        """Loop de um worker: atende conexões da fila até receber o sinal de parada."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            request, client_address = item
+            with self._connections_lock:
+                self._connections[request] = False
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._connections_lock:
+                    self._connections.pop(request, None)
+                self.shutdown_request(request)
+    
+    def connection_idle(self, connection):
+        """Marca a conexão como ociosa (aguardando a próxima requisição)."""
+        with self._connections_lock:
+            if connection in self._connections:
+                self._connections[connection] = False
+        # Conexões que ficam ociosas durante o encerramento são fechadas na hora
+        if self.draining:
+            self._close_reading(connection)
+    
+    def connection_metrics(self):
+        """Conexões abertas por estado, para ``Metrics.collect``."""
+        with self._connections_lock:
+            active = sum(1 for busy in self._connections.values() if busy)
+            total = len(self._connections)
+        return [
+            ('opds_http_connections', active, {'state': 'active'}),
+            ('opds_http_connections', total - active, {'state': 'idle'}),
+        ]
+    
+    def connection_busy(self, connection):
+        """Marca a conexão como ocupada (requisição em andamento)."""
+        with self._connections_lock:
+            if connection in self._connections:
+                self._connections[connection] = True
+    
+    def _close_reading(self, connection):
+        """Interrompe a leitura de uma conexão para liberar o worker."""
+        try:
+            connection.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+    
+    def server_close(self):
+        """
+        Encerra o servidor drenando as conexões em andamento.
+        
+        Para de aceitar conexões, fecha as conexões keep-alive ociosas,
+        deixa as requisições em andamento terminarem e aguarda os workers
+        por até ``drain_timeout`` segundos no total.
+        """
+        super().server_close()
+        if self.draining:
+            return
+        self.draining = True
+        
+        with self._connections_lock:
+            idle = [conn for conn, busy in self._connections.items() if not busy]
+        for conn in idle:
+            self._close_reading(conn)
         
-        ext = file_path.suffix.lower()
-        return mime_map.get(ext, 'application/octet-stream')
+        for _ in self._threads:
+            self._queue.put(None)
+        # Um prazo único para todos os workers, não um prazo para cada um
+        deadline = time.monotonic() + self.drain_timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
 
 
 class OPDSServer:
     """Servidor HTTP para OPDS."""
     
-    def __init__(self, books_dir, generator, host='0.0.0.0', port=8080):
+    def __init__(self, books_dir, generator, host='0.0.0.0', port=8080,
+                 workers=8, queue_size=32, keepalive_timeout=15, reuse_port=False):
         """
         Inicializa o servidor OPDS.
         
         Args:
-            books_dir: Diretório contendo os livros
+            books_dir: Diretório contendo os livros (a primeira raiz; os
+                       caminhos são resolvidos pelas raízes do gerador)
             generator: Instância do OPDSGenerator
             host: Host para o servidor
             port: Porta para o servidor
+            workers: Número de workers concorrentes (0 = servidor de thread única)
+            queue_size: Máximo de conexões aguardando um worker livre
+            keepalive_timeout: Segundos de inatividade antes de fechar conexões keep-alive
+            reuse_port: Escutar com SO_REUSEPORT (modo multiprocesso; usa sempre
+                        o pool de workers)
         """
         self.books_dir = Path(books_dir)
         self.generator = generator
         self.host = host
         self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.keepalive_timeout = keepalive_timeout
+        self.reuse_port = reuse_port
         
         # Criar handler com contexto
         def handler(*args, **kwargs):
@@ -214,16 +1078,28 @@ class OPDSServer:
         self.handler = handler
         self.httpd = None
     
-    def start(self):
-        """Inicia o servidor HTTP."""
-        self.httpd = HTTPServer((self.host, self.port), self.handler)
+    def start(self, banner=True):
+        """
+        Inicia o servidor HTTP.
         
-        print(f"\nServidor OPDS rodando em http://{self.host}:{self.port}")
-        print(f"Feed OPDS disponível em: http://{self.host}:{self.port}/opds")
-        print("\nNo KOReader:")
-        print(f"  1. Vá em 'Buscar' > 'Catálogo OPDS'")
-        print(f"  2. Adicione novo catálogo com URL: http://[SEU_IP]:{self.port}/opds")
-        print("\nPressione Ctrl+C para encerrar o servidor\n")
+        Args:
+            banner: Exibir o endereço e as instruções de uso ao iniciar
+        """
+        if self.workers > 0 or self.reuse_port:
+            self.httpd = ThreadPoolHTTPServer(
+                (self.host, self.port),
+                self.handler,
+                workers=max(1, self.workers),
+                queue_size=self.queue_size,
+                keepalive_timeout=self.keepalive_timeout,
+                reuse_port=self.reuse_port
+            )
+            self.generator.metrics.collect(self.httpd.connection_metrics)
+        else:
+            self.httpd = HTTPServer((self.host, self.port), self.handler)
+        
+        if banner:
+            self._print_banner()
         
         try:
             self.httpd.serve_forever()
@@ -234,6 +1110,17 @@ class OPDSServer:
                 self.httpd.shutdown()
                 self.httpd.server_close()
     
+    def _print_banner(self):
+        """Exibe o endereço do servidor e as instruções para o KOReader."""
+        print(f"\nServidor OPDS rodando em http://{self.host}:{self.port}")
+        if self.workers > 0:
+            print(f"Workers: {self.workers} | Fila: {self.queue_size} | Keep-alive: {self.keepalive_timeout}s")
+        print(f"Feed OPDS disponível em: http://{self.host}:{self.port}/opds")
+        print("\nNo KOReader:")
+        print(f"  1. Vá em 'Buscar' > 'Catálogo OPDS'")
+        print(f"  2. Adicione novo catálogo com URL: http://[SEU_IP]:{self.port}/opds")
+        print("\nPressione Ctrl+C para encerrar o servidor\n")
+    
     def stop(self):
         """Para o servidor HTTP."""
         if self.httpd:
@@ -0,0 +1,176 @@
+"""
+Snapshot do catálogo em disco para inicialização rápida
+"""
+
+import logging
+import marshal
+import mmap
+import os
+import struct
+
+from opds_catalog import BookRecord
+from opds_scanner import DirectoryState
+
+
+logger = logging.getLogger('opds.snapshot')
+
+
+MAGIC = b'OPDSSNAP'
+CATALOG_MAGIC = b'OPDSCATL'
+
+# Incrementar sempre que o formato dos registros mudar; snapshots de outras
+# versões são ignorados (e substituídos após o próximo escaneamento)
+SNAPSHOT_VERSION = 4
+
+HEADER = struct.Struct('<8sH')
+
+
+def save_snapshot(path, root, directories, fingerprint, updated):
+    """
+    Grava o índice de diretórios do escaneador e os livros em um arquivo.
+
+    O conteúdo é serializado com ``marshal`` (apenas tuplas, strings,
+    números e bytes), o que é rápido de carregar e não executa código como
+    o ``pickle``. A gravação é atômica: um snapshot incompleto nunca
+    substitui o anterior.
+
+    Args:
+        path: Caminho do arquivo de snapshot
+        root: Diretório raiz da biblioteca (validado ao carregar)
+        directories: Índice do escaneador (diretório relativo -> DirectoryState)
+        fingerprint: Impressão digital do catálogo
+        updated: Timestamp da última alteração do catálogo
+    """
+    payload = (
+        str(root),
+        fingerprint,
+        updated,
+        tuple(
+            (
+                relative_dir,
+                state.mtime,
+                tuple(state.subdirs),
+                # Tamanho e mtime já estão nos campos do livro
+                tuple((name, book.fields()) for name, (_, _, book) in state.files.items()),
+            )
+            for relative_dir, state in directories.items()
+        ),
+    )
+
+    path = str(path)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION))
+        f.write(marshal.dumps(payload))
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path, root):
+    """
+    Carrega um snapshot gravado por ``save_snapshot``.
+
+    Args:
+        path: Caminho do arquivo de snapshot
+        root: Diretório raiz esperado da biblioteca
+
+    Returns:
+        Tupla (índice de diretórios, impressão digital, timestamp) ou None se
+        o arquivo não existir, for de outra versão, de outra biblioteca ou
+        estiver corrompido
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning("Não foi possível ler o snapshot do catálogo: %s", e)
+        return None
+
+    if len(data) < HEADER.size:
+        return None
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC or version != SNAPSHOT_VERSION:
+        return None
+
+    try:
+        snapshot_root, fingerprint, updated, entries = marshal.loads(data[HEADER.size:])
+        if snapshot_root != str(root):
+            return None
+        directories = {}
+        for relative_dir, mtime, subdirs, files in entries:
+            records = {}
+            for name, fields in files:
+                book = BookRecord(*fields)
+                records[name] = (book.file_size, book.mtime_ns, book)
+            directories[relative_dir] = DirectoryState(mtime, records, list(subdirs))
+    except (EOFError, ValueError, TypeError) as e:
+        logger.warning("Snapshot do catálogo inválido, ignorando: %s", e)
+        return None
+
+    return directories, fingerprint, updated
+
+
+def save_catalog(path, books, fingerprint, updated, scanning=()):
+    """
+    Publica uma versão do catálogo (apenas os livros) para outros processos.
+
+    Usa o mesmo formato de registros do snapshot. Cada versão é gravada em
+    um arquivo novo que substitui o anterior com ``os.replace``: quem já
+    abriu a versão antiga continua lendo-a intacta, e quem abre depois vê
+    apenas a versão nova completa.
+
+    Args:
+        path: Caminho do arquivo publicado
+        books: Lista de BookRecord
+        fingerprint: Impressão digital do catálogo
+        updated: Timestamp da última alteração do catálogo
+        scanning: Nomes das raízes ainda no primeiro escaneamento
+    """
+    path = str(path)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(CATALOG_MAGIC, SNAPSHOT_VERSION))
+        f.write(marshal.dumps((
+            fingerprint, updated, tuple(scanning), tuple(book.fields() for book in books)
+        )))
+    os.replace(temp_path, path)
+
+
+def load_catalog(path):
+    """
+    Carrega uma versão do catálogo publicada por ``save_catalog``.
+
+    O arquivo é mapeado na memória e decodificado direto do mapeamento,
+    sem uma cópia intermediária do conteúdo.
+
+    Args:
+        path: Caminho do arquivo publicado
+
+    Returns:
+        Tupla (lista de BookRecord, impressão digital, timestamp, raízes no
+        primeiro escaneamento) ou None se o arquivo não existir, for de outra
+        versão ou estiver corrompido
+    """
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if len(mapped) < HEADER.size:
+                    return None
+                magic, version = HEADER.unpack_from(mapped)
+                if magic != CATALOG_MAGIC or version != SNAPSHOT_VERSION:
+                    return None
+                with memoryview(mapped) as view:
+                    fingerprint, updated, scanning, records = marshal.loads(view[HEADER.size:])
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        logger.warning("Catálogo publicado inválido, ignorando: %s", e)
+        return None
+
+    try:
+        books = [BookRecord(*fields) for fields in records]
+    except TypeError as e:
+        logger.warning("Catálogo publicado inválido, ignorando: %s", e)
+        return None
+    return books, fingerprint, updated, scanning
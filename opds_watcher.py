@@ -0,0 +1,281 @@
+"""
+Monitoramento do diretório de livros com inotify (Linux)
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+
+logger = logging.getLogger('opds.watcher')
+
+
+# Constantes de <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class WatchLimitError(Exception):
+    """O limite de watches do inotify (fs.inotify.max_user_watches) foi atingido."""
+
+
+class LibraryWatcher:
+    """
+    Aplica mudanças no catálogo a partir de eventos do inotify.
+
+    Cada diretório de uma raiz da biblioteca recebe um watch. Os eventos
+    apenas marcam diretórios como alterados; depois de ``debounce`` segundos
+    sem novos eventos (ou ``max_delay`` segundos desde o primeiro), somente
+    esses diretórios são listados novamente via ``generator.refresh``.
+    Cada raiz tem o próprio monitor.
+    """
+
+    def __init__(self, generator, debounce=2.0, max_delay=30.0, library=None):
+        """
+        Inicializa o monitor.
+
+        Args:
+            generator: Instância do OPDSGenerator
+            debounce: Segundos sem eventos antes de aplicar as mudanças
+            max_delay: Espera máxima, em segundos, durante rajadas de eventos
+            library: Nome da raiz monitorada (padrão: a primeira)
+        """
+        root = generator.get_library(library)
+        self.generator = generator
+        self.library = root.name
+        self.root = str(root.path)
+        self.skip = root.scanner.skip
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._libc = None
+        self._fd = None
+        self._watches = {}  # wd -> diretório relativo
+        self._paths = {}    # diretório relativo -> wd
+
+    @staticmethod
+    def is_supported():
+        """Retorna True se o inotify estiver disponível nesta plataforma."""
+        if not hasattr(os, 'uname') or os.uname().sysname != 'Linux':
+            return False
+        libc_name = ctypes.util.find_library('c')
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+        except OSError:
+            return False
+        return hasattr(libc, 'inotify_init1')
+
+    def start(self):
+        """
+        Cria a instância do inotify e registra os watches da biblioteca.
+
+        Returns:
+            True se o monitoramento foi iniciado, False se for preciso
+            recorrer ao reescaneamento periódico
+        """
+        if not self.is_supported():
+            logger.warning("inotify não disponível nesta plataforma")
+            return False
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            logger.warning("Não foi possível iniciar o inotify: %s", os.strerror(err))
+            return False
+        self._fd = fd
+
+        try:
+            self._watch_tree('')
+        except WatchLimitError:
+            logger.warning("Limite de watches do inotify atingido "
+                           "(aumente fs.inotify.max_user_watches)")
+            self.close()
+            return False
+
+        logger.info("Monitorando %d diretórios de %s com inotify", len(self._watches), self.root)
+        return True
+
+    def close(self):
+        """Libera a instância do inotify."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._watches.clear()
+        self._paths.clear()
+
+    def run(self):
+        """
+        Processa eventos até que o monitoramento deixe de ser possível.
+
+        Retorna apenas se o limite de watches for atingido com a biblioteca
+        já em execução; nesse caso, quem chamou deve voltar ao
+        reescaneamento periódico.
+        """
+        dirty = set()
+        first_event = None
+        full_scan = False
+
+        try:
+            while True:
+                if dirty or full_scan:
+                    elapsed = time.monotonic() - first_event
+                    timeout = max(0.0, min(self.debounce, self.max_delay - elapsed))
+                else:
+                    timeout = None
+
+                readable, _, _ = select.select([self._fd], [], [], timeout)
+
+                if readable:
+                    try:
+                        data = os.read(self._fd, 64 * 1024)
+                    except InterruptedError:
+                        continue
+                    if first_event is None:
+                        first_event = time.monotonic()
+                    full_scan |= self._handle_events(data, dirty)
+                    if time.monotonic() - first_event < self.max_delay:
+                        continue
+
+                if not (dirty or full_scan):
+                    continue
+
+                try:
+                    if full_scan:
+                        logger.warning("Fila do inotify estourou, reescaneando tudo")
+                        self.generator.generate(self.library)
+                    else:
+                        self.generator.refresh(dirty, self.library)
+                except Exception as e:
+                    logger.error("Erro ao aplicar mudanças na biblioteca: %s", e)
+                dirty = set()
+                first_event = None
+                full_scan = False
+        except WatchLimitError:
+            logger.warning("Limite de watches do inotify atingido, voltando ao reescaneamento periódico")
+            self.close()
+
+    def _handle_events(self, data, dirty):
+        """
+        Interpreta um bloco de eventos do inotify.
+
+        Args:
+            data: Bytes lidos do descritor do inotify
+            dirty: Conjunto de diretórios relativos a serem listados novamente
+
+        Returns:
+            True se eventos foram perdidos e é preciso reescanear tudo
+        """
+        overflow = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].split(b'\0', 1)[0]
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+
+            if mask & IN_IGNORED:
+                self._forget(wd)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+
+            dirty.add(directory)
+            if not name or not mask & IN_ISDIR:
+                continue
+
+            child = os.path.join(directory, os.fsdecode(name)) if directory else os.fsdecode(name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(child)
+            elif mask & (IN_MOVED_FROM | IN_DELETE):
+                self._unwatch_tree(child)
+
+        return overflow
+
+    def _watch_tree(self, relative_dir):
+        """
+        Registra watches para um diretório e todos os seus subdiretórios.
+
+        Args:
+            relative_dir: Diretório relativo à raiz ('' para a raiz)
+
+        Raises:
+            WatchLimitError: Se o limite de watches for atingido
+        """
+        stack = [relative_dir]
+        while stack:
+            current = stack.pop()
+            path = os.path.join(self.root, current)
+            if path in self.skip:
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise WatchLimitError()
+                # Diretório removido ou inacessível entre a listagem e o watch
+                continue
+            self._watches[wd] = current
+            self._paths[current] = wd
+
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(os.path.join(current, entry.name) if current else entry.name)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def _unwatch_tree(self, relative_dir):
+        """
+        Remove os watches de um diretório que saiu da biblioteca (ou mudou de lugar).
+
+        Args:
+            relative_dir: Diretório relativo à raiz
+        """
+        prefix = relative_dir + os.sep
+        for path in [p for p in self._paths if p == relative_dir or p.startswith(prefix)]:
+            wd = self._paths.pop(path)
+            self._watches.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _forget(self, wd):
+        """Descarta um watch que o kernel removeu (diretório apagado)."""
+        path = self._watches.pop(wd, None)
+        if path is not None and self._paths.get(path) == wd:
+            del self._paths[path]
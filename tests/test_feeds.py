@@ -0,0 +1,82 @@
+"""
+Testes das rotas dos feeds OPDS servidos por HTTP
+"""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from opds_generator import OPDSGenerator
+from opds_server import OPDSServer
+
+
+COMIC_INFO = (
+    '<?xml version="1.0"?>'
+    '<ComicInfo><Title>Highway to Hell</Title><Writer>AC/DC</Writer></ComicInfo>'
+)
+
+
+class FeedRoutesTest(unittest.TestCase):
+    """Rotas de ``/opds`` com nomes que precisam de codificação na URL."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.library = tempfile.mkdtemp()
+        os.makedirs(os.path.join(cls.library, 'Rock'))
+        with zipfile.ZipFile(os.path.join(cls.library, 'Rock', 'highway.cbz'), 'w') as archive:
+            archive.writestr('ComicInfo.xml', COMIC_INFO)
+
+        cls.generator = OPDSGenerator(cls.library, port=0, metadata_workers=0, covers=False)
+        cls.generator.generate()
+        cls.server = OPDSServer(cls.library, cls.generator, '127.0.0.1', 0, workers=2)
+        cls.thread = threading.Thread(target=cls.server.start, kwargs={'banner': False}, daemon=True)
+        cls.thread.start()
+        while cls.server.httpd is None:
+            time.sleep(0.01)
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.httpd.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.thread.join(5)
+        shutil.rmtree(cls.library, ignore_errors=True)
+
+    def fetch(self, path):
+        """Retorna (status, corpo) de um GET no servidor de teste."""
+        try:
+            with urllib.request.urlopen(self.base_url + path) as response:
+                return response.status, response.read().decode('utf-8')
+        except urllib.error.HTTPError as e:
+            return e.code, ''
+
+    def test_author_with_slash(self):
+        status, body = self.fetch('/opds/categories/Rock')
+        self.assertEqual(status, 200)
+        hrefs = re.findall(r'href="([^"]*/categories/Rock/[^"]*)"', body)
+        self.assertEqual(hrefs, [self.base_url + '/opds/categories/Rock/AC%2FDC'])
+
+        status, body = self.fetch('/opds/categories/Rock/AC%2FDC')
+        self.assertEqual(status, 200)
+        self.assertIn('Highway to Hell', body)
+
+        status, _ = self.fetch('/opds/categories/Rock/AC/DC')
+        self.assertEqual(status, 404)
+
+    def test_author_with_slash_opds2(self):
+        status, body = self.fetch('/opds/v2/categories/Rock/AC%2FDC')
+        self.assertEqual(status, 200)
+        self.assertIn('Highway to Hell', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+Testes das respostas parciais (Range, multipart/byteranges e If-Range)
+"""
+
+import http.client
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from opds_generator import OPDSGenerator
+from opds_server import OPDSRequestHandler, OPDSServer
+
+
+CONTENT = bytes(range(256)) * 40
+
+
+class RangeRequestsTest(unittest.TestCase):
+    """Downloads de ``/books/`` com o cabeçalho Range."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.library = tempfile.mkdtemp()
+        with open(os.path.join(cls.library, 'livro.pdf'), 'wb') as f:
+            f.write(CONTENT)
+
+        cls.generator = OPDSGenerator(cls.library, port=0, metadata_workers=0, covers=False)
+        cls.generator.generate()
+        cls.server = OPDSServer(cls.library, cls.generator, '127.0.0.1', 0, workers=2)
+        cls.thread = threading.Thread(target=cls.server.start, kwargs={'banner': False}, daemon=True)
+        cls.thread.start()
+        while cls.server.httpd is None:
+            time.sleep(0.01)
+        cls.port = cls.server.httpd.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.thread.join(5)
+        shutil.rmtree(cls.library, ignore_errors=True)
+
+    def fetch(self, **headers):
+        """Retorna (status, cabeçalhos, corpo) de um GET do livro de teste."""
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            connection.request('GET', '/books/livro.pdf', headers=headers)
+            response = connection.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            connection.close()
+
+    def parts(self, headers, body):
+        """Separa as partes de um corpo multipart/byteranges."""
+        content_type, _, boundary = headers['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        self.assertTrue(body.endswith(f'\r\n--{boundary}--\r\n'.encode('latin-1')))
+        found = []
+        for chunk in body.split(f'\r\n--{boundary}'.encode('latin-1'))[1:-1]:
+            head, _, data = chunk.partition(b'\r\n\r\n')
+            content_range = [line for line in head.decode('latin-1').split('\r\n')
+                             if line.startswith('Content-Range: ')]
+            found.append((content_range[0][len('Content-Range: '):], data))
+        return found
+
+    def test_full_download(self):
+        status, headers, body = self.fetch()
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(body, CONTENT)
+
+    def test_single_range(self):
+        status, headers, body = self.fetch(Range='bytes=100-199')
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Range'], f'bytes 100-199/{len(CONTENT)}')
+        self.assertEqual(body, CONTENT[100:200])
+
+    def test_suffix_range(self):
+        status, headers, body = self.fetch(Range='bytes=-500')
+        self.assertEqual(status, 206)
+        size = len(CONTENT)
+        self.assertEqual(headers['Content-Range'], f'bytes {size - 500}-{size - 1}/{size}')
+        self.assertEqual(body, CONTENT[-500:])
+
+    def test_suffix_larger_than_file(self):
+        status, headers, body = self.fetch(Range=f'bytes=-{len(CONTENT) * 2}')
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Range'], f'bytes 0-{len(CONTENT) - 1}/{len(CONTENT)}')
+        self.assertEqual(body, CONTENT)
+
+    def test_open_ended_range(self):
+        status, _, body = self.fetch(Range='bytes=10000-')
+        self.assertEqual(status, 206)
+        self.assertEqual(body, CONTENT[10000:])
+
+    def test_end_past_file_is_clamped(self):
+        status, headers, body = self.fetch(Range='bytes=10200-99999')
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Range'], f'bytes 10200-{len(CONTENT) - 1}/{len(CONTENT)}')
+        self.assertEqual(body, CONTENT[10200:])
+
+    def test_unsatisfiable_range(self):
+        status, headers, body = self.fetch(Range=f'bytes={len(CONTENT)}-')
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['Content-Range'], f'bytes */{len(CONTENT)}')
+        self.assertEqual(body, b'')
+
+        status, _, _ = self.fetch(Range=f'bytes={len(CONTENT) + 10}-{len(CONTENT) + 20},-0')
+        self.assertEqual(status, 416)
+
+    def test_unsatisfiable_part_is_skipped(self):
+        status, headers, body = self.fetch(Range=f'bytes=0-9,{len(CONTENT) + 10}-')
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Range'], f'bytes 0-9/{len(CONTENT)}')
+        self.assertEqual(body, CONTENT[:10])
+
+    def test_invalid_range_serves_whole_file(self):
+        for header in ('bytes=20-10', 'bytes=abc', 'items=0-10', 'bytes=-'):
+            with self.subTest(header=header):
+                status, _, body = self.fetch(Range=header)
+                self.assertEqual(status, 200)
+                self.assertEqual(body, CONTENT)
+
+    def test_multiple_ranges(self):
+        status, headers, body = self.fetch(Range='bytes=0-9, 5000-5099, -20')
+        self.assertEqual(status, 206)
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        size = len(CONTENT)
+        self.assertEqual(self.parts(headers, body), [
+            (f'bytes 0-9/{size}', CONTENT[:10]),
+            (f'bytes 5000-5099/{size}', CONTENT[5000:5100]),
+            (f'bytes {size - 20}-{size - 1}/{size}', CONTENT[-20:]),
+        ])
+
+    def test_overlapping_ranges(self):
+        status, headers, body = self.fetch(Range='bytes=0-99,50-149')
+        self.assertEqual(status, 206)
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        size = len(CONTENT)
+        self.assertEqual(self.parts(headers, body), [
+            (f'bytes 0-99/{size}', CONTENT[0:100]),
+            (f'bytes 50-149/{size}', CONTENT[50:150]),
+        ])
+
+    def test_too_many_ranges_serves_whole_file(self):
+        spec = ','.join(f'{i}-{i}' for i in range(OPDSRequestHandler.MAX_RANGES + 1))
+        status, _, body = self.fetch(Range=f'bytes={spec}')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, CONTENT)
+
+    def test_if_range_current_etag(self):
+        _, headers, _ = self.fetch()
+        status, _, body = self.fetch(Range='bytes=0-9', **{'If-Range': headers['ETag']})
+        self.assertEqual(status, 206)
+        self.assertEqual(body, CONTENT[:10])
+
+    def test_if_range_current_date(self):
+        _, headers, _ = self.fetch()
+        status, _, body = self.fetch(Range='bytes=0-9', **{'If-Range': headers['Last-Modified']})
+        self.assertEqual(status, 206)
+        self.assertEqual(body, CONTENT[:10])
+
+    def test_if_range_stale_validator(self):
+        for validator in ('"0-0"', 'W/"0-0"', 'Thu, 01 Jan 1970 00:00:00 GMT'):
+            with self.subTest(validator=validator):
+                status, headers, body = self.fetch(Range='bytes=0-9', **{'If-Range': validator})
+                self.assertEqual(status, 200)
+                self.assertNotIn('Content-Range', headers)
+                self.assertEqual(body, CONTENT)
+
+
+if __name__ == '__main__':
+    unittest.main()
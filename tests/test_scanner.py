@@ -0,0 +1,329 @@
+"""
+Testes do escaneamento incremental e do reconhecimento de livros movidos
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from opds_catalog import BookRecord
+from opds_scanner import LibraryScanner, ScanDelta, delta_is_empty, partial_hash
+
+
+def make_book(path, relative_path, stat):
+    """Registro mínimo de um livro, com o ID derivado do caminho relativo."""
+    return BookRecord(
+        digest=hashlib.md5(relative_path.encode()).digest(),
+        title=os.path.splitext(os.path.basename(relative_path))[0],
+        authors=['Autor'],
+        category='Categoria',
+        file_path=relative_path,
+        file_size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        extension=os.path.splitext(relative_path)[1].lower(),
+        inode=stat.st_ino,
+        device=stat.st_dev,
+    )
+
+
+class ScannerTestCase(unittest.TestCase):
+    """Base com uma biblioteca temporária."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def write(self, relative_path, content=b'livro'):
+        """Cria (ou sobrescreve) um arquivo da biblioteca."""
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def scanner(self, **options):
+        """Escaneador da biblioteca temporária."""
+        return LibraryScanner(self.root, make_book, {'.epub', '.pdf'}, **options)
+
+    def paths(self, books):
+        """Caminhos relativos de uma lista de livros, ordenados."""
+        return sorted(book.file_path for book in books)
+
+
+class IncrementalScanTest(ScannerTestCase):
+    """ScanDelta de escaneamentos sucessivos (``scan`` e ``refresh``)."""
+
+    def setUp(self):
+        super().setUp()
+        self.write('Ficção/a.epub')
+        self.write('Ficção/b.pdf')
+        self.write('Técnicos/Python/c.epub')
+        self.write('Técnicos/notas.txt')
+
+    def test_first_scan_adds_everything(self):
+        books, delta = self.scanner().scan()
+        expected = ['Ficção/a.epub', 'Ficção/b.pdf', 'Técnicos/Python/c.epub']
+        self.assertEqual(self.paths(books), expected)
+        self.assertEqual(self.paths(delta.added), expected)
+        self.assertEqual((delta.removed, delta.modified), ([], []))
+
+    def test_unchanged_scan_is_empty(self):
+        scanner = self.scanner()
+        books, _ = scanner.scan()
+        again, delta = scanner.scan()
+        self.assertTrue(delta_is_empty(delta))
+        # Os registros inalterados são os mesmos objetos
+        self.assertEqual({id(book) for book in again}, {id(book) for book in books})
+
+    def test_added_and_removed_files(self):
+        scanner = self.scanner()
+        scanner.scan()
+        self.write('Ficção/d.epub')
+        os.remove(os.path.join(self.root, 'Ficção', 'b.pdf'))
+
+        books, delta = scanner.scan()
+        self.assertEqual(self.paths(delta.added), ['Ficção/d.epub'])
+        self.assertEqual(self.paths(delta.removed), ['Ficção/b.pdf'])
+        self.assertEqual(delta.modified, [])
+        self.assertEqual(self.paths(books), ['Ficção/a.epub', 'Ficção/d.epub', 'Técnicos/Python/c.epub'])
+
+    def test_modified_file_keeps_id(self):
+        scanner = self.scanner()
+        books, _ = scanner.scan()
+        old = next(book for book in books if book.file_path == 'Ficção/a.epub')
+        # Remover e recriar muda o mtime do diretório, que é listado de novo
+        os.remove(os.path.join(self.root, 'Ficção', 'a.epub'))
+        self.write('Ficção/a.epub', b'livro alterado')
+
+        _, delta = scanner.scan()
+        self.assertEqual((delta.added, delta.removed), ([], []))
+        self.assertEqual(len(delta.modified), 1)
+        before, after = delta.modified[0]
+        self.assertIs(before, old)
+        self.assertEqual(after.file_size, len(b'livro alterado'))
+        self.assertEqual(after.digest, old.digest)
+
+    def test_in_place_change_found_by_periodic_full_scan(self):
+        scanner = self.scanner(verify_every=3)
+        scanner.scan()
+        directory = os.path.join(self.root, 'Ficção')
+        mtime = os.stat(directory).st_mtime_ns
+        path = self.write('Ficção/a.epub', b'conteudo maior')
+        # Escrever no arquivo não muda o diretório; fixar o mtime para garantir
+        os.utime(directory, ns=(mtime, mtime))
+
+        _, delta = scanner.scan()   # escaneamento 2: diretório inalterado, não listado
+        self.assertTrue(delta_is_empty(delta))
+        _, delta = scanner.scan()   # escaneamento 3: ainda não é a vez da listagem completa
+        self.assertTrue(delta_is_empty(delta))
+        _, delta = scanner.scan()   # escaneamento 4: lista todos os diretórios
+        self.assertEqual([new.file_path for _, new in delta.modified], ['Ficção/a.epub'])
+        self.assertEqual(delta.modified[0][1].file_size, os.path.getsize(path))
+
+    def test_full_scan_disabled(self):
+        scanner = self.scanner(verify_every=0)
+        scanner.scan()
+        directory = os.path.join(self.root, 'Ficção')
+        mtime = os.stat(directory).st_mtime_ns
+        self.write('Ficção/a.epub', b'conteudo maior')
+        os.utime(directory, ns=(mtime, mtime))
+        for _ in range(5):
+            _, delta = scanner.scan()
+            self.assertTrue(delta_is_empty(delta))
+
+    def test_deleted_directory_removes_subtree(self):
+        scanner = self.scanner()
+        scanner.scan()
+        shutil.rmtree(os.path.join(self.root, 'Técnicos'))
+
+        books, delta = scanner.scan()
+        self.assertEqual(self.paths(delta.removed), ['Técnicos/Python/c.epub'])
+        self.assertEqual((delta.added, delta.modified), ([], []))
+        self.assertNotIn('Técnicos', scanner.directories())
+        self.assertNotIn(os.path.join('Técnicos', 'Python'), scanner.directories())
+        self.assertEqual(self.paths(books), ['Ficção/a.epub', 'Ficção/b.pdf'])
+
+    def test_directory_vanishing_during_listing(self):
+        scanner = self.scanner()
+        scanner.scan()
+        previous = scanner.directories()['Ficção']
+        # O diretório some entre o stat do pai e a listagem
+        shutil.rmtree(os.path.join(self.root, 'Ficção'))
+
+        delta = ScanDelta([], [], [])
+        state = scanner._scan_directory('Ficção', previous.mtime + 1, previous, False, delta)
+        self.assertEqual(state.files, {})
+        self.assertEqual(self.paths(delta.removed), ['Ficção/a.epub', 'Ficção/b.pdf'])
+
+    def test_new_directory(self):
+        scanner = self.scanner()
+        scanner.scan()
+        self.write('Novos/Sub/e.pdf')
+
+        _, delta = scanner.scan()
+        self.assertEqual(self.paths(delta.added), ['Novos/Sub/e.pdf'])
+
+    def test_refresh_lists_only_given_directories(self):
+        scanner = self.scanner()
+        scanner.scan()
+        self.write('Ficção/d.epub')
+        self.write('Técnicos/Python/f.epub')
+
+        books, delta = scanner.refresh(['Ficção'])
+        self.assertEqual(self.paths(delta.added), ['Ficção/d.epub'])
+        self.assertNotIn('Técnicos/Python/f.epub', self.paths(books))
+
+        _, delta = scanner.refresh([os.path.join('Técnicos', 'Python')])
+        self.assertEqual(self.paths(delta.added), ['Técnicos/Python/f.epub'])
+
+    def test_refresh_of_deleted_directory(self):
+        scanner = self.scanner()
+        scanner.scan()
+        shutil.rmtree(os.path.join(self.root, 'Técnicos'))
+
+        _, delta = scanner.refresh(['Técnicos'])
+        self.assertEqual(self.paths(delta.removed), ['Técnicos/Python/c.epub'])
+
+    def test_parallel_scan_matches_serial(self):
+        for index in range(20):
+            self.write(f'Lote/{index % 4}/livro{index}.epub')
+        serial, serial_delta = self.scanner().scan()
+        parallel, parallel_delta = self.scanner(workers=4).scan()
+        self.assertEqual([book.file_path for book in parallel], [book.file_path for book in serial])
+        self.assertEqual(self.paths(parallel_delta.added), self.paths(serial_delta.added))
+
+
+class MoveDetectionTest(ScannerTestCase):
+    """Livros movidos ou renomeados mantêm o ID (``_match_moves``)."""
+
+    def test_rename_keeps_id(self):
+        self.write('Ficção/a.epub')
+        scanner = self.scanner()
+        books, _ = scanner.scan()
+        old = books[0]
+        os.rename(os.path.join(self.root, 'Ficção', 'a.epub'), os.path.join(self.root, 'Ficção', 'b.epub'))
+
+        books, delta = scanner.scan()
+        self.assertEqual((delta.added, delta.removed), ([], []))
+        self.assertEqual(len(delta.modified), 1)
+        before, after = delta.modified[0]
+        self.assertIs(before, old)
+        self.assertEqual(after.file_path, 'Ficção/b.epub')
+        self.assertEqual(after.digest, old.digest)
+
+    def test_move_between_directories_keeps_id(self):
+        self.write('Ficção/a.epub')
+        os.makedirs(os.path.join(self.root, 'Outra'))
+        scanner = self.scanner()
+        old = scanner.scan()[0][0]
+        os.rename(os.path.join(self.root, 'Ficção', 'a.epub'), os.path.join(self.root, 'Outra', 'a.epub'))
+
+        books, delta = scanner.scan()
+        self.assertEqual([new.file_path for _, new in delta.modified], ['Outra/a.epub'])
+        self.assertEqual(books[0].digest, old.digest)
+
+    def test_refresh_detects_move(self):
+        self.write('Ficção/a.epub')
+        os.makedirs(os.path.join(self.root, 'Outra'))
+        scanner = self.scanner()
+        old = scanner.scan()[0][0]
+        os.rename(os.path.join(self.root, 'Ficção', 'a.epub'), os.path.join(self.root, 'Outra', 'a.epub'))
+
+        _, delta = scanner.refresh(['Ficção', 'Outra'])
+        self.assertEqual((delta.added, delta.removed), ([], []))
+        self.assertEqual(delta.modified[0][1].digest, old.digest)
+
+    def test_new_file_at_old_path_gets_new_id(self):
+        self.write('Ficção/a.epub')
+        scanner = self.scanner()
+        old = scanner.scan()[0][0]
+        os.rename(os.path.join(self.root, 'Ficção', 'a.epub'), os.path.join(self.root, 'Ficção', 'b.epub'))
+        scanner.scan()
+        self.write('Ficção/a.epub', b'outro livro')
+
+        books, delta = scanner.scan()
+        self.assertEqual(self.paths(delta.added), ['Ficção/a.epub'])
+        digests = [book.digest for book in books]
+        self.assertEqual(len(set(digests)), 2)
+        moved = next(book for book in books if book.file_path == 'Ficção/b.epub')
+        self.assertEqual(moved.digest, old.digest)
+
+    def copy_as_new_inode(self, source, target):
+        """Recria o arquivo em outro caminho (novo inode) e apaga o original."""
+        with open(os.path.join(self.root, source), 'rb') as f:
+            content = f.read()
+        self.write(target, content)
+        os.remove(os.path.join(self.root, source))
+
+    def test_copy_without_content_hash_is_add_and_remove(self):
+        self.write('Ficção/a.epub', b'x' * 50000)
+        scanner = self.scanner()
+        scanner.scan()
+        self.copy_as_new_inode('Ficção/a.epub', 'Outra/a.epub')
+
+        _, delta = scanner.scan()
+        self.assertEqual(self.paths(delta.added), ['Outra/a.epub'])
+        self.assertEqual(self.paths(delta.removed), ['Ficção/a.epub'])
+        self.assertEqual(delta.modified, [])
+
+    def test_copy_with_content_hash_keeps_id(self):
+        self.write('Ficção/a.epub', b'x' * 50000)
+        self.write('Ficção/b.epub', b'y' * 50000)
+        scanner = self.scanner(content_hash=True)
+        books, _ = scanner.scan()
+        old = next(book for book in books if book.file_path == 'Ficção/a.epub')
+        self.assertIsNotNone(old.content_hash)
+        self.copy_as_new_inode('Ficção/a.epub', 'Outra/a.epub')
+
+        _, delta = scanner.scan()
+        self.assertEqual((delta.added, delta.removed), ([], []))
+        self.assertEqual(len(delta.modified), 1)
+        before, after = delta.modified[0]
+        self.assertIs(before, old)
+        self.assertEqual(after.file_path, 'Outra/a.epub')
+        self.assertEqual(after.digest, old.digest)
+
+    def test_content_hash_needs_same_content(self):
+        self.write('Ficção/a.epub', b'x' * 50000)
+        scanner = self.scanner(content_hash=True)
+        scanner.scan()
+        os.remove(os.path.join(self.root, 'Ficção', 'a.epub'))
+        # Mesmo tamanho, fim diferente
+        self.write('Outra/a.epub', b'x' * 49999 + b'z')
+
+        _, delta = scanner.scan()
+        self.assertEqual(self.paths(delta.added), ['Outra/a.epub'])
+        self.assertEqual(self.paths(delta.removed), ['Ficção/a.epub'])
+
+
+class PartialHashTest(ScannerTestCase):
+    """Hash parcial do conteúdo (início, fim e tamanho)."""
+
+    def test_same_content_same_hash(self):
+        first = self.write('a.epub', b'a' * 100000)
+        second = self.write('b.epub', b'a' * 100000)
+        self.assertEqual(partial_hash(first, 100000), partial_hash(second, 100000))
+
+    def test_start_and_end_are_hashed(self):
+        base = self.write('a.epub', b'a' * 100000)
+        start = self.write('b.epub', b'b' + b'a' * 99999)
+        end = self.write('c.epub', b'a' * 99999 + b'b')
+        self.assertNotEqual(partial_hash(base, 100000), partial_hash(start, 100000))
+        self.assertNotEqual(partial_hash(base, 100000), partial_hash(end, 100000))
+
+    def test_small_file(self):
+        path = self.write('a.epub', b'curto')
+        self.assertEqual(partial_hash(path, 5), partial_hash(path, 5))
+        self.assertIsNotNone(partial_hash(path, 5))
+
+    def test_missing_file(self):
+        self.assertIsNone(partial_hash(os.path.join(self.root, 'nada.epub'), 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
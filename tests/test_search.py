@@ -0,0 +1,165 @@
+"""
+Testes do índice invertido da busca
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from opds_catalog import BookRecord
+from opds_scanner import ScanDelta
+from opds_search import PREFIX_FACTOR, SearchIndex, normalize, tokenize
+
+
+def make_book(file_path, title, author='Desconhecido', category='Geral'):
+    """Registro de um livro com o ID derivado do caminho."""
+    return BookRecord(
+        digest=hashlib.md5(file_path.encode()).digest(),
+        title=title,
+        authors=[author],
+        category=category,
+        file_path=file_path,
+        file_size=1,
+        mtime_ns=0,
+        extension=os.path.splitext(file_path)[1],
+    )
+
+
+FOUNDATION = make_book('Ficção/Asimov/fundacao.epub', 'Fundação', 'Isaac Asimov', 'Ficção')
+ROBOTS = make_book('Ficção/Asimov/robos.epub', 'Eu, Robô', 'Isaac Asimov', 'Ficção')
+PYTHON = make_book('Técnicos/Luciano/python.pdf', 'Python Fluente', 'Luciano Ramalho', 'Técnicos')
+
+
+class TokenizeTest(unittest.TestCase):
+    """Normalização dos termos."""
+
+    def test_accents_and_case(self):
+        self.assertEqual(normalize('Ação É'), 'acao e')
+        self.assertEqual(tokenize('Eu, Robô! (2ª edição)'), ['eu', 'robo', '2a', 'edicao'])
+
+
+class SearchIndexTest(unittest.TestCase):
+    """Busca, pesos e atualização incremental."""
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.rebuild([FOUNDATION, ROBOTS, PYTHON])
+
+    def ids(self, query):
+        """IDs encontrados por uma busca, na ordem da pontuação."""
+        return [book_id for _, book_id in self.index.search(query)]
+
+    def assertTermsSorted(self):
+        """A lista de termos continua ordenada e igual às postings."""
+        self.assertEqual(self.index._terms, sorted(self.index._postings))
+
+    def test_exact_match_ignores_accents(self):
+        self.assertEqual(self.ids('fundacao'), [FOUNDATION.digest])
+        self.assertEqual(self.ids('FUNDAÇÃO'), [FOUNDATION.digest])
+
+    def test_empty_query(self):
+        self.assertEqual(self.index.search(''), [])
+        self.assertEqual(self.index.search('  ,; '), [])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(sorted(self.ids('asimov')), sorted([FOUNDATION.digest, ROBOTS.digest]))
+        self.assertEqual(self.ids('asimov robo'), [ROBOTS.digest])
+        self.assertEqual(self.ids('asimov python'), [])
+
+    def test_prefix_match(self):
+        self.assertEqual(self.ids('fund'), [FOUNDATION.digest])
+        self.assertEqual(self.ids('pyth flu'), [PYTHON.digest])
+        self.assertEqual(self.ids('fundacaox'), [])
+
+    def test_prefix_scores_less_than_exact(self):
+        exact = self.index.search('python')
+        prefix = self.index.search('pyth')
+        self.assertEqual(exact, [(8, PYTHON.digest)])
+        self.assertEqual(prefix, [(8 * PREFIX_FACTOR, PYTHON.digest)])
+
+    def test_short_terms_match_only_exactly(self):
+        self.assertEqual(self.ids('e'), [])
+        self.assertEqual(self.ids('eu'), [ROBOTS.digest])
+
+    def test_field_weights(self):
+        # "ficcao" está na categoria e no caminho: vale o maior peso (categoria)
+        self.assertEqual(self.index.search('ficcao')[0][0], 2)
+        # "luciano" está no autor e no caminho
+        self.assertEqual(self.index.search('luciano'), [(4, PYTHON.digest)])
+        # "tecnicos" está na categoria
+        self.assertEqual(self.index.search('tecnicos'), [(2, PYTHON.digest)])
+
+    def test_ranking_by_field(self):
+        in_title = make_book('a/x.epub', 'Duna', 'Frank Herbert')
+        in_author = make_book('b/y.epub', 'Messias', 'Duna Autor')
+        in_category = make_book('c/z.epub', 'Filhos', 'Outro', 'Duna')
+        in_path = make_book('duna/w.epub', 'Imperador', 'Outro')
+        index = SearchIndex()
+        index.rebuild([in_path, in_category, in_author, in_title])
+        self.assertEqual(index.search('duna'), [
+            (8, in_title.digest), (4, in_author.digest), (2, in_category.digest), (1, in_path.digest),
+        ])
+
+    def test_scores_add_up_across_terms(self):
+        self.assertEqual(self.index.search('python luciano'), [(8 + 4, PYTHON.digest)])
+
+    def test_update_added(self):
+        dune = make_book('Ficção/Herbert/duna.epub', 'Duna', 'Frank Herbert', 'Ficção')
+        self.index.update(ScanDelta([dune], [], []))
+        self.assertEqual(self.ids('duna'), [dune.digest])
+        self.assertEqual(self.ids('herb'), [dune.digest])
+        self.assertEqual(len(self.index), 4)
+        self.assertTermsSorted()
+
+    def test_update_removed(self):
+        self.index.update(ScanDelta([], [PYTHON], []))
+        self.assertEqual(self.ids('python'), [])
+        # Os termos que só o livro removido tinha saem também da busca por prefixo
+        self.assertEqual(self.ids('pyth'), [])
+        self.assertNotIn('fluente', self.index._postings)
+        self.assertEqual(len(self.index), 2)
+        self.assertTermsSorted()
+
+    def test_update_modified(self):
+        renamed = make_book(PYTHON.file_path, 'Python Avançado', 'Luciano Ramalho', 'Técnicos')
+        self.index.update(ScanDelta([], [], [(PYTHON, renamed)]))
+        self.assertEqual(self.ids('avancado'), [PYTHON.digest])
+        self.assertEqual(self.ids('fluente'), [])
+        self.assertEqual(self.ids('python'), [PYTHON.digest])
+        self.assertEqual(len(self.index), 3)
+        self.assertTermsSorted()
+
+    def test_update_with_many_new_terms(self):
+        # Muitos termos novos de uma vez: a lista é reordenada por inteiro
+        books = [make_book(f'Lote/{i}.epub', f'Volume{i} Tomo{i}') for i in range(50)]
+        self.index.update(ScanDelta(books, [], []))
+        self.assertEqual(self.ids('volume7'), [books[7].digest])
+        self.assertEqual(len(self.ids('volume1')), 11)
+        self.assertTermsSorted()
+
+    def test_rebuild_replaces_everything(self):
+        self.index.rebuild([PYTHON])
+        self.assertEqual(self.ids('asimov'), [])
+        self.assertEqual(self.ids('python'), [PYTHON.digest])
+        self.assertTermsSorted()
+
+    def test_invalidate_blocks_search_until_rebuild(self):
+        self.index.invalidate()
+        results = []
+        searcher = threading.Thread(target=lambda: results.append(self.ids('duna')))
+        searcher.start()
+        searcher.join(0.1)
+        self.assertTrue(searcher.is_alive())
+
+        dune = make_book('x/duna.epub', 'Duna')
+        self.index.rebuild([dune])
+        searcher.join(5)
+        self.assertEqual(results, [[dune.digest]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Testes do snapshot do catálogo e do catálogo publicado
+"""
+
+import hashlib
+import marshal
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from opds_catalog import BookRecord
+from opds_scanner import DirectoryState
+from opds_snapshot import (
+    CATALOG_MAGIC, HEADER, MAGIC, SNAPSHOT_VERSION,
+    load_catalog, load_snapshot, save_catalog, save_snapshot,
+)
+
+
+def make_book(file_path, **fields):
+    """Registro de um livro com o ID derivado do caminho."""
+    return BookRecord(
+        digest=hashlib.md5(file_path.encode()).digest(),
+        title=os.path.splitext(os.path.basename(file_path))[0],
+        authors=['Autor Um', 'Autor Dois'],
+        category=os.path.dirname(file_path) or 'Sem Categoria',
+        file_path=file_path,
+        file_size=1234,
+        mtime_ns=1700000000123456789,
+        extension=os.path.splitext(file_path)[1],
+        **fields
+    )
+
+
+class SnapshotTest(unittest.TestCase):
+    """Gravação e leitura do snapshot de uma raiz."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, '.opds_catalog.snapshot')
+        self.root = '/biblioteca'
+
+        first = make_book('Ficção/a.epub', series='Saga', series_index=2.0, language='pt',
+                          description='Sinopse', inode=42, device=7, content_hash=b'\x01' * 16)
+        second = make_book('Ficção/b.cbz', page_count=24)
+        third = make_book('raiz.pdf')
+        self.directories = {
+            '': DirectoryState(10, {'raiz.pdf': (third.file_size, third.mtime_ns, third)}, ['Ficção']),
+            'Ficção': DirectoryState(20, {
+                'a.epub': (first.file_size, first.mtime_ns, first),
+                'b.cbz': (second.file_size, second.mtime_ns, second),
+            }, []),
+        }
+
+    def test_round_trip(self):
+        save_snapshot(self.path, self.root, self.directories, 'abc123', 1700000000.5)
+        loaded = load_snapshot(self.path, self.root)
+        self.assertIsNotNone(loaded)
+        directories, fingerprint, updated = loaded
+        self.assertEqual((fingerprint, updated), ('abc123', 1700000000.5))
+        self.assertEqual(set(directories), set(self.directories))
+        for relative_dir, state in self.directories.items():
+            restored = directories[relative_dir]
+            self.assertEqual(restored.mtime, state.mtime)
+            self.assertEqual(restored.subdirs, state.subdirs)
+            self.assertEqual(set(restored.files), set(state.files))
+            for name, (size, mtime, book) in state.files.items():
+                restored_size, restored_mtime, restored_book = restored.files[name]
+                self.assertEqual((restored_size, restored_mtime), (size, mtime))
+                self.assertEqual(restored_book.fields(), book.fields())
+        # Não sobra arquivo temporário
+        self.assertEqual(os.listdir(self.directory), ['.opds_catalog.snapshot'])
+
+    def test_missing_file(self):
+        self.assertIsNone(load_snapshot(self.path, self.root))
+
+    def test_other_root(self):
+        save_snapshot(self.path, self.root, self.directories, 'abc123', 0)
+        self.assertIsNone(load_snapshot(self.path, '/outra'))
+
+    def test_other_version(self):
+        save_snapshot(self.path, self.root, self.directories, 'abc123', 0)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for version in (SNAPSHOT_VERSION - 1, SNAPSHOT_VERSION + 1):
+            with self.subTest(version=version):
+                with open(self.path, 'wb') as f:
+                    f.write(HEADER.pack(MAGIC, version) + data[HEADER.size:])
+                self.assertIsNone(load_snapshot(self.path, self.root))
+
+    def test_other_magic(self):
+        save_catalog(self.path, [], 'abc123', 0)
+        self.assertIsNone(load_snapshot(self.path, self.root))
+
+    def test_corrupt_files(self):
+        save_snapshot(self.path, self.root, self.directories, 'abc123', 0)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        header = HEADER.pack(MAGIC, SNAPSHOT_VERSION)
+        corrupt = {
+            'vazio': b'',
+            'cabeçalho incompleto': data[:HEADER.size - 1],
+            'truncado': data[:len(data) // 2],
+            'lixo': header + b'\xff' * 64,
+            'outra estrutura': header + marshal.dumps(('/biblioteca', 'abc123')),
+            'registro inválido': header + marshal.dumps(
+                ('/biblioteca', 'abc123', 0, (('', 10, (), (('x.epub', ('curto',)),)),))
+            ),
+        }
+        for label, content in corrupt.items():
+            with self.subTest(label):
+                with open(self.path, 'wb') as f:
+                    f.write(content)
+                self.assertIsNone(load_snapshot(self.path, self.root))
+
+
+class PublishedCatalogTest(unittest.TestCase):
+    """Catálogo publicado para os processos de atendimento."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, '.opds_catalog.published')
+
+    def test_round_trip(self):
+        books = [make_book('a.epub', page_count=3), make_book('b/c.pdf', library='hq')]
+        save_catalog(self.path, books, 'abc123', 1700000000.5, ('hq',))
+        loaded_books, fingerprint, updated, scanning = load_catalog(self.path)
+        self.assertEqual([book.fields() for book in loaded_books], [book.fields() for book in books])
+        self.assertEqual((fingerprint, updated, scanning), ('abc123', 1700000000.5, ('hq',)))
+
+    def test_rejected_files(self):
+        save_catalog(self.path, [make_book('a.epub')], 'abc123', 0)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        rejected = {
+            'outra versão': HEADER.pack(CATALOG_MAGIC, SNAPSHOT_VERSION + 1) + data[HEADER.size:],
+            'snapshot': HEADER.pack(MAGIC, SNAPSHOT_VERSION) + data[HEADER.size:],
+            'truncado': data[:len(data) // 2],
+            'cabeçalho incompleto': data[:3],
+        }
+        for label, content in rejected.items():
+            with self.subTest(label):
+                with open(self.path, 'wb') as f:
+                    f.write(content)
+                self.assertIsNone(load_catalog(self.path))
+
+    def test_missing_file(self):
+        self.assertIsNone(load_catalog(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()